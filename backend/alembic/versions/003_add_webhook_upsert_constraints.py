@@ -0,0 +1,37 @@
+"""add webhook upsert constraints
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Conflict targets for the batched webhook upserts
+    op.create_unique_constraint(
+        'uq_contacts_account_instagram_user',
+        'contacts',
+        ['instagram_account_id', 'instagram_user_id']
+    )
+
+    # At most one open conversation per contact. The status column stores
+    # ConversationStatus member names.
+    op.create_index(
+        'uq_conversations_open_contact',
+        'conversations',
+        ['instagram_account_id', 'contact_id'],
+        unique=True,
+        postgresql_where=sa.text("status = 'OPEN'")
+    )
+
+def downgrade():
+    op.drop_index('uq_conversations_open_contact', table_name='conversations')
+    op.drop_constraint('uq_contacts_account_instagram_user', 'contacts', type_='unique')
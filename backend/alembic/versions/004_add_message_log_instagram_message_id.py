@@ -0,0 +1,31 @@
+"""add message_logs.instagram_message_id
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Instagram mid of inbound events, unique so redelivered webhooks
+    # cannot be logged twice
+    op.add_column('message_logs', sa.Column('instagram_message_id', sa.String(), nullable=True))
+    op.create_index(
+        'uq_message_logs_instagram_message_id',
+        'message_logs',
+        ['instagram_message_id'],
+        unique=True,
+        postgresql_where=sa.text("instagram_message_id IS NOT NULL")
+    )
+
+def downgrade():
+    op.drop_index('uq_message_logs_instagram_message_id', table_name='message_logs')
+    op.drop_column('message_logs', 'instagram_message_id')
@@ -0,0 +1,23 @@
+"""add trigger matching rules
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('triggers', sa.Column('priority', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('triggers', sa.Column('match_whole_word', sa.Boolean(), nullable=False, server_default='false'))
+
+def downgrade():
+    op.drop_column('triggers', 'match_whole_word')
+    op.drop_column('triggers', 'priority')
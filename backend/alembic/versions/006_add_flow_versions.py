@@ -0,0 +1,89 @@
+"""add flow versions
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+import hashlib
+import json
+import uuid
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+def definition_hash(flow_definition):
+    # Same bytes as app.services.flow_compiler.definition_hash (sorted
+    # keys, no whitespace, UTF-8), kept here so the migration does not
+    # depend on application code
+    encoded = json.dumps(flow_definition, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def upgrade():
+    op.create_table(
+        'flow_versions',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('flow_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(64), nullable=False),
+        sa.Column('flow_definition', postgresql.JSONB(), nullable=False),
+        sa.Column('created_at', sa.DateTime()),
+        sa.ForeignKeyConstraint(['flow_id'], ['flows.id'], ondelete='CASCADE'),
+        sa.UniqueConstraint('flow_id', 'content_hash', name='uq_flow_versions_flow_content_hash')
+    )
+    op.create_index('ix_flow_versions_content_hash', 'flow_versions', ['content_hash'])
+
+    op.add_column('flows', sa.Column('current_version_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_foreign_key(
+        'fk_flows_current_version_id', 'flows', 'flow_versions',
+        ['current_version_id'], ['id'], ondelete='SET NULL'
+    )
+    op.add_column('contacts', sa.Column('current_flow_version_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_foreign_key(
+        'fk_contacts_current_flow_version_id', 'contacts', 'flow_versions',
+        ['current_flow_version_id'], ['id'], ondelete='SET NULL'
+    )
+
+    # Existing definitions become version 1 of their flow, and contacts in
+    # a flow are pinned to it.
+    connection = op.get_bind()
+    flows = connection.execute(sa.text("SELECT id, flow_definition FROM flows")).fetchall()
+    now = datetime.utcnow()
+    for flow_id, flow_definition in flows:
+        version_id = uuid.uuid4()
+        connection.execute(
+            sa.text(
+                "INSERT INTO flow_versions (id, flow_id, version, content_hash, flow_definition, created_at) "
+                "VALUES (:id, :flow_id, 1, :content_hash, :flow_definition, :created_at)"
+            ).bindparams(sa.bindparam('flow_definition', type_=postgresql.JSONB())),
+            {
+                "id": version_id,
+                "flow_id": flow_id,
+                "content_hash": definition_hash(flow_definition),
+                "flow_definition": flow_definition,
+                "created_at": now,
+            }
+        )
+        connection.execute(
+            sa.text("UPDATE flows SET current_version_id = :version_id WHERE id = :flow_id"),
+            {"version_id": version_id, "flow_id": flow_id}
+        )
+    connection.execute(sa.text(
+        "UPDATE contacts SET current_flow_version_id = flows.current_version_id "
+        "FROM flows WHERE contacts.current_flow_id = flows.id"
+    ))
+
+def downgrade():
+    op.drop_constraint('fk_contacts_current_flow_version_id', 'contacts', type_='foreignkey')
+    op.drop_column('contacts', 'current_flow_version_id')
+    op.drop_constraint('fk_flows_current_version_id', 'flows', type_='foreignkey')
+    op.drop_column('flows', 'current_version_id')
+    op.drop_index('ix_flow_versions_content_hash', table_name='flow_versions')
+    op.drop_table('flow_versions')
@@ -0,0 +1,20 @@
+"""add instagram account token expiry index
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_instagram_accounts_token_expires_at', 'instagram_accounts', ['token_expires_at'])
+
+def downgrade():
+    op.drop_index('ix_instagram_accounts_token_expires_at', table_name='instagram_accounts')
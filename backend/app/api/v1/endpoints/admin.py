@@ -1,4 +1,5 @@
-from typing import List
+from typing import List, Optional
+import uuid
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.api.deps import get_db
@@ -6,6 +7,11 @@ from app.core.auth import get_current_admin_user
 from app.models.user import User
 from app.models.subscription_plan import SubscriptionPlan
 from app.schemas.admin import UserResponse, SubscriptionPlanResponse, UserStatusUpdate
+from app.services.flow_metrics import flow_metrics
+from app.services.graph_concurrency import graph_concurrency
+from app.services.graph_response_cache import graph_response_cache
+from app.services.rate_limiter import graph_rate_limiter
+from app.services.webhook_dedup import webhook_deduplicator
 
 router = APIRouter()
 
@@ -89,4 +95,53 @@ async def delete_subscription_plan(
 
     db.delete(db_plan)
     db.commit()
-    return {"message": "Subscription plan deleted"} 
\ No newline at end of file
+    return {"message": "Subscription plan deleted"} 
+
+@router.get("/webhooks/dedup-stats")
+async def get_webhook_dedup_stats(
+    hours: int = 24,
+    current_admin = Depends(get_current_admin_user)
+):
+    """Get webhook event and duplicate counts (admin only)."""
+    return await webhook_deduplicator.get_stats(hours=hours)
+
+@router.get("/flows/metrics")
+async def get_flow_metrics(
+    minutes: int = 60,
+    flow_id: Optional[uuid.UUID] = None,
+    current_admin = Depends(get_current_admin_user)
+):
+    """Get flow node, event and send latencies across all processes (admin only)."""
+    return await flow_metrics.get_summary(minutes=minutes, flow_id=flow_id)
+
+@router.get("/graph/rate-limits")
+async def get_graph_rate_limits(
+    instagram_user_id: Optional[str] = None,
+    current_admin = Depends(get_current_admin_user)
+):
+    """
+    Get this process's Graph API rate limiter waits and timeouts, and the
+    budget left for an account (admin only).
+    """
+    result = {"stats": graph_rate_limiter.get_stats()}
+    if instagram_user_id:
+        result["remaining"] = await graph_rate_limiter.remaining(instagram_user_id)
+    return result
+
+@router.get("/graph/concurrency")
+async def get_graph_concurrency(
+    instagram_user_id: Optional[str] = None,
+    current_admin = Depends(get_current_admin_user)
+):
+    """
+    Get this process's adaptive Graph API concurrency limits and the usage
+    they follow (admin only).
+    """
+    return graph_concurrency.get_stats(instagram_user_id)
+
+@router.get("/graph/cache")
+async def get_graph_cache(current_admin = Depends(get_current_admin_user)):
+    """
+    Get this process's Graph API response cache hit counts and size (admin only).
+    """
+    return graph_response_cache.get_stats()
@@ -1,5 +1,5 @@
 from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from app.core.auth import get_current_user
 from app.db.session import get_db
@@ -7,7 +7,8 @@ from app.models.user import User
 from app.models.contact import Contact
 from app.models.instagram_account import InstagramAccount
 from app.schemas.contact import ContactCreate, ContactUpdate, ContactResponse
-from app.services.instagram import InstagramService
+from app.services.flow_state import flow_state_store
+from app.services.profile_enrichment import enqueue_profile_enrichment
 
 router = APIRouter()
 
@@ -16,10 +17,13 @@ def create_contact(
     *,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
-    contact_in: ContactCreate
+    contact_in: ContactCreate,
+    background_tasks: BackgroundTasks
 ) -> Any:
     """
     Create new contact.
+
+    Missing profile fields are filled in by the profile enrichment worker.
     """
     # Check if user has access to the Instagram account
     account = db.query(InstagramAccount).filter(
@@ -42,18 +46,12 @@ def create_contact(
             detail="Contact already exists",
         )
     
-    # Get contact profile from Instagram
-    instagram_service = InstagramService()
-    profile = instagram_service.get_profile(account, contact_in.instagram_user_id)
-    
-    contact = Contact(
-        **contact_in.dict(),
-        first_name=profile.get("name"),
-        profile_picture_url=profile.get("profile_pic")
-    )
+    contact = Contact(**contact_in.dict())
     db.add(contact)
     db.commit()
     db.refresh(contact)
+
+    background_tasks.add_task(enqueue_profile_enrichment, [contact.id])
     return contact
 
 @router.get("/", response_model=List[ContactResponse])
@@ -107,6 +105,7 @@ def read_contact(
 def update_contact(
     *,
     db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     contact_id: str,
     contact_in: ContactUpdate
@@ -139,6 +138,9 @@ def update_contact(
     db.add(contact)
     db.commit()
     db.refresh(contact)
+    if contact_in.tags:
+        # Tags of contacts in a flow live in Redis until written behind
+        background_tasks.add_task(flow_state_store.add_tags, contact.id, contact_in.tags)
     return contact
 
 @router.delete("/{contact_id}")
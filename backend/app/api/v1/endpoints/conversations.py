@@ -1,15 +1,19 @@
+import uuid
+from datetime import datetime
 from typing import Any, List
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from app.core.auth import get_current_user
-from app.db.session import get_db
+from app.db.session import get_async_db, get_db
 from app.models.user import User
 from app.models.conversation import Conversation
 from app.models.message_log import MessageLog
 from app.models.instagram_account import InstagramAccount
 from app.schemas.conversation import ConversationCreate, ConversationUpdate, ConversationResponse
 from app.schemas.message import MessageCreate, MessageResponse
-from app.services.instagram import InstagramService
+from app.services.instagram import instagram_service
 
 router = APIRouter()
 
@@ -144,20 +148,23 @@ def read_messages(
     return messages
 
 @router.post("/{conversation_id}/messages", response_model=MessageResponse)
-def create_message(
+async def create_message(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
-    conversation_id: str,
+    conversation_id: uuid.UUID,
     message_in: MessageCreate
 ) -> Any:
     """
     Send a message in a conversation.
     """
-    conversation = db.query(Conversation).join(InstagramAccount).filter(
-        Conversation.id == conversation_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    # Async session: the send awaits the Graph API on the event loop
+    conversation = await db.scalar(
+        select(Conversation).join(InstagramAccount).where(
+            Conversation.id == conversation_id,
+            InstagramAccount.user_id == current_user.id
+        ).options(selectinload(Conversation.instagram_account), selectinload(Conversation.contact))
+    )
     if not conversation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -165,8 +172,7 @@ def create_message(
         )
     
     # Send message via Instagram API
-    instagram_service = InstagramService()
-    instagram_service.send_message(
+    await instagram_service.send_message(
         account=conversation.instagram_account,
         recipient_id=conversation.contact.instagram_user_id,
         message=message_in.content
@@ -174,16 +180,22 @@ def create_message(
     
     # Log message
     message = MessageLog(
-        conversation_id=conversation_id,
+        id=uuid.uuid4(),
+        instagram_account_id=conversation.instagram_account_id,
+        contact_id=conversation.contact_id,
+        conversation_id=conversation.id,
         direction="outbound",
-        **message_in.dict()
+        type=message_in.type,
+        content=message_in.content,
+        is_automated=message_in.is_automated,
+        flow_id=message_in.flow_id,
+        timestamp=datetime.utcnow()
     )
     db.add(message)
     
     # Update conversation
-    conversation.last_message_id = message.id
+    conversation.last_message = message
     conversation.updated_at = message.timestamp
     
-    db.commit()
-    db.refresh(message)
-    return message 
\ No newline at end of file
+    await db.commit()
+    return message
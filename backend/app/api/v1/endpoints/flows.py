@@ -1,17 +1,21 @@
 from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from app.core.auth import get_current_user
 from app.db.session import get_db
 from app.models.user import User
-from app.models.flow import Flow, Trigger
+from app.models.flow import Flow, FlowVersion, Trigger
 from app.models.instagram_account import InstagramAccount
+from app.services.cache_invalidation import cache_invalidation_bus, invalidate_locally
+from app.services.flow_compiler import CompiledFlow, flow_cache
+from app.services.flow_metrics import flow_metrics
+from app.services.flow_versions import record_flow_version
 from app.schemas.flow import (
     FlowCreate,
     FlowUpdate,
     FlowResponse,
+    FlowVersionResponse,
     TriggerCreate,
-    TriggerUpdate,
     TriggerResponse
 )
 
@@ -40,8 +44,13 @@ def create_flow(
     
     flow = Flow(**flow_in.dict())
     db.add(flow)
+    db.flush()
+    record_flow_version(db, flow)
     db.commit()
     db.refresh(flow)
+    # Compile (message templates included) at save time rather than on
+    # the first message that reaches the flow
+    flow_cache.put(CompiledFlow(flow))
     return flow
 
 @router.get("/", response_model=List[FlowResponse])
@@ -85,6 +94,7 @@ def read_flow(
 def update_flow(
     *,
     db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     flow_id: str,
     flow_in: FlowUpdate
@@ -102,18 +112,112 @@ def update_flow(
             detail="Flow not found",
         )
     
-    for field, value in flow_in.dict(exclude_unset=True).items():
+    update_data = flow_in.dict(exclude_unset=True)
+    for field, value in update_data.items():
         setattr(flow, field, value)
+    # Contacts in the flow stay on the version they started on
+    if "flow_definition" in update_data:
+        record_flow_version(db, flow)
     
     db.add(flow)
     db.commit()
     db.refresh(flow)
+    invalidate_locally(flow.instagram_account_id, [flow.id])
+    flow_cache.put(CompiledFlow(flow))
+    background_tasks.add_task(cache_invalidation_bus.publish, flow.instagram_account_id, [flow.id])
+    return flow
+
+@router.get("/{flow_id}/versions", response_model=List[FlowVersionResponse])
+def read_flow_versions(
+    *,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    flow_id: str
+) -> Any:
+    """
+    Get the version history of a flow, newest first.
+    """
+    flow = db.query(Flow).join(InstagramAccount).filter(
+        Flow.id == flow_id,
+        InstagramAccount.user_id == current_user.id
+    ).first()
+    if not flow:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Flow not found",
+        )
+    return db.query(FlowVersion).filter(
+        FlowVersion.flow_id == flow.id
+    ).order_by(FlowVersion.version.desc()).all()
+
+@router.get("/{flow_id}/metrics")
+async def read_flow_metrics(
+    *,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    flow_id: str,
+    minutes: int = 60
+) -> Any:
+    """
+    Get the latencies and error counts of a flow's nodes, events and sends.
+    """
+    flow = db.query(Flow).join(InstagramAccount).filter(
+        Flow.id == flow_id,
+        InstagramAccount.user_id == current_user.id
+    ).first()
+    if not flow:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Flow not found",
+        )
+    return await flow_metrics.get_summary(minutes=minutes, flow_id=flow.id)
+
+@router.post("/{flow_id}/versions/{version_id}/restore", response_model=FlowResponse)
+def restore_flow_version(
+    *,
+    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    flow_id: str,
+    version_id: str
+) -> Any:
+    """
+    Make an earlier version the flow's current definition.
+    """
+    flow = db.query(Flow).join(InstagramAccount).filter(
+        Flow.id == flow_id,
+        InstagramAccount.user_id == current_user.id
+    ).first()
+    if not flow:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Flow not found",
+        )
+    version = db.query(FlowVersion).filter(
+        FlowVersion.id == version_id,
+        FlowVersion.flow_id == flow.id
+    ).first()
+    if not version:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Flow version not found",
+        )
+
+    flow.flow_definition = version.flow_definition
+    flow.current_version_id = version.id
+    db.add(flow)
+    db.commit()
+    db.refresh(flow)
+    invalidate_locally(flow.instagram_account_id, [flow.id])
+    flow_cache.put(CompiledFlow(flow))
+    background_tasks.add_task(cache_invalidation_bus.publish, flow.instagram_account_id, [flow.id])
     return flow
 
 @router.delete("/{flow_id}")
 def delete_flow(
     *,
     db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     flow_id: str
 ) -> Any:
@@ -130,8 +234,11 @@ def delete_flow(
             detail="Flow not found",
         )
     
+    instagram_account_id = flow.instagram_account_id
     db.delete(flow)
     db.commit()
+    invalidate_locally(instagram_account_id, [flow_id])
+    background_tasks.add_task(cache_invalidation_bus.publish, instagram_account_id, [flow_id])
     return {"message": "Flow deleted successfully"}
 
 # Trigger endpoints
@@ -139,6 +246,7 @@ def delete_flow(
 def create_trigger(
     *,
     db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     flow_id: str,
     trigger_in: TriggerCreate
@@ -156,10 +264,12 @@ def create_trigger(
             detail="Flow not found",
         )
     
-    trigger = Trigger(flow_id=flow_id, **trigger_in.dict())
+    trigger = Trigger(flow_id=flow_id, **trigger_in.dict(exclude={"flow_id"}))
     db.add(trigger)
     db.commit()
     db.refresh(trigger)
+    invalidate_locally(flow.instagram_account_id, [flow.id])
+    background_tasks.add_task(cache_invalidation_bus.publish, flow.instagram_account_id, [flow.id])
     return trigger
 
 @router.get("/{flow_id}/triggers", response_model=List[TriggerResponse])
@@ -1,14 +1,16 @@
-from typing import Any, Dict
+import hashlib
+import hmac
+from typing import Any, Optional
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Request, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
-from app.db.session import get_db
-from app.models.instagram_account import InstagramAccount
-from app.models.contact import Contact
-from app.models.conversation import Conversation
-from app.models.message_log import MessageLog
-from app.services.automation import AutomationEngine
-from app.services.instagram import InstagramService
+from app.db.session import get_async_db
+from app.services.delayed_jobs import delayed_job_scheduler
+from app.services.profile_enrichment import enqueue_profile_enrichment
+from app.services.webhook_dedup import webhook_deduplicator
+from app.services.webhook_processor import process_webhook_payload
+from app.services.webhook_stream import publish_webhook
 
 router = APIRouter()
 
@@ -31,172 +33,63 @@ async def verify_webhook(
 @router.post("/instagram")
 async def handle_webhook(
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Any:
     """
     Handle Instagram webhook events.
+
+    In "stream" ingestion mode the delivery is only appended to Redis and
+    acknowledged; the webhook consumer worker does the processing.
     """
-    payload = await request.json()
-    
+    # Read once: the same bytes are hashed and then decoded
+    raw_body = await request.body()
+
     # Verify webhook signature
-    signature = request.headers.get("X-Hub-Signature")
-    if not signature or not verify_signature(payload, signature):
+    signature = request.headers.get("X-Hub-Signature-256")
+    if not verify_signature(raw_body, signature):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid webhook signature",
         )
-    
-    for entry in payload.get("entry", []):
-        instagram_page_id = entry.get("id")
-        account = db.query(InstagramAccount).filter(
-            InstagramAccount.instagram_page_id == instagram_page_id
-        ).first()
-        if not account:
-            continue
-        
-        for messaging in entry.get("messaging", []):
-            sender_id = messaging.get("sender", {}).get("id")
-            recipient_id = messaging.get("recipient", {}).get("id")
-            
-            # Get or create contact
-            contact = get_or_create_contact(db, account, sender_id)
-            
-            # Get or create conversation
-            conversation = get_or_create_conversation(db, account, contact)
-            
-            # Process message
-            if "message" in messaging:
-                handle_message(db, account, contact, conversation, messaging["message"])
-            
-            # Process postback
-            elif "postback" in messaging:
-                handle_postback(db, account, contact, conversation, messaging["postback"])
-    
-    return {"success": True}
-
-def verify_signature(payload: Dict[str, Any], signature: str) -> bool:
-    """
-    Verify webhook signature using app secret.
-    """
-    # TODO: Implement signature verification
-    return True
 
-def get_or_create_contact(
-    db: Session,
-    account: InstagramAccount,
-    instagram_user_id: str
-) -> Contact:
-    """
-    Get existing contact or create a new one.
-    """
-    contact = db.query(Contact).filter(
-        Contact.instagram_account_id == account.id,
-        Contact.instagram_user_id == instagram_user_id
-    ).first()
-    
-    if not contact:
-        # Get user profile from Instagram
-        instagram_service = InstagramService()
-        profile = instagram_service.get_profile(account, instagram_user_id)
-        
-        contact = Contact(
-            instagram_account_id=account.id,
-            instagram_user_id=instagram_user_id,
-            instagram_username=profile.get("username"),
-            first_name=profile.get("name"),
-            profile_picture_url=profile.get("profile_pic")
+    try:
+        payload = orjson.loads(raw_body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid webhook payload",
         )
-        db.add(contact)
-        db.commit()
-        db.refresh(contact)
-    
-    return contact
 
-def get_or_create_conversation(
-    db: Session,
-    account: InstagramAccount,
-    contact: Contact
-) -> Conversation:
-    """
-    Get active conversation or create a new one.
-    """
-    conversation = db.query(Conversation).filter(
-        Conversation.instagram_account_id == account.id,
-        Conversation.contact_id == contact.id,
-        Conversation.status == "open"
-    ).first()
-    
-    if not conversation:
-        conversation = Conversation(
-            instagram_account_id=account.id,
-            contact_id=contact.id
-        )
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
-    
-    return conversation
+    if settings.WEBHOOK_INGESTION_MODE == "stream":
+        if not await publish_webhook(raw_body, payload):
+            # Let Meta redeliver rather than acknowledging a lost event
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Webhook could not be queued",
+            )
+        return {"success": True}
 
-def handle_message(
-    db: Session,
-    account: InstagramAccount,
-    contact: Contact,
-    conversation: Conversation,
-    message: Dict[str, Any]
-) -> None:
-    """
-    Handle incoming message.
-    """
-    # Log message
-    message_log = MessageLog(
-        instagram_account_id=account.id,
-        contact_id=contact.id,
-        conversation_id=conversation.id,
-        direction="inbound",
-        type="text",
-        content={"text": message.get("text", "")},
-        timestamp=message.get("timestamp")
-    )
-    db.add(message_log)
-    
-    # Update conversation
-    conversation.last_message_id = message_log.id
-    conversation.updated_at = message_log.timestamp
-    
-    db.commit()
-    
-    # Process message with automation engine
-    automation_engine = AutomationEngine(db)
-    automation_engine.process_message(account, contact, message_log)
+    payload = await webhook_deduplicator.drop_duplicates(payload)
+    result = await process_webhook_payload(db, payload)
+    # Only now: a delivery that failed is processed when Meta redelivers it
+    await webhook_deduplicator.mark_seen(payload)
+    await delayed_job_scheduler.schedule_many(result.scheduled_jobs)
+    await enqueue_profile_enrichment(result.new_contact_ids)
+    return {"success": True}
 
-def handle_postback(
-    db: Session,
-    account: InstagramAccount,
-    contact: Contact,
-    conversation: Conversation,
-    postback: Dict[str, Any]
-) -> None:
+def verify_signature(raw_body: bytes, signature: Optional[str]) -> bool:
     """
-    Handle postback from button click.
+    Verify the X-Hub-Signature-256 header against the raw request body
+    using the app secret.
     """
-    # Log postback as message
-    message_log = MessageLog(
-        instagram_account_id=account.id,
-        contact_id=contact.id,
-        conversation_id=conversation.id,
-        direction="inbound",
-        type="button_response",
-        content={"payload": postback.get("payload")},
-        timestamp=postback.get("timestamp")
-    )
-    db.add(message_log)
-    
-    # Update conversation
-    conversation.last_message_id = message_log.id
-    conversation.updated_at = message_log.timestamp
-    
-    db.commit()
-    
-    # Process postback with automation engine
-    automation_engine = AutomationEngine(db)
-    automation_engine.process_postback(account, contact, message_log) 
\ No newline at end of file
+    if not signature or not settings.INSTAGRAM_APP_SECRET:
+        return False
+    algorithm, _, received_digest = signature.partition("=")
+    if algorithm != "sha256" or not received_digest:
+        return False
+    expected_digest = hmac.new(
+        settings.INSTAGRAM_APP_SECRET.encode("utf-8"),
+        raw_body,
+        hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected_digest, received_digest)
@@ -43,17 +43,168 @@ class Settings(BaseSettings):
             path=f"/{values.get('POSTGRES_DB') or ''}",
         )
 
+    # Same database through asyncpg, for AsyncSession users
+    ASYNC_DATABASE_URI: Optional[str] = None
+
+    @validator("ASYNC_DATABASE_URI", pre=True, always=True)
+    def assemble_async_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> str:
+        if isinstance(v, str):
+            return v
+        return values.get("DATABASE_URI").replace("postgresql://", "postgresql+asyncpg://", 1)
+
+    DATABASE_POOL_SIZE: int = 20
+    DATABASE_MAX_OVERFLOW: int = 20
+
     # Redis
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
     REDIS_PASSWORD: Optional[str] = None
+    REDIS_URL: Optional[str] = None
+
+    @validator("REDIS_URL", pre=True, always=True)
+    def assemble_redis_url(cls, v: Optional[str], values: Dict[str, Any]) -> str:
+        if isinstance(v, str):
+            return v
+        password = values.get("REDIS_PASSWORD")
+        auth = f":{password}@" if password else ""
+        return f"redis://{auth}{values.get('REDIS_HOST')}:{values.get('REDIS_PORT')}/{values.get('REDIS_DB')}"
+
+    # Webhook ingestion
+    # "inline" processes deliveries inside the request, "stream" only appends
+    # them to Redis streams that the webhook consumer drains.
+    WEBHOOK_INGESTION_MODE: str = "inline"
+    WEBHOOK_STREAM_PARTITIONS: int = 16
+    WEBHOOK_STREAM_MAXLEN: int = 1000000
+    WEBHOOK_CONSUMER_GROUP: str = "webhook_processors"
+    # Consumer i of N reads the partitions where partition % N == i, under
+    # a name that survives restarts; entries another consumer left pending
+    # this long are claimed by the partition's consumer
+    WEBHOOK_CONSUMER_COUNT: int = 1
+    WEBHOOK_CONSUMER_INDEX: int = 0
+    WEBHOOK_CLAIM_MIN_IDLE_SECONDS: int = 60
+    # Redeliveries are dropped for between one and two windows.
+    # "bloom" needs the RedisBloom module and trades exactness for memory.
+    WEBHOOK_DEDUP_BACKEND: str = "set"
+    WEBHOOK_DEDUP_WINDOW_SECONDS: int = 6 * 60 * 60
+    WEBHOOK_DEDUP_BLOOM_CAPACITY: int = 10000000
+    WEBHOOK_DEDUP_BLOOM_ERROR_RATE: float = 0.0001
+
+    # Instagram API, reached through one pooled client per process
+    INSTAGRAM_GRAPH_API_URL: str = "https://graph.facebook.com"
+    INSTAGRAM_GRAPH_API_VERSION: str = "v18.0"
+    GRAPH_API_HTTP2: bool = True
+    GRAPH_API_MAX_CONNECTIONS: int = 100
+    GRAPH_API_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    GRAPH_API_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    GRAPH_API_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    GRAPH_API_TIMEOUT_SECONDS: float = 15.0
 
-    # Instagram API
-    INSTAGRAM_GRAPH_API_VERSION: str = "v12.0"
-    INSTAGRAM_API_BASE_URL: str = f"https://graph.facebook.com/{INSTAGRAM_GRAPH_API_VERSION}"
+    # Graph API rate limits, as token buckets in Redis shared by every
+    # process: per account and for the whole app, for messaging (Send API,
+    # private replies) and for profile lookups. Callers wait for budget up
+    # to GRAPH_RATE_LIMIT_MAX_WAIT_SECONDS.
+    GRAPH_RATE_LIMIT_ENABLED: bool = True
+    GRAPH_RATE_LIMIT_MAX_WAIT_SECONDS: float = 30.0
+    GRAPH_MESSAGING_RATE_PER_SECOND: float = 100.0
+    GRAPH_MESSAGING_BURST: int = 100
+    GRAPH_APP_MESSAGING_RATE_PER_SECOND: float = 1000.0
+    GRAPH_APP_MESSAGING_BURST: int = 1000
+    GRAPH_PROFILE_RATE_PER_SECOND: float = 10.0
+    GRAPH_PROFILE_BURST: int = 50
+    GRAPH_APP_PROFILE_RATE_PER_SECOND: float = 200.0
+    GRAPH_APP_PROFILE_BURST: int = 500
+
+    # Graph API calls in flight per process, adapted (AIMD) to the usage
+    # Meta reports: per account between MIN and MAX, and for the app
+    GRAPH_ADAPTIVE_CONCURRENCY_ENABLED: bool = True
+    GRAPH_USAGE_TARGET_PERCENT: float = 80.0
+    GRAPH_CONCURRENCY_INITIAL: int = 8
+    GRAPH_CONCURRENCY_MIN: int = 1
+    GRAPH_CONCURRENCY_MAX: int = 64
+    GRAPH_APP_CONCURRENCY_INITIAL: int = 64
+    GRAPH_APP_CONCURRENCY_MAX: int = 512
+    GRAPH_CONCURRENCY_BACKOFF: float = 0.5
+    GRAPH_CONCURRENCY_DECREASE_INTERVAL_SECONDS: float = 1.0
+    # Accounts whose limits a process keeps; idle ones are forgotten first
+    GRAPH_CONCURRENCY_MAX_ACCOUNTS: int = 10000
+
+    # Failed jobs and Graph API sends are retried with jittered exponential
+    # backoff through the delayed job scheduler, then dead-lettered. An
+    # account's circuit breaker opens after FAILURE_THRESHOLD retryable
+    # failures in a row.
+    RETRY_MAX_ATTEMPTS: int = 6
+    RETRY_BASE_DELAY_SECONDS: float = 2.0
+    RETRY_MAX_DELAY_SECONDS: float = 15 * 60
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_BREAKER_OPEN_SECONDS: int = 60
+    DEAD_LETTER_STREAM_MAXLEN: int = 100000
+
+    # Access tokens are refreshed in the last TOKEN_REFRESH_WINDOW_DAYS
+    # before they expire, each account at its own point in the first half
+    # of the window, by a sweeper in worker process 0
+    TOKEN_REFRESH_WINDOW_DAYS: int = 10
+    TOKEN_REFRESH_SWEEP_INTERVAL_SECONDS: int = 300
+    TOKEN_REFRESH_BATCH_SIZE: int = 500
+    TOKEN_REFRESH_CONCURRENCY: int = 10
+    # Read-only Graph API responses (profiles, conversation lists) are
+    # cached per endpoint in Redis and, for at most
+    # GRAPH_CACHE_LOCAL_TTL_SECONDS, in process; 404s are cached as well
+    GRAPH_CACHE_PROFILE_TTL_SECONDS: int = 3600
+    GRAPH_CACHE_CONVERSATIONS_TTL_SECONDS: int = 60
+    GRAPH_CACHE_NEGATIVE_TTL_SECONDS: int = 300
+    GRAPH_CACHE_LOCAL_TTL_SECONDS: int = 60
+    GRAPH_CACHE_LOCAL_SIZE: int = 10000
     INSTAGRAM_APP_ID: Optional[str] = None
     INSTAGRAM_APP_SECRET: Optional[str] = None
+    INSTAGRAM_WEBHOOK_VERIFY_TOKEN: Optional[str] = None
+
+    # Automation worker: jobs are hashed by contact onto lanes;
+    # worker process i of N owns the lanes where lane % N == i
+    WORKER_LANES: int = 64
+    WORKER_PROCESS_COUNT: int = 1
+    WORKER_PROCESS_INDEX: int = 0
+    WORKER_MAX_LANE_DEPTH: int = 100
+
+    # Compiled flows kept in memory per process
+    FLOW_CACHE_SIZE: int = 1024
+    # Compiled graphs kept per process, by content hash and by version
+    FLOW_GRAPH_CACHE_SIZE: int = 4096
+    # Upper bound on how long a missed invalidation leaves a cache stale
+    CACHE_REVALIDATE_SECONDS: int = 30
+
+    # Delayed jobs (wait nodes): claimed this far ahead into an in-process
+    # timing wheel ticking every SCHEDULER_TICK_MS
+    SCHEDULER_TICK_MS: int = 100
+    SCHEDULER_HORIZON_SECONDS: int = 10
+    SCHEDULER_CLAIM_BATCH_SIZE: int = 500
+    SCHEDULER_MAX_HELD: int = 20000
+    SCHEDULER_LEASE_SECONDS: int = 60
+
+    # Flow state of active contacts is kept in Redis and written behind to
+    # the contacts table
+    FLOW_STATE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    FLOW_STATE_FLUSH_BATCH_SIZE: int = 500
+    FLOW_STATE_FLUSH_INTERVAL_SECONDS: float = 1.0
+    FLOW_STATE_FLUSH_LEASE_SECONDS: int = 60
+
+    # Comment triggers: each commenter is answered once per post, and
+    # replies to an account are spread out to stay below the Graph API's
+    # private reply limit; the backlog is capped well within the 7 days a
+    # comment can be replied to
+    COMMENT_TRIGGER_DEDUP_SECONDS: int = 7 * 24 * 60 * 60
+    COMMENT_REPLY_RATE_PER_HOUR: int = 600
+    COMMENT_REPLY_MAX_DELAY_SECONDS: int = 24 * 60 * 60
+
+    # Per-node, per-event and per-send latency histograms of flows, added
+    # to per-minute Redis hashes by every process
+    FLOW_METRICS_ENABLED: bool = True
+    FLOW_METRICS_REPORT_SECONDS: int = 10
+
+    # Contact profile enrichment (Graph API batches hold at most 50 requests)
+    PROFILE_ENRICHMENT_BATCH_SIZE: int = 50
+    # Failed lookups are retried with RETRY_* backoff this many times in all
+    PROFILE_ENRICHMENT_MAX_ATTEMPTS: int = 5
 
     # Email
     SMTP_TLS: bool = True
@@ -1,7 +1,12 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.api_v1.api import api_router
+from app.services.cache_invalidation import cache_invalidation_bus
+from app.services.flow_compiler import preload_flows
+from app.services.flow_metrics import flow_metrics
+from app.services.graph_client import graph_client
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -19,6 +24,22 @@ app.add_middleware(
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+@app.on_event("startup")
+async def startup():
+    await cache_invalidation_bus.start()
+    # Webhooks processed inline run flows in this process
+    await preload_flows()
+    app.state.flow_metrics_reporter = asyncio.create_task(flow_metrics.run_reporter())
+
+@app.on_event("shutdown")
+async def shutdown():
+    flow_metrics.stop()
+    app.state.flow_metrics_reporter.cancel()
+    # What was recorded since the last report
+    await flow_metrics.report()
+    await cache_invalidation_bus.stop()
+    await graph_client.close()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to InstaFlow API"}
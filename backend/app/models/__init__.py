@@ -1,4 +1,20 @@
 from .user import User
 from .subscription import SubscriptionPlan, UserSubscription
+from .instagram_account import InstagramAccount
+from .flow import Flow, FlowVersion, Trigger
+from .contact import Contact
+from .conversation import Conversation
+from .message_log import MessageLog
 
-__all__ = ["User", "SubscriptionPlan", "UserSubscription"] 
\ No newline at end of file
+__all__ = [
+    "User",
+    "SubscriptionPlan",
+    "UserSubscription",
+    "InstagramAccount",
+    "Flow",
+    "FlowVersion",
+    "Trigger",
+    "Contact",
+    "Conversation",
+    "MessageLog",
+]
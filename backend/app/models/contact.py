@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum as PyEnum
-from sqlalchemy import Column, String, DateTime, ForeignKey, Enum, JSON, Boolean, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB
 from sqlalchemy.orm import relationship
 import uuid
@@ -9,6 +9,9 @@ from app.db.base_class import Base
 
 class Contact(Base):
     __tablename__ = "contacts"
+    __table_args__ = (
+        UniqueConstraint("instagram_account_id", "instagram_user_id", name="uq_contacts_account_instagram_user"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     instagram_account_id = Column(UUID(as_uuid=True), ForeignKey("instagram_accounts.id"), nullable=False)
@@ -20,6 +23,9 @@ class Contact(Base):
     last_interaction_at = Column(DateTime)
     current_flow_id = Column(UUID(as_uuid=True), ForeignKey("flows.id"))
     current_flow_step_node_id = Column(String)
+    # Flow version the contact started on; its node ids stay valid when
+    # the flow is edited
+    current_flow_version_id = Column(UUID(as_uuid=True), ForeignKey("flow_versions.id", ondelete="SET NULL"))
     flow_context = Column(JSONB)
     tags = Column(ARRAY(String), default=[])
     custom_attributes = Column(JSONB, default={})
@@ -47,19 +53,3 @@ class MessageType(PyEnum):
     VIDEO = "video"
     BUTTON_RESPONSE = "button_response"
     QUICK_REPLY_RESPONSE = "quick_reply_response"
-
-class MessageLog(Base):
-    __tablename__ = "message_logs"
-
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"), nullable=False)
-    direction = Column(Enum(MessageDirection), nullable=False)
-    type = Column(Enum(MessageType), nullable=False)
-    content = Column(JSON, nullable=False)
-    is_automated = Column(Boolean, default=False)
-    flow_id = Column(UUID(as_uuid=True), ForeignKey("flows.id"))
-    timestamp = Column(DateTime, default=datetime.utcnow)
-
-    # Relationships
-    conversation = relationship("Conversation", back_populates="messages")
-    flow = relationship("Flow") 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, DateTime, ForeignKey, Enum, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -6,8 +6,20 @@ from datetime import datetime
 from app.db.base_class import Base
 from app.models.contact import ConversationStatus
 
+# Enum(ConversationStatus) persists member names, hence 'OPEN'
+OPEN_CONVERSATION_PREDICATE = text("status = 'OPEN'")
+
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        Index(
+            "uq_conversations_open_contact",
+            "instagram_account_id",
+            "contact_id",
+            unique=True,
+            postgresql_where=OPEN_CONVERSATION_PREDICATE
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     instagram_account_id = Column(UUID(as_uuid=True), ForeignKey("instagram_accounts.id"), nullable=False)
@@ -24,5 +36,6 @@ class Conversation(Base):
     instagram_account = relationship("InstagramAccount", back_populates="conversations")
     contact = relationship("Contact", back_populates="conversations")
     assigned_agent = relationship("User")
-    messages = relationship("MessageLog", back_populates="conversation")
-    last_message = relationship("MessageLog", foreign_keys=[last_message_id]) 
\ No newline at end of file
+    messages = relationship("MessageLog", back_populates="conversation", foreign_keys="MessageLog.conversation_id")
+    # The two tables reference each other; set after both rows exist
+    last_message = relationship("MessageLog", foreign_keys=[last_message_id], post_update=True) 
\ No newline at end of file
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum as PyEnum
-from sqlalchemy import Column, String, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, Enum, Text, Integer, Boolean, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 import uuid
@@ -20,6 +20,11 @@ class Flow(Base):
     name = Column(String, nullable=False)
     description = Column(Text)
     flow_definition = Column(JSONB, nullable=False)
+    # Version holding the current flow_definition
+    current_version_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("flow_versions.id", use_alter=True, name="fk_flows_current_version_id", ondelete="SET NULL")
+    )
     status = Column(Enum(FlowStatus), nullable=False, default=FlowStatus.DRAFT)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -29,6 +34,20 @@ class Flow(Base):
     triggers = relationship("Trigger", back_populates="flow")
     message_logs = relationship("MessageLog", back_populates="flow")
 
+class FlowVersion(Base):
+    """An immutable flow definition, identified within its flow by content hash."""
+    __tablename__ = "flow_versions"
+    __table_args__ = (
+        UniqueConstraint("flow_id", "content_hash", name="uq_flow_versions_flow_content_hash"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    flow_id = Column(UUID(as_uuid=True), ForeignKey("flows.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=False, index=True)
+    flow_definition = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class TriggerType(PyEnum):
     WELCOME_MESSAGE = "welcome_message"
     DM_KEYWORD = "dm_keyword"
@@ -43,6 +62,8 @@ class Trigger(Base):
     type = Column(Enum(TriggerType), nullable=False)
     keyword = Column(String)  # For keyword-based triggers
     post_permalink = Column(String)  # For comment triggers on specific posts
+    priority = Column(Integer, nullable=False, default=0)  # Higher wins when several triggers match
+    match_whole_word = Column(Boolean, nullable=False, default=False)
     status = Column(Enum(FlowStatus), nullable=False, default=FlowStatus.ACTIVE)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
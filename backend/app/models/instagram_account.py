@@ -14,7 +14,8 @@ class InstagramAccount(Base):
     instagram_user_id = Column(String, unique=True, nullable=False)
     instagram_username = Column(String, nullable=False)
     access_token = Column(String, nullable=False)
-    token_expires_at = Column(DateTime, nullable=False)
+    # Indexed for the token refresh sweeper
+    token_expires_at = Column(DateTime, nullable=False, index=True)
     status = Column(Enum('connected', 'disconnected', 'error', name='account_status'), default='connected')
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
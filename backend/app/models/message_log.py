@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Enum
+from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Enum, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 import uuid
@@ -7,6 +7,14 @@ from app.db.base_class import Base
 
 class MessageLog(Base):
     __tablename__ = "message_logs"
+    __table_args__ = (
+        Index(
+            "uq_message_logs_instagram_message_id",
+            "instagram_message_id",
+            unique=True,
+            postgresql_where=text("instagram_message_id IS NOT NULL")
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     instagram_account_id = Column(UUID(as_uuid=True), ForeignKey("instagram_accounts.id"), nullable=False)
@@ -18,9 +26,10 @@ class MessageLog(Base):
     is_automated = Column(Boolean, default=False)
     flow_id = Column(UUID(as_uuid=True), ForeignKey("flows.id"))
     conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"))
+    instagram_message_id = Column(String)  # mid of inbound Instagram events
 
     # Relationships
     instagram_account = relationship("InstagramAccount")
     contact = relationship("Contact", back_populates="message_logs")
     flow = relationship("Flow", back_populates="message_logs")
-    conversation = relationship("Conversation", back_populates="messages") 
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages", foreign_keys=[conversation_id]) 
\ No newline at end of file
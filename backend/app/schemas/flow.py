@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Dict, List, Optional, Any
 from pydantic import BaseModel, UUID4
 from app.models.flow import FlowStatus, TriggerType
@@ -36,12 +37,24 @@ class Flow(FlowInDBBase):
     pass
 
 class FlowResponse(FlowInDBBase):
-    pass
+    current_version_id: Optional[UUID4] = None
+
+class FlowVersionResponse(IDSchema):
+    flow_id: UUID4
+    version: int
+    content_hash: str
+    flow_definition: Dict[str, Any]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
 
 class TriggerBase(BaseModel):
     type: TriggerType
     keyword: Optional[str] = None
     post_permalink: Optional[str] = None
+    priority: int = 0
+    match_whole_word: bool = False
     status: FlowStatus = FlowStatus.ACTIVE
 
 class TriggerCreate(TriggerBase):
@@ -50,6 +63,8 @@ class TriggerCreate(TriggerBase):
 class TriggerUpdate(BaseModel):
     keyword: Optional[str] = None
     post_permalink: Optional[str] = None
+    priority: Optional[int] = None
+    match_whole_word: Optional[bool] = None
     status: Optional[FlowStatus] = None
 
 class TriggerInDBBase(TriggerBase, IDSchema, TimestampedSchema):
@@ -1,21 +1,122 @@
-from typing import Any, Dict, List, Optional
-from datetime import datetime, timedelta
-import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import functools
 import logging
-from sqlalchemy.orm import Session
+import time
+import uuid
+from sqlalchemy import event, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.flow import Flow, FlowStatus, Trigger
-from app.models.contact import Contact, Conversation, MessageLog, ConversationStatus
-from app.services.instagram import instagram_api, InstagramService
+from app.models.flow import Flow, FlowStatus, FlowVersion
+from app.models.contact import Contact, ConversationStatus
+from app.models.conversation import Conversation
+from app.models.instagram_account import InstagramAccount
+from app.models.message_log import MessageLog
+from app.services.flow_compiler import CompiledFlow, CompiledGraph, CompiledNode, flow_cache, graph_cache
+from app.services.flow_metrics import flow_metrics
+from app.services.flow_state import FlowState, flow_state_store
+from app.services.instagram import instagram_api
 from app.services.redis_service import redis_service
+from app.services.resilience import (
+    FAILING,
+    RETRYABLE,
+    TOKEN_EXPIRED,
+    account_breaker,
+    classify_error,
+    dead_letters,
+    mark_tokens_expired,
+    retry_delay,
+    retry_or_dead_letter
+)
+from app.services.trigger_matcher import trigger_index
 
 logger = logging.getLogger(__name__)
 
+# Nodes after which a flow waits for a reply, a timer or an agent; a node
+# with conditional connections also waits, for the input to branch on,
+# except a condition node, which branches at once
+BLOCKING_NODE_TYPES = frozenset({"get_input", "wait", "human_takeover"})
+# Guards against flows whose unconditional connections form a cycle
+MAX_NODES_PER_RUN = 50
+
+def timed_event(name: str):
+    """
+    Record the latency, errors and database queries of an event handler
+    under the flow it ran (see FlowMetrics).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self: "AutomationEngine", *args, **kwargs):
+            if not flow_metrics.enabled:
+                return await method(self, *args, **kwargs)
+            self.event_flow_id = None
+            queries = self.db_queries
+            error = False
+            started = time.perf_counter_ns()
+            try:
+                return await method(self, *args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                flow_metrics.record(
+                    self.event_flow_id, "event", name, time.perf_counter_ns() - started,
+                    error=error, queries=self.db_queries - queries
+                )
+        return wrapper
+    return decorator
+
 class AutomationEngine:
-    def __init__(self, db: Session):
+    """
+    Runs flows for inbound events on an AsyncSession.
+
+    Only trigger and flow lookups on a cache miss and flush() touch the
+    database or the Graph API, so many conversations can be processed
+    concurrently on one event loop.
+    """
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        sender: Any = instagram_api,
+        state_store: Any = flow_state_store,
+        breaker: Any = account_breaker
+    ):
         self.db = db
-        self.instagram_service = InstagramService()
+        # Replaceable for simulations (see scripts/simulate_flows.py)
+        self.sender = sender
+        self.state_store = state_store
+        self.breaker = breaker
         self.queue_name = "automation_tasks"
+        # Effects of processed events, applied by flush()
+        self.pending_statements: List[Any] = []
+        # (account, recipient id, content, flow id)
+        self.outbound_messages: List[Tuple[InstagramAccount, str, Dict[str, Any], Any]] = []
+        # (job, delay_seconds) pairs for the caller to hand to the delayed
+        # job scheduler once the state they resume from is committed
+        self.scheduled_jobs: List[Tuple[Dict[str, Any], float]] = []
+        # Flow state of the contacts seen, saved by flush() if changed
+        self.states: Dict[Any, FlowState] = {}
+        # Comment to answer per (account id, recipient) of a flow started
+        # by a comment trigger
+        self.comment_replies: Dict[Tuple[Any, str], str] = {}
+        # Per (account id, recipient): the contact, for the lane of a retry,
+        # and the attempts its messages already had
+        self.recipient_contacts: Dict[Tuple[Any, str], Any] = {}
+        self.send_attempts: Dict[Tuple[Any, str], int] = {}
+        # Accounts whose token stopped working during flush()
+        self.expired_accounts: set = set()
+        # Statements the session has executed, and the flow of the event
+        # being handled, for flow_metrics
+        self.db_queries = 0
+        self.event_flow_id: Any = None
+        sync_session = getattr(db, "sync_session", None)
+        if flow_metrics.enabled and sync_session is not None:
+            event.listen(sync_session, "do_orm_execute", self._count_query)
+
+    def _count_query(self, orm_execute_state: Any) -> None:
+        self.db_queries += 1
 
     async def queue_flow_execution(
         self,
@@ -34,7 +135,18 @@ class AutomationEngine:
             logger.error(f"Error queueing flow execution: {str(e)}")
             return False
 
-    def process_message(
+    async def load_states(self, contacts: Iterable[Contact]) -> None:
+        """Fetch the flow state of several contacts in one round trip."""
+        missing = [contact for contact in contacts if contact.id not in self.states]
+        self.states.update(await self.state_store.load_many(missing))
+
+    async def _load_state(self, contact: Contact) -> FlowState:
+        if contact.id not in self.states:
+            await self.load_states([contact])
+        return self.states[contact.id]
+
+    @timed_event("message")
+    async def process_message(
         self,
         account: InstagramAccount,
         contact: Contact,
@@ -44,14 +156,16 @@ class AutomationEngine:
         Process an incoming message and execute appropriate flows.
         """
         # If contact is in a flow, continue that flow
-        if contact.current_flow_id:
-            self._continue_flow(account, contact, message)
+        state = await self._load_state(contact)
+        if state.flow_id:
+            await self._continue_flow(account, contact, message)
             return
         
         # Otherwise, check for matching triggers
-        self._check_triggers(account, contact, message)
+        await self._check_triggers(account, contact, message)
 
-    def process_postback(
+    @timed_event("postback")
+    async def process_postback(
         self,
         account: InstagramAccount,
         contact: Contact,
@@ -65,14 +179,15 @@ class AutomationEngine:
             return
         
         # If contact is in a flow, continue that flow
-        if contact.current_flow_id:
-            self._continue_flow(account, contact, message)
+        state = await self._load_state(contact)
+        if state.flow_id:
+            await self._continue_flow(account, contact, message)
             return
         
         # Otherwise, check for matching triggers
-        self._check_triggers(account, contact, message)
+        await self._check_triggers(account, contact, message)
 
-    def _check_triggers(
+    async def _check_triggers(
         self,
         account: InstagramAccount,
         contact: Contact,
@@ -81,43 +196,108 @@ class AutomationEngine:
         """
         Check if the message matches any triggers and start the corresponding flow.
         """
-        message_text = message.content.get("text", "").lower()
-        
-        # Check keyword triggers
-        triggers = self.db.query(Trigger).join(Flow).filter(
-            Flow.instagram_account_id == account.id,
-            Trigger.status == "active"
-        ).all()
-        
-        for trigger in triggers:
-            if trigger.type == "dm_keyword" and trigger.keyword.lower() in message_text:
-                self._start_flow(account, contact, trigger.flow)
-                break
-            elif trigger.type == "welcome_message" and not contact.last_interaction_at:
-                self._start_flow(account, contact, trigger.flow)
-                break
+        matcher = await trigger_index.get(self.db, account.id)
+
+        if "story_mention_url" in message.content:
+            rule = matcher.story_mention_rule
+        else:
+            # Check keyword triggers
+            rule = matcher.match_dm(message.content.get("text", ""))
+        if rule is None and not contact.last_interaction_at:
+            rule = matcher.welcome_rule
+        if rule is None:
+            return
+
+        compiled = await self._get_compiled_flow(rule.flow_id)
+        if compiled:
+            self._start_flow(account, contact, compiled, message)
 
     def _start_flow(
         self,
         account: InstagramAccount,
         contact: Contact,
-        flow: Flow
+        compiled: CompiledFlow,
+        message: Optional[MessageLog] = None
     ) -> None:
         """
         Start a new flow for a contact.
         """
-        # Set current flow
-        contact.current_flow_id = flow.id
-        contact.current_flow_step_node_id = flow.flow_definition["startNodeId"]
-        contact.flow_context = {}
-        
-        self.db.add(contact)
-        self.db.commit()
-        
-        # Execute first node
-        self._execute_node(account, contact, flow.flow_definition["nodes"][0])
+        start_node = compiled.node(compiled.start_node_id)
+        if not start_node:
+            return
+
+        # Set current flow, pinned to its current version
+        state = self.states[contact.id]
+        state.flow_id = compiled.flow_id
+        state.version_id = compiled.version_id
+        state.context = {}
+        self._run_from(account, contact, compiled.graph, start_node, message)
+
+    def _run_from(
+        self,
+        account: InstagramAccount,
+        contact: Contact,
+        graph: CompiledGraph,
+        node: CompiledNode,
+        message: Optional[MessageLog] = None
+    ) -> None:
+        """
+        Execute a node and every following node that needs no user input,
+        leaving the contact on the node the flow stops at. Condition nodes
+        branch right away, on the contact and the message that got the
+        flow here.
+        """
+        state = self.states[contact.id]
+        self.event_flow_id = state.flow_id
+        for _ in range(MAX_NODES_PER_RUN):
+            state.node_id = node.id
+            self._execute_node(account, contact, node)
+            if node.type == "condition":
+                next_node = graph.node(self._next_target(node, contact, state, message))
+            elif node.type in BLOCKING_NODE_TYPES or node.branches or node.conditions:
+                # Waits for a reply, a timer or an agent
+                break
+            else:
+                next_node = graph.node(node.default_target)
+            if next_node is None:
+                self._end_flow(contact)
+                return
+            node = next_node
+        else:
+            logger.warning(f"Flow {state.flow_id} stopped at node {node.id} after {MAX_NODES_PER_RUN} nodes")
+
+    def _end_flow(self, contact: Contact) -> None:
+        self.states[contact.id].clear()
+
+    async def _get_compiled_flow(self, flow_id: Any) -> Optional[CompiledFlow]:
+        """
+        Get a compiled flow, hitting the database only on a cache miss.
+        """
+        compiled = flow_cache.get(flow_id)
+        if compiled is not None:
+            return compiled
+        flow = await self.db.get(Flow, flow_id)
+        if not flow:
+            return None
+        return flow_cache.get_for(flow)
 
-    def _continue_flow(
+    async def _get_graph(self, state: FlowState) -> Optional[CompiledGraph]:
+        """
+        Graph of the flow version a contact is pinned to, or of the flow's
+        current version for contacts from before versions were pinned.
+        """
+        if state.version_id is None:
+            compiled = await self._get_compiled_flow(state.flow_id)
+            return compiled.graph if compiled else None
+        graph = graph_cache.for_version(state.version_id)
+        if graph is not None:
+            return graph
+        version = await self.db.get(FlowVersion, state.version_id)
+        if not version:
+            return None
+        return graph_cache.add_version(version)
+
+    async def _continue_flow(
         self,
         account: InstagramAccount,
         contact: Contact,
@@ -126,158 +306,362 @@ class AutomationEngine:
         """
         Continue an existing flow based on user input.
         """
-        flow = self.db.query(Flow).filter(Flow.id == contact.current_flow_id).first()
-        if not flow:
+        state = self.states[contact.id]
+        self.event_flow_id = state.flow_id
+        graph = await self._get_graph(state)
+        if not graph:
             return
         
-        current_node = next(
-            (node for node in flow.flow_definition["nodes"]
-             if node["id"] == contact.current_flow_step_node_id),
-            None
-        )
+        current_node = graph.node(state.node_id)
         if not current_node:
             return
+
+        if current_node.type == "wait":
+            # The scheduled resume moves the flow on, not the contact
+            return
         
         # Find next node based on conditions
-        next_node = self._find_next_node(flow.flow_definition["nodes"], current_node, message, contact)
+        next_node = graph.node(self._next_target(current_node, contact, state, message))
         if next_node:
-            contact.current_flow_step_node_id = next_node["id"]
-            self.db.add(contact)
-            self.db.commit()
-            
-            self._execute_node(account, contact, next_node)
+            self._run_from(account, contact, graph, next_node, message)
         else:
             # End flow if no next node
-            contact.current_flow_id = None
-            contact.current_flow_step_node_id = None
-            contact.flow_context = {}
-            self.db.add(contact)
-            self.db.commit()
+            self._end_flow(contact)
 
-    def _find_next_node(
+    def _next_target(
         self,
-        nodes: List[Dict[str, Any]],
-        current_node: Dict[str, Any],
-        message: MessageLog,
-        contact: Contact
-    ) -> Optional[Dict[str, Any]]:
-        """
-        Find the next node based on conditions and user input.
-        """
-        for connection in current_node.get("connections", []):
-            if not connection.get("condition"):
-                # If no condition, follow connection
-                return next(
-                    (node for node in nodes if node["id"] == connection["targetNodeId"]),
-                    None
-                )
-            
-            condition = connection["condition"]
-            if condition["type"] == "button_payload":
-                if message.type == "button_response" and message.content.get("payload") == condition["value"]:
-                    return next(
-                        (node for node in nodes if node["id"] == connection["targetNodeId"]),
-                        None
-                    )
-            elif condition["type"] == "input_valid":
-                # Validate input based on node type
-                is_valid = self._validate_input(current_node, message)
-                if is_valid == condition["value"]:
-                    return next(
-                        (node for node in nodes if node["id"] == connection["targetNodeId"]),
-                        None
-                    )
-        
-        return None
-
-    def _validate_input(self, node: Dict[str, Any], message: MessageLog) -> bool:
-        """
-        Validate user input based on node type.
-        """
-        if node["type"] != "get_input":
-            return True
-        
-        input_type = node.get("inputType")
-        text = message.content.get("text", "")
-        
-        if input_type == "email":
-            # Simple email validation
-            return "@" in text and "." in text
-        elif input_type == "phone":
-            # Simple phone validation
-            return text.replace(" ", "").replace("-", "").isdigit()
-        
-        return True
+        node: CompiledNode,
+        contact: Contact,
+        state: FlowState,
+        message: Optional[MessageLog]
+    ) -> Optional[str]:
+        """Choose the node after `node`, timed as a branch of its type."""
+        if not flow_metrics.enabled:
+            return node.next_target(contact, state, message)
+        started = time.perf_counter_ns()
+        target = node.next_target(contact, state, message)
+        flow_metrics.record(state.flow_id, "branch", node.type, time.perf_counter_ns() - started)
+        return target
 
     def _execute_node(
         self,
         account: InstagramAccount,
         contact: Contact,
-        node: Dict[str, Any]
+        compiled_node: CompiledNode
+    ) -> None:
+        """Execute a flow node, timed per node type."""
+        if not flow_metrics.enabled:
+            self._apply_node(account, contact, compiled_node)
+            return
+        flow_id = self.states[contact.id].flow_id
+        started = time.perf_counter_ns()
+        try:
+            self._apply_node(account, contact, compiled_node)
+        except Exception:
+            flow_metrics.record(flow_id, "node", compiled_node.type, time.perf_counter_ns() - started, error=True)
+            raise
+        flow_metrics.record(flow_id, "node", compiled_node.type, time.perf_counter_ns() - started)
+
+    def _apply_node(
+        self,
+        account: InstagramAccount,
+        contact: Contact,
+        compiled_node: CompiledNode
     ) -> None:
         """
-        Execute a flow node.
+        Apply a flow node. State changes are only made on the session and
+        outbound messages only queued; flush() writes and sends them.
         """
+        node = compiled_node.definition
+        state = self.states[contact.id]
         if node["type"] == "message":
-            # Send message
-            content = self._prepare_message_content(node["content"], contact)
-            self.instagram_service.send_message(
-                account=account,
-                recipient_id=contact.instagram_user_id,
-                message=content
-            )
+            # Send message, rendered from the templates compiled with the flow
+            content = compiled_node.render_content(contact, state.context)
+            self.outbound_messages.append((account, contact.instagram_user_id, content, state.flow_id))
+            self.recipient_contacts[(account.id, contact.instagram_user_id)] = contact.id
         
         elif node["type"] == "tag_contact":
             # Add tag to contact
-            if node.get("tagName"):
-                current_tags = set(contact.tags)
-                current_tags.add(node["tagName"])
-                contact.tags = list(current_tags)
-                self.db.add(contact)
-                self.db.commit()
+            if node.get("tagName") and node["tagName"] not in state.tags:
+                state.tags = [*state.tags, node["tagName"]]
         
         elif node["type"] == "human_takeover":
             # Mark conversation for human takeover
-            conversation = self.db.query(Conversation).filter(
-                Conversation.contact_id == contact.id,
-                Conversation.status == "open"
-            ).first()
-            if conversation:
-                conversation.status = "pending_human"
-                self.db.add(conversation)
-                self.db.commit()
+            self.pending_statements.append(
+                update(Conversation).where(
+                    Conversation.contact_id == contact.id,
+                    Conversation.status == ConversationStatus.OPEN
+                ).values(status=ConversationStatus.PENDING_HUMAN)
+            )
         
         elif node["type"] == "wait":
-            # Schedule next node execution
-            # TODO: Implement delayed execution using Redis/Celery
-            pass
+            # Schedule next node execution; the token ties the job to this
+            # visit of the node so a stale or repeated resume is ignored
+            wait_token = str(uuid.uuid4())
+            state.context = {**state.context, "wait_token": wait_token}
+            self.scheduled_jobs.append(({
+                "job_id": f"resume_flow:{wait_token}",
+                "type": "resume_flow",
+                "account_id": str(account.id),
+                "contact_id": str(contact.id),
+                "flow_id": str(state.flow_id),
+                "node_id": node["id"],
+                "wait_token": wait_token
+            }, float(node.get("durationSeconds") or 0)))
 
-    def _prepare_message_content(
+    @timed_event("resume")
+    async def resume_flow(self, job: Dict[str, Any]) -> None:
+        """
+        Continue a flow past the wait node a scheduled job was created for.
+        """
+        contact = await self.db.get(Contact, uuid.UUID(job["contact_id"]))
+        if not contact:
+            return
+        state = await self._load_state(contact)
+        if (
+            str(state.flow_id) != job["flow_id"]
+            or state.node_id != job["node_id"]
+            or state.context.get("wait_token") != job["wait_token"]
+        ):
+            # The contact left the flow or the wait since it was scheduled
+            return
+
+        account = await self.db.get(InstagramAccount, contact.instagram_account_id)
+        graph = await self._get_graph(state)
+        wait_node = graph.node(job["node_id"]) if graph else None
+        if not account or not wait_node:
+            return
+
+        state.context = {key: value for key, value in state.context.items() if key != "wait_token"}
+        next_node = graph.node(wait_node.default_target)
+        if next_node:
+            self._run_from(account, contact, graph, next_node)
+        else:
+            self._end_flow(contact)
+
+    @timed_event("comment")
+    async def start_comment_flow(self, job: Dict[str, Any]) -> None:
+        """Start the flow of a comment trigger for the commenter."""
+        contact = await self.db.get(Contact, uuid.UUID(job["contact_id"]))
+        if not contact:
+            return
+        state = await self._load_state(contact)
+        if state.flow_id:
+            # Not pulled out of a conversation that is under way
+            return
+
+        account = await self.db.get(InstagramAccount, contact.instagram_account_id)
+        compiled = await self._get_compiled_flow(uuid.UUID(job["flow_id"]))
+        if not account or not compiled or compiled.status != FlowStatus.ACTIVE:
+            return
+
+        self.comment_replies[(account.id, contact.instagram_user_id)] = job["comment_id"]
+        message = MessageLog(
+            type="text",
+            content={"text": job.get("text", ""), "comment_id": job["comment_id"], "media_id": job.get("media_id")}
+        )
+        self._start_flow(account, contact, compiled, message)
+
+    async def retry_send(self, job: Dict[str, Any]) -> None:
+        """Queue the messages of a send_messages retry job for flush()."""
+        account = await self.db.get(InstagramAccount, uuid.UUID(job["account_id"]))
+        if not account:
+            return
+        recipient = (account.id, job["recipient_id"])
+        flow_id = uuid.UUID(job["flow_id"]) if job.get("flow_id") else None
+        for content in job["messages"]:
+            self.outbound_messages.append((account, job["recipient_id"], content, flow_id))
+        if job.get("comment_id"):
+            self.comment_replies[recipient] = job["comment_id"]
+        if job.get("contact_id"):
+            self.recipient_contacts[recipient] = job["contact_id"]
+        self.send_attempts[recipient] = job.get("attempt", 0)
+
+    async def flush(self) -> None:
+        """
+        Commit the database changes of every event processed so far in one
+        database transaction, then save the flow states they changed in
+        one Redis script, then send the messages the flows produced.
+
+        States are saved only once the commit succeeded, and messages go
+        out only after both, so a failure never leaves the contact with
+        messages of a step it did not take. A contact whose state another
+        worker saved in between keeps that state, and the messages of its
+        step are dropped. Recipients are sent to concurrently, each one's
+        messages in order. A commenter has not opened a conversation yet,
+        so the messages for a comment go out coalesced into the one
+        private reply it allows.
+
+        Messages that fail are retried later as send_messages jobs (added
+        to scheduled_jobs) or dead-lettered, by the kind of error; an
+        expired token puts its account in error status. Accounts in error
+        status or with an open circuit breaker are not called at all.
+        """
+        started = time.perf_counter_ns()
+        queries = self.db_queries
+        for statement in self.pending_statements:
+            await self.db.execute(statement)
+        await self.db.commit()
+        self.pending_statements = []
+        committed = time.perf_counter_ns()
+        conflicts = set(await self.state_store.save_many(
+            state for state in self.states.values() if state.is_changed()
+        ))
+        if flow_metrics.enabled:
+            # The commit counts as one more round trip
+            flow_metrics.record(
+                None, "flush", "db", committed - started, queries=self.db_queries - queries + 1
+            )
+            flow_metrics.record(None, "flush", "state", time.perf_counter_ns() - committed)
+
+        outbound_messages, self.outbound_messages = self.outbound_messages, []
+        by_recipient: Dict[Tuple[Any, str], List[Tuple[InstagramAccount, Dict[str, Any], Any]]] = {}
+        for account, recipient_id, content, flow_id in outbound_messages:
+            recipient = (account.id, recipient_id)
+            if conflicts and self.recipient_contacts.get(recipient) in conflicts:
+                continue
+            by_recipient.setdefault(recipient, []).append((account, content, flow_id))
+        comment_replies, self.comment_replies = self.comment_replies, {}
+        await asyncio.gather(*(
+            self._deliver(recipient[1], messages, comment_replies.get(recipient))
+            for recipient, messages in by_recipient.items()
+        ))
+        self.recipient_contacts = {}
+        self.send_attempts = {}
+
+        expired_accounts, self.expired_accounts = self.expired_accounts, set()
+        if expired_accounts:
+            await mark_tokens_expired(self.db, expired_accounts)
+
+    async def _deliver(
+        self,
+        recipient_id: str,
+        messages: List[Tuple[InstagramAccount, Dict[str, Any], Any]],
+        comment_id: Optional[str] = None
+    ) -> None:
+        """Send a recipient's messages, handling what could not be sent."""
+        account = messages[0][0]
+        reason = "account_error" if account.status == "error" else await self.breaker.check(account.id)
+        if reason:
+            await self._send_failed(account, recipient_id, messages, comment_id, reason=reason)
+            return
+        if comment_id is not None:
+            failure = await self._send_private_reply(comment_id, messages)
+        else:
+            failure = await self._send_in_order(recipient_id, messages)
+        if failure is None:
+            self.breaker.record_success(account.id)
+        else:
+            unsent, error = failure
+            await self._send_failed(account, recipient_id, unsent, comment_id, error=error)
+
+    async def _send_failed(
         self,
-        content: Dict[str, Any],
-        contact: Contact
-    ) -> Dict[str, Any]:
+        account: InstagramAccount,
+        recipient_id: str,
+        messages: List[Tuple[InstagramAccount, Dict[str, Any], Any]],
+        comment_id: Optional[str],
+        error: Optional[BaseException] = None,
+        reason: Optional[str] = None
+    ) -> None:
         """
-        Prepare message content with variable substitution.
+        Retry unsent messages as a send_messages job, or dead-letter them:
+        for an error by its kind, or for the reason the account was not
+        called.
         """
-        if "text" in content:
-            text = content["text"]
-            # Replace variables
-            text = text.replace("{{contact.firstName}}", contact.first_name or "")
-            text = text.replace("{{contact.lastName}}", contact.last_name or "")
-            content["text"] = text
-        
-        return content
+        recipient = (account.id, recipient_id)
+        flow_id = messages[-1][2]
+        contact_id = self.recipient_contacts.get(recipient)
+        job = {
+            "job_id": f"send_messages:{uuid.uuid4()}",
+            "type": "send_messages",
+            "account_id": str(account.id),
+            "contact_id": str(contact_id) if contact_id else None,
+            "recipient_id": recipient_id,
+            "comment_id": comment_id,
+            "flow_id": str(flow_id) if flow_id else None,
+            "messages": [content for _, content, _ in messages],
+            "attempt": self.send_attempts.get(recipient, 0),
+        }
+        if reason == FAILING:
+            # Waits for the breaker to close; not an attempt of its own
+            self.scheduled_jobs.append((job, retry_delay(job["attempt"] + 1)))
+            return
+        if reason is not None:
+            await dead_letters.add(job, reason)
+            return
+
+        classification = classify_error(error)
+        if classification == TOKEN_EXPIRED:
+            self.expired_accounts.add(account.id)
+        elif classification == RETRYABLE:
+            await self.breaker.record_failure(account.id)
+        retry = await retry_or_dead_letter(job, error)
+        if retry is not None:
+            self.scheduled_jobs.append(retry)
+
+    async def _send_private_reply(
+        self,
+        comment_id: str,
+        messages: List[Tuple[InstagramAccount, Dict[str, Any], Any]]
+    ) -> Optional[Tuple[List[Tuple[InstagramAccount, Dict[str, Any], Any]], BaseException]]:
+        """Send the private reply; on failure, (unsent messages, error)."""
+        account, _, flow_id = messages[-1]
+        # Texts joined; anything else (buttons, media) from the last message
+        texts = [content["text"] for _, content, _ in messages if content.get("text")]
+        content = {**messages[-1][1]}
+        if texts:
+            content["text"] = "\n\n".join(texts)
+        started = time.perf_counter_ns()
+        try:
+            await self.sender.send_private_reply(
+                instagram_user_id=account.instagram_page_id,
+                comment_id=comment_id,
+                message=content,
+                access_token=account.access_token
+            )
+        except Exception as e:
+            logger.error(f"Error replying to comment {comment_id}: {str(e)}")
+            if flow_metrics.enabled:
+                flow_metrics.record(flow_id, "send", "private_reply", time.perf_counter_ns() - started, error=True)
+            return messages, e
+        if flow_metrics.enabled:
+            flow_metrics.record(flow_id, "send", "private_reply", time.perf_counter_ns() - started)
+        return None
+
+    async def _send_in_order(
+        self,
+        recipient_id: str,
+        messages: List[Tuple[InstagramAccount, Dict[str, Any], Any]]
+    ) -> Optional[Tuple[List[Tuple[InstagramAccount, Dict[str, Any], Any]], BaseException]]:
+        """Send messages one after another; on failure, (unsent messages, error)."""
+        for index, (account, content, flow_id) in enumerate(messages):
+            started = time.perf_counter_ns()
+            try:
+                await self.sender.send_message(
+                    instagram_user_id=account.instagram_page_id,
+                    recipient_id=recipient_id,
+                    message=content,
+                    access_token=account.access_token
+                )
+            except Exception as e:
+                logger.error(f"Error sending message to {recipient_id}: {str(e)}")
+                if flow_metrics.enabled:
+                    flow_metrics.record(flow_id, "send", "message", time.perf_counter_ns() - started, error=True)
+                # Later messages of the sequence would arrive out of context
+                return messages[index:], e
+            if flow_metrics.enabled:
+                flow_metrics.record(flow_id, "send", "message", time.perf_counter_ns() - started)
+        return None
 
     async def execute_flow(
         self,
-        db: Session,
         flow_id: str,
         trigger_data: Dict[str, Any]
     ) -> None:
         """Execute a flow from the queue."""
         try:
-            flow = db.query(Flow).filter(Flow.id == flow_id).first()
+            flow = await self.db.get(Flow, uuid.UUID(str(flow_id)))
             if not flow or flow.status != FlowStatus.ACTIVE:
                 return
 
@@ -285,22 +669,26 @@ class AutomationEngine:
             if not contact_id:
                 return
 
-            contact = db.query(Contact).filter(Contact.id == contact_id).first()
+            contact = await self.db.get(Contact, uuid.UUID(str(contact_id)))
             if not contact:
                 return
+            account = await self.db.get(InstagramAccount, contact.instagram_account_id)
+            await self._load_state(contact)
 
             if trigger_data.get("type") == "continue_flow":
-                await self._continue_flow(contact, trigger_data.get("message_data", {}))
+                message_data = trigger_data.get("message_data", {})
+                message = MessageLog(
+                    type=message_data.get("type", "text"),
+                    content=message_data.get("content", {})
+                )
+                await self._continue_flow(account, contact, message)
             elif trigger_data.get("type") == "start_flow":
-                await self._start_flow(contact, flow)
+                self._start_flow(account, contact, flow_cache.get_for(flow))
+            await self.flush()
 
         except Exception as e:
             logger.error(f"Error executing flow from queue: {str(e)}")
 
-automation_engine = None
-
-def get_automation_engine(db: Session) -> AutomationEngine:
-    global automation_engine
-    if not automation_engine:
-        automation_engine = AutomationEngine(db)
-    return automation_engine 
\ No newline at end of file
+def get_automation_engine(db: AsyncSession) -> AutomationEngine:
+    # Engines buffer effects until flush(), so one is needed per session
+    return AutomationEngine(db)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, Optional
+import orjson
+from app.core.config import settings
+from app.services.flow_compiler import flow_cache
+from app.services.redis_service import redis_service
+from app.services.trigger_matcher import trigger_index
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+GENERATION_KEY_PREFIX = "cache:generation"
+
+def invalidate_locally(instagram_account_id: Any, flow_ids: Optional[Iterable[Any]] = None) -> None:
+    """
+    Drop this process's cached automations of an account.
+
+    Only the given flows are dropped from the flow cache when flow_ids is
+    passed, every flow of the account otherwise. The trigger matcher of
+    the account is always rebuilt since triggers hang off flows.
+    """
+    if flow_ids is None:
+        flow_cache.invalidate_account(instagram_account_id)
+    else:
+        for flow_id in flow_ids:
+            flow_cache.invalidate(flow_id)
+    trigger_index.invalidate(instagram_account_id)
+
+class CacheInvalidationBus:
+    """
+    Keeps the per-process flow and trigger caches coherent across the cluster.
+
+    Every mutation bumps a per-account generation counter in Redis and
+    publishes a notification that all processes apply immediately. Pub/sub
+    is fire-and-forget, so each process also compares the generations of
+    the accounts it has cached against Redis every CACHE_REVALIDATE_SECONDS;
+    a missed notification therefore leaves a cache stale for at most that
+    long.
+    """
+
+    def __init__(self):
+        self.revalidate_seconds = settings.CACHE_REVALIDATE_SECONDS
+        self._generations: Dict[str, int] = {}
+        self._tasks = []
+
+    async def publish(self, instagram_account_id: Any, flow_ids: Optional[Iterable[Any]] = None) -> None:
+        """Announce that flows or triggers of an account changed."""
+        account_key = str(instagram_account_id)
+        flow_ids = [str(flow_id) for flow_id in flow_ids] if flow_ids is not None else None
+        try:
+            await redis_service.init()
+            generation = await redis_service.redis.incr(f"{GENERATION_KEY_PREFIX}:{account_key}")
+            await redis_service.redis.publish(
+                INVALIDATION_CHANNEL,
+                orjson.dumps({
+                    "account_id": account_key,
+                    "flow_ids": flow_ids,
+                    "generation": generation,
+                }).decode("utf-8")
+            )
+        except Exception as e:
+            # Other processes catch up through revalidation
+            logger.error(f"Error publishing cache invalidation: {str(e)}")
+            return
+        self._apply(account_key, flow_ids, generation)
+
+    def _apply(self, account_key: str, flow_ids: Optional[Iterable[str]], generation: int) -> None:
+        if generation <= self._generations.get(account_key, 0):
+            return
+        self._generations[account_key] = generation
+        invalidate_locally(account_key, flow_ids)
+
+    async def start(self) -> None:
+        """Start listening for invalidations and revalidating periodically."""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._listen()),
+                asyncio.create_task(self._revalidate_periodically()),
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                await redis_service.init()
+                pubsub = redis_service.redis.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Anything published while we were not subscribed
+                await self.revalidate()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    event = orjson.loads(message["data"])
+                    self._apply(event["account_id"], event.get("flow_ids"), event["generation"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener failed: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _revalidate_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.revalidate_seconds)
+            try:
+                await self.revalidate()
+            except Exception as e:
+                logger.error(f"Cache revalidation failed: {str(e)}")
+
+    async def revalidate(self) -> None:
+        """Compare cached accounts against their Redis generation counters."""
+        account_keys = sorted(flow_cache.cached_account_ids() | trigger_index.cached_account_ids())
+        if not account_keys:
+            return
+        await redis_service.init()
+        generations = await redis_service.redis.mget(
+            [f"{GENERATION_KEY_PREFIX}:{account_key}" for account_key in account_keys]
+        )
+        for account_key, generation in zip(account_keys, generations):
+            generation = int(generation or 0)
+            known = self._generations.get(account_key)
+            if known is None:
+                # Cached before we knew its generation: an edit may have
+                # been missed in between, so rebuild once
+                self._generations[account_key] = generation
+                invalidate_locally(account_key)
+            elif generation > known:
+                self._apply(account_key, None, generation)
+
+cache_invalidation_bus = CacheInvalidationBus()
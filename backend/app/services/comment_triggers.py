@@ -0,0 +1,246 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.contact import Contact
+from app.models.instagram_account import InstagramAccount
+from app.services.instagram import instagram_api
+from app.services.redis_service import redis_service
+from app.services.trigger_matcher import TriggerRule, trigger_index
+
+logger = logging.getLogger(__name__)
+
+# Webhook fields of the `changes` entries that carry a new comment
+COMMENT_FIELDS = frozenset({"comments", "live_comments"})
+
+CLAIM_KEY_PREFIX = "comment_trigger:claimed"
+PACE_KEY_PREFIX = "comment_trigger:next_slot"
+PERMALINK_KEY_PREFIX = "media:permalink"
+PERMALINK_TTL_SECONDS = 30 * 24 * 60 * 60
+MAX_CACHED_PERMALINKS = 10000
+
+# Claims (commenter, post) pairs (their keys in KEYS) for ARGV[1] seconds.
+# Returns 1 for every pair claimed now, 0 for pairs already answered.
+CLAIM_SCRIPT = """
+local result = {}
+for i = 1, #KEYS do
+    if redis.call('SET', KEYS[i], '1', 'NX', 'EX', tonumber(ARGV[1])) then
+        result[i] = 1
+    else
+        result[i] = 0
+    end
+end
+return result
+"""
+
+# Hands out ARGV[3] reply slots ARGV[2] ms apart on the account's clock
+# (KEYS[1]), starting no earlier than now (ARGV[1]). Returns each slot's
+# delay in ms, or -1 once the backlog is more than ARGV[4] ms deep.
+PACE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local max_delay = tonumber(ARGV[4])
+local slot = tonumber(redis.call('GET', KEYS[1]) or '0')
+if slot < now then
+    slot = now
+end
+local delays = {}
+for i = 1, tonumber(ARGV[3]) do
+    if slot - now > max_delay then
+        delays[i] = -1
+    else
+        delays[i] = slot - now
+        slot = slot + interval
+    end
+end
+redis.call('SET', KEYS[1], slot, 'PX', max_delay + interval)
+return delays
+"""
+
+class CommentEvent(NamedTuple):
+    instagram_page_id: str
+    comment_id: str
+    media_id: Optional[str]
+    sender_id: str
+    username: Optional[str]
+    text: str
+
+class CommentMatch(NamedTuple):
+    event: CommentEvent
+    account: InstagramAccount
+    rule: TriggerRule
+
+def change_key(change: Dict[str, Any]) -> Optional[str]:
+    """Idempotency key of a `changes` entry: its comment id."""
+    if change.get("field") in COMMENT_FIELDS:
+        comment_id = (change.get("value") or {}).get("id")
+        return f"comment:{comment_id}" if comment_id else None
+    return None
+
+def collect_comment_events(payload: Dict[str, Any]) -> List[CommentEvent]:
+    events = []
+    for entry in payload.get("entry", []):
+        instagram_page_id = entry.get("id")
+        for change in entry.get("changes", []):
+            if change.get("field") not in COMMENT_FIELDS:
+                continue
+            value = change.get("value") or {}
+            sender = value.get("from") or {}
+            if not instagram_page_id or not value.get("id") or not sender.get("id"):
+                continue
+            events.append(CommentEvent(
+                instagram_page_id=instagram_page_id,
+                comment_id=value["id"],
+                media_id=(value.get("media") or {}).get("id"),
+                sender_id=sender["id"],
+                username=sender.get("username"),
+                text=value.get("text") or ""
+            ))
+    return events
+
+class CommentTriggerPipeline:
+    """
+    Turns comments into comment_keyword flows, built for posts that draw
+    tens of thousands of comments.
+
+    - Triggers are matched in process against automata indexed by post
+      (see AccountTriggerMatcher); media ids are resolved to permalinks
+      only for accounts with permalink triggers, once per post.
+    - Each commenter is answered once per post: repeats within a batch
+      are coalesced and a Redis claim per (account, post, commenter)
+      drops repeats for COMMENT_TRIGGER_DEDUP_SECONDS.
+    - Replies are not sent from the webhook path. Each is a delayed
+      comment_trigger job on a per-account clock that hands out one slot
+      every 3600 / COMMENT_REPLY_RATE_PER_HOUR seconds, so a burst drains
+      at a steady rate below the Graph API limit instead of hitting it.
+      Comments that would wait longer than COMMENT_REPLY_MAX_DELAY_SECONDS
+      are dropped and their claims released.
+    """
+
+    def __init__(self):
+        self.claim_ttl_seconds = settings.COMMENT_TRIGGER_DEDUP_SECONDS
+        self.interval_ms = max(1, round(3600 * 1000 / settings.COMMENT_REPLY_RATE_PER_HOUR))
+        self.max_delay_ms = settings.COMMENT_REPLY_MAX_DELAY_SECONDS * 1000
+        self._permalinks: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def match(
+        self,
+        db: AsyncSession,
+        accounts: Dict[str, InstagramAccount],
+        events: List[CommentEvent]
+    ) -> List[CommentMatch]:
+        """Comments that match a trigger, first one per commenter and post."""
+        matches = []
+        seen = set()
+        for event in events:
+            account = accounts.get(event.instagram_page_id)
+            if account is None or event.sender_id in (account.instagram_user_id, account.instagram_page_id):
+                # The account's own replies come back as comments too
+                continue
+            key = (account.id, event.media_id, event.sender_id)
+            if key in seen:
+                continue
+            matcher = await trigger_index.get(db, account.id)
+            permalink = None
+            if matcher.has_permalink_rules and event.media_id:
+                permalink = await self.permalink(account, event.media_id)
+            rule = matcher.match_comment(event.text, media_id=event.media_id, permalink=permalink)
+            if rule is not None:
+                seen.add(key)
+                matches.append(CommentMatch(event, account, rule))
+        return matches
+
+    async def permalink(self, account: InstagramAccount, media_id: str) -> Optional[str]:
+        """Permalink of a post, from memory, Redis or the Graph API."""
+        with self._lock:
+            if media_id in self._permalinks:
+                self._permalinks.move_to_end(media_id)
+                return self._permalinks[media_id]
+
+        key = f"{PERMALINK_KEY_PREFIX}:{media_id}"
+        await redis_service.init()
+        permalink = await redis_service.redis.get(key)
+        if permalink is None:
+            try:
+                permalink = await instagram_api.get_media_permalink(media_id, account.access_token)
+            except Exception as e:
+                logger.error(f"Error looking up permalink of media {media_id}: {str(e)}")
+                return None
+            if permalink:
+                await redis_service.redis.set(key, permalink, ex=PERMALINK_TTL_SECONDS)
+
+        with self._lock:
+            self._permalinks[media_id] = permalink
+            while len(self._permalinks) > MAX_CACHED_PERMALINKS:
+                self._permalinks.popitem(last=False)
+        return permalink
+
+    def _claim_key(self, match: CommentMatch) -> str:
+        return f"{CLAIM_KEY_PREFIX}:{match.account.id}:{match.event.media_id}:{match.event.sender_id}"
+
+    async def claim(self, matches: List[CommentMatch]) -> List[CommentMatch]:
+        """Matches whose commenter has not been answered on the post yet."""
+        if not matches:
+            return []
+        flags = await redis_service.eval_script(
+            CLAIM_SCRIPT,
+            keys=[self._claim_key(match) for match in matches],
+            args=[self.claim_ttl_seconds]
+        )
+        return [match for match, claimed in zip(matches, flags) if claimed]
+
+    async def release(self, matches: List[CommentMatch]) -> None:
+        if matches:
+            await redis_service.init()
+            await redis_service.redis.delete(*(self._claim_key(match) for match in matches))
+
+    async def schedule(
+        self,
+        matches: List[CommentMatch],
+        contacts: Dict[Tuple[uuid.UUID, str], Contact]
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        (job, delay_seconds) pairs for the delayed job scheduler, paced per
+        account.
+        """
+        by_account: Dict[uuid.UUID, List[CommentMatch]] = {}
+        for match in matches:
+            by_account.setdefault(match.account.id, []).append(match)
+
+        jobs = []
+        dropped = []
+        now = int(time.time() * 1000)
+        for account_id, account_matches in by_account.items():
+            delays = await redis_service.eval_script(
+                PACE_SCRIPT,
+                keys=[f"{PACE_KEY_PREFIX}:{account_id}"],
+                args=[now, self.interval_ms, len(account_matches), self.max_delay_ms]
+            )
+            for match, delay_ms in zip(account_matches, delays):
+                if delay_ms < 0:
+                    dropped.append(match)
+                    continue
+                event = match.event
+                jobs.append(({
+                    "job_id": f"comment_trigger:{event.comment_id}",
+                    "type": "comment_trigger",
+                    "account_id": str(account_id),
+                    "contact_id": str(contacts[(account_id, event.sender_id)].id),
+                    "flow_id": str(match.rule.flow_id),
+                    "comment_id": event.comment_id,
+                    "media_id": event.media_id,
+                    "text": event.text
+                }, delay_ms / 1000))
+
+        if dropped:
+            logger.warning(f"Reply backlog full; dropped {len(dropped)} comment triggers")
+            # A later comment of the same person may still be answered
+            await self.release(dropped)
+        return jobs
+
+comment_trigger_pipeline = CommentTriggerPipeline()
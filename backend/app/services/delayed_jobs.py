@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import orjson
+from app.core.config import settings
+from app.services.job_lanes import AUTOMATION_QUEUE, job_lane, lane_queue
+from app.services.redis_service import redis_service
+from app.services.timing_wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+
+DUE_KEY = "scheduler:due"
+INFLIGHT_KEY = "scheduler:inflight"
+OWNERS_KEY = "scheduler:owners"
+PAYLOADS_KEY = "scheduler:jobs"
+# Sorted set of the old poller: JSON payloads scored by due time in seconds
+LEGACY_DELAYED_KEY = f"{AUTOMATION_QUEUE}:delayed"
+
+# Moves up to ARGV[2] jobs due before ARGV[1] from the due set to the
+# inflight set, leased to ARGV[4] until ARGV[3] ms past their due time.
+# Returns a flat list of id, due time, payload.
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+local claimed = {}
+for i = 1, #due, 2 do
+    local id = due[i]
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], tonumber(due[i + 1]) + tonumber(ARGV[3]), id)
+    redis.call('HSET', KEYS[3], id, ARGV[4])
+    table.insert(claimed, id)
+    table.insert(claimed, due[i + 1])
+    table.insert(claimed, redis.call('HGET', KEYS[4], id) or '')
+end
+return claimed
+"""
+
+# Pushes each job (ARGV[k + 1], onto queue KEYS[k + 3]) still leased to
+# ARGV[1] and forgets it. Jobs whose lease was taken over are skipped, so
+# a job is dispatched once even if its first owner stalled.
+FIRE_SCRIPT = """
+local fired = 0
+for i = 2, #ARGV do
+    local id = ARGV[i]
+    if redis.call('HGET', KEYS[2], id) == ARGV[1] then
+        local payload = redis.call('HGET', KEYS[3], id)
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('HDEL', KEYS[2], id)
+        redis.call('HDEL', KEYS[3], id)
+        if payload then
+            redis.call('RPUSH', KEYS[i + 2], payload)
+            fired = fired + 1
+        end
+    end
+end
+return fired
+"""
+
+# Returns jobs leased to ARGV[1] (ARGV[3..]) to the due set at their
+# original due time.
+RELEASE_SCRIPT = """
+for i = 3, #ARGV do
+    local id = ARGV[i]
+    if redis.call('HGET', KEYS[2], id) == ARGV[1] then
+        local lease = redis.call('ZSCORE', KEYS[1], id)
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('HDEL', KEYS[2], id)
+        if lease then
+            redis.call('ZADD', KEYS[3], tonumber(lease) - tonumber(ARGV[2]), id)
+        end
+    end
+end
+return 1
+"""
+
+# Hands up to ARGV[2] jobs whose lease ended before ARGV[1] back to the due
+# set, for owners that died while holding them.
+REAP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+for i = 1, #expired, 2 do
+    redis.call('ZREM', KEYS[1], expired[i])
+    redis.call('HDEL', KEYS[2], expired[i])
+    redis.call('ZADD', KEYS[3], tonumber(expired[i + 1]) - tonumber(ARGV[3]), expired[i])
+end
+return #expired / 2
+"""
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+def job_queue(job: Dict[str, Any]) -> str:
+    """Queue a due job is dispatched to: its contact's lane if it has one."""
+    lane = job_lane(job)
+    return lane_queue(lane) if lane is not None else AUTOMATION_QUEUE
+
+class DelayedJobScheduler:
+    """
+    Durable delayed jobs on a Redis sorted set.
+
+    Pending jobs are ids in DUE_KEY scored by due time, with payloads in a
+    hash, so millions of waits cost one sorted set entry each. Every worker
+    process claims jobs that fall due within the next few seconds in
+    bounded batches, leasing them so no other process can claim them, and
+    holds them in a timing wheel until they fire onto the automation
+    queues. A lease is only released by firing, by a clean shutdown or,
+    when the owner died, by the reaper; firing checks the lease, so a job
+    never fires twice.
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.tick_ms = settings.SCHEDULER_TICK_MS
+        self.horizon_ms = settings.SCHEDULER_HORIZON_SECONDS * 1000
+        self.lease_ms = settings.SCHEDULER_LEASE_SECONDS * 1000
+        self.claim_batch_size = settings.SCHEDULER_CLAIM_BATCH_SIZE
+        self.max_held = settings.SCHEDULER_MAX_HELD
+        self.wheel: Optional[TimingWheel] = None
+        self.held: Dict[str, Dict[str, Any]] = {}
+        self.running = False
+
+    async def schedule(
+        self,
+        job: Dict[str, Any],
+        delay_seconds: float,
+        job_id: Optional[str] = None
+    ) -> str:
+        """Schedule a job to be queued after delay_seconds."""
+        job_id = job_id or job.get("job_id") or str(uuid.uuid4())
+        await self.schedule_many([({**job, "job_id": job_id}, delay_seconds)])
+        return job_id
+
+    async def schedule_many(self, jobs: Iterable[Tuple[Dict[str, Any], float]]) -> None:
+        """
+        Schedule (job, delay_seconds) pairs in one round trip. Jobs carry
+        their job_id; scheduling an id again moves it to the new due time.
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return
+        now = _now_ms()
+        await redis_service.init()
+        async with redis_service.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(PAYLOADS_KEY, mapping={
+                job["job_id"]: orjson.dumps(job).decode("utf-8") for job, _ in jobs
+            })
+            pipe.zadd(DUE_KEY, {
+                job["job_id"]: now + int(delay_seconds * 1000) for job, delay_seconds in jobs
+            })
+            await pipe.execute()
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not been claimed yet."""
+        await redis_service.init()
+        async with redis_service.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(DUE_KEY, job_id)
+            pipe.hdel(PAYLOADS_KEY, job_id)
+            removed, _ = await pipe.execute()
+        return bool(removed)
+
+    async def claim(self) -> int:
+        """Lease jobs falling due within the horizon into the wheel."""
+        room = min(self.claim_batch_size, self.max_held - len(self.held))
+        if room <= 0:
+            return 0
+        now = _now_ms()
+        claimed = await redis_service.eval_script(
+            CLAIM_SCRIPT,
+            keys=[DUE_KEY, INFLIGHT_KEY, OWNERS_KEY, PAYLOADS_KEY],
+            args=[now + self.horizon_ms, room, self.lease_ms, self.owner]
+        )
+        for index in range(0, len(claimed), 3):
+            job_id, due_ms, payload = claimed[index:index + 3]
+            job = orjson.loads(payload) if payload else {}
+            self.held[job_id] = job
+            self.wheel.add(int(float(due_ms)), job_id)
+        return len(claimed) // 3
+
+    async def fire(self, job_ids: List[str]) -> int:
+        """Dispatch expired jobs onto their queues."""
+        queues = [job_queue(self.held.pop(job_id)) for job_id in job_ids]
+        return await redis_service.eval_script(
+            FIRE_SCRIPT,
+            keys=[INFLIGHT_KEY, OWNERS_KEY, PAYLOADS_KEY, *queues],
+            args=[self.owner, *job_ids]
+        )
+
+    async def reap(self) -> int:
+        """Return jobs of dead owners whose lease ran out to the due set."""
+        return await redis_service.eval_script(
+            REAP_SCRIPT,
+            keys=[INFLIGHT_KEY, OWNERS_KEY, DUE_KEY],
+            args=[_now_ms(), self.claim_batch_size, self.lease_ms]
+        )
+
+    async def release(self) -> None:
+        """Hand every job held in the wheel back to the due set."""
+        if not self.held:
+            return
+        await redis_service.eval_script(
+            RELEASE_SCRIPT,
+            keys=[INFLIGHT_KEY, OWNERS_KEY, DUE_KEY],
+            args=[self.owner, self.lease_ms, *self.held]
+        )
+        self.held.clear()
+
+    async def drain_legacy(self) -> int:
+        """
+        Move jobs left in the old poller's sorted set to the due set, at
+        their original due time. Each batch moves in one transaction, and
+        one process drains at a time, so no job is lost or moved twice.
+        """
+        await redis_service.init()
+        if not await redis_service.set_lock(LEGACY_DELAYED_KEY, self.owner, expiry_seconds=60):
+            return 0
+        moved = 0
+        try:
+            while True:
+                entries = await redis_service.redis.zrange(
+                    LEGACY_DELAYED_KEY, 0, self.claim_batch_size - 1, withscores=True
+                )
+                if not entries:
+                    break
+                payloads = {}
+                due = {}
+                for payload, due_seconds in entries:
+                    job = orjson.loads(payload)
+                    # Stable ids, so a job moved by a batch that failed to
+                    # commit keeps its id when moved again
+                    job_id = job.get("job_id") or f"legacy:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+                    payloads[job_id] = orjson.dumps({**job, "job_id": job_id}).decode("utf-8")
+                    due[job_id] = int(due_seconds * 1000)
+                async with redis_service.redis.pipeline(transaction=True) as pipe:
+                    pipe.hset(PAYLOADS_KEY, mapping=payloads)
+                    pipe.zadd(DUE_KEY, due)
+                    pipe.zrem(LEGACY_DELAYED_KEY, *(payload for payload, _ in entries))
+                    await pipe.execute()
+                moved += len(entries)
+        finally:
+            await redis_service.release_lock(LEGACY_DELAYED_KEY, self.owner)
+        if moved:
+            logger.info(f"Moved {moved} delayed jobs from {LEGACY_DELAYED_KEY} to the scheduler")
+        return moved
+
+    async def run(self) -> None:
+        """Claim, fire and reap until stopped."""
+        self.running = True
+        try:
+            await self.drain_legacy()
+        except Exception as e:
+            logger.error(f"Error draining legacy delayed jobs: {str(e)}")
+        self.wheel = TimingWheel(tick_ms=self.tick_ms, start_ms=_now_ms())
+        tick_seconds = self.tick_ms / 1000
+        reap_every = max(1, self.lease_ms // self.tick_ms)
+        ticks = 0
+        try:
+            while self.running:
+                try:
+                    # Claiming every tick keeps short delays precise; full
+                    # batches mean a backlog, so keep going up to max_held
+                    while await self.claim() == self.claim_batch_size and self.running:
+                        pass
+                    expired = self.wheel.advance(_now_ms())
+                    if expired:
+                        await self.fire(expired)
+                    if ticks % reap_every == 0:
+                        await self.reap()
+                except Exception as e:
+                    logger.error(f"Error in delayed job scheduler: {str(e)}")
+                ticks += 1
+                await asyncio.sleep(tick_seconds)
+        finally:
+            try:
+                await self.release()
+            except Exception as e:
+                # Leases run out and the reaper takes over
+                logger.error(f"Error releasing delayed jobs: {str(e)}")
+
+    def stop(self) -> None:
+        self.running = False
+
+delayed_job_scheduler = DelayedJobScheduler()
@@ -0,0 +1,283 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.flow import Flow, FlowStatus, FlowVersion
+from app.services.flow_conditions import Condition, compile_condition, compile_input_validator
+from app.services.flow_state import FlowState
+from app.services.message_templates import Renderer, compile_content
+
+if TYPE_CHECKING:
+    from app.models.contact import Contact
+    from app.models.message_log import MessageLog
+
+logger = logging.getLogger(__name__)
+
+class CompiledNode:
+    """
+    A flow node with its outgoing connections turned into lookup tables.
+
+    branches maps the value-indexed condition types (button_payload and
+    input_valid) to {condition value: target node id}, so picking one of
+    many buttons is one dict lookup. conditions holds the compiled
+    predicates of the other condition types in connection order.
+    default_target is the first unconditional connection. Conditional
+    connections listed after an unconditional one can never be taken (the
+    interpreter stopped at the first match) and are left out.
+
+    render_content renders the message content of a message node from its
+    precompiled templates.
+    """
+    __slots__ = (
+        "id", "type", "definition", "default_target", "branches", "conditions",
+        "validate_input", "render_content"
+    )
+
+    INDEXED_CONDITION_TYPES = ("button_payload", "input_valid")
+
+    def __init__(self, definition: Dict[str, Any]):
+        self.id = definition["id"]
+        self.type = definition["type"]
+        self.definition = definition
+        self.default_target: Optional[str] = None
+        self.branches: Dict[str, Dict[Any, str]] = {}
+        self.conditions: List[Tuple[Condition, str]] = []
+        self.validate_input = compile_input_validator(definition)
+        self.render_content: Optional[Renderer] = None
+        if self.type == "message":
+            self.render_content, _ = compile_content(definition.get("content") or {})
+
+        for connection in definition.get("connections", []):
+            condition = connection.get("condition")
+            if not condition:
+                self.default_target = connection["targetNodeId"]
+                break
+            if condition["type"] in self.INDEXED_CONDITION_TYPES:
+                # First connection wins for a repeated value, as in connection order
+                self.branches.setdefault(condition["type"], {}).setdefault(
+                    condition.get("value"), connection["targetNodeId"]
+                )
+                continue
+            predicate = compile_condition(condition)
+            if predicate is not None:
+                self.conditions.append((predicate, connection["targetNodeId"]))
+
+    def next_target(self, contact: "Contact", state: FlowState, message: Optional["MessageLog"]) -> Optional[str]:
+        """
+        Target node id for a contact leaving this node: a matching button
+        payload, then the input_valid branch for the reply, then the first
+        matching compiled condition, then the default connection.
+        """
+        if message is not None:
+            payloads = self.branches.get("button_payload")
+            if payloads and message.type == "button_response":
+                target = payloads.get((message.content or {}).get("payload"))
+                if target:
+                    return target
+
+            validity = self.branches.get("input_valid")
+            if validity:
+                target = validity.get(self.validate_input(message))
+                if target:
+                    return target
+
+        for predicate, target in self.conditions:
+            if predicate(contact, state, message):
+                return target
+        return self.default_target
+
+def definition_hash(flow_definition: Dict[str, Any]) -> str:
+    """Content hash of a flow definition, independent of key order."""
+    return hashlib.sha256(orjson.dumps(flow_definition, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+class CompiledGraph:
+    """
+    Immutable, indexed form of a flow definition.
+
+    Graphs are identified by content hash only, so flows with the same
+    definition (e.g. duplicated to another account) share one.
+    """
+    __slots__ = ("content_hash", "start_node_id", "nodes")
+
+    def __init__(self, content_hash: str, flow_definition: Dict[str, Any]):
+        self.content_hash = content_hash
+        self.start_node_id: str = flow_definition["startNodeId"]
+        self.nodes: Dict[str, CompiledNode] = {
+            node["id"]: CompiledNode(node) for node in flow_definition["nodes"]
+        }
+
+    def node(self, node_id: Optional[str]) -> Optional[CompiledNode]:
+        return self.nodes.get(node_id)
+
+class GraphCache:
+    """
+    Bounded LRU of compiled graphs by content hash, and of the graph of
+    each flow version by version id.
+
+    Both keys name immutable content, so entries are never invalidated;
+    eviction only bounds memory.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._graphs: "OrderedDict[str, CompiledGraph]" = OrderedDict()
+        self._versions: "OrderedDict[str, CompiledGraph]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, entries: OrderedDict, key: str, graph: CompiledGraph) -> None:
+        entries[key] = graph
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def get_or_compile(self, flow_definition: Dict[str, Any], content_hash: Optional[str] = None) -> CompiledGraph:
+        content_hash = content_hash or definition_hash(flow_definition)
+        with self._lock:
+            graph = self._graphs.get(content_hash)
+            if graph is not None:
+                self._graphs.move_to_end(content_hash)
+                return graph
+        graph = CompiledGraph(content_hash, flow_definition)
+        with self._lock:
+            # Keep the graph another thread may have compiled meanwhile
+            graph = self._graphs.get(content_hash, graph)
+            self._remember(self._graphs, content_hash, graph)
+        return graph
+
+    def for_version(self, version_id: Any) -> Optional[CompiledGraph]:
+        key = str(version_id)
+        with self._lock:
+            graph = self._versions.get(key)
+            if graph is not None:
+                self._versions.move_to_end(key)
+            return graph
+
+    def put_version(self, version_id: Any, graph: CompiledGraph) -> None:
+        with self._lock:
+            self._remember(self._versions, str(version_id), graph)
+
+    def add_version(self, version: FlowVersion) -> CompiledGraph:
+        graph = self.get_or_compile(version.flow_definition, version.content_hash)
+        self.put_version(version.id, graph)
+        return graph
+
+graph_cache = GraphCache(max_size=settings.FLOW_GRAPH_CACHE_SIZE)
+
+class CompiledFlow:
+    """
+    A flow with the compiled graph of its current version.
+
+    Contacts already in the flow keep running on the version they started
+    on (see GraphCache.for_version); this is only used to start it.
+    """
+    __slots__ = ("flow_id", "instagram_account_id", "updated_at", "status", "version_id", "graph")
+
+    def __init__(self, flow: Flow):
+        self.flow_id = flow.id
+        self.instagram_account_id = flow.instagram_account_id
+        self.updated_at: Optional[datetime] = flow.updated_at
+        self.status = flow.status
+        self.version_id = flow.current_version_id
+        self.graph = graph_cache.get_or_compile(flow.flow_definition)
+        if self.version_id is not None:
+            graph_cache.put_version(self.version_id, self.graph)
+
+    @property
+    def start_node_id(self) -> str:
+        return self.graph.start_node_id
+
+    def node(self, node_id: Optional[str]) -> Optional[CompiledNode]:
+        return self.graph.nodes.get(node_id)
+
+class FlowCache:
+    """
+    Bounded LRU of compiled flows, keyed by flow id.
+
+    Entries are compiled once per (flow_id, updated_at); callers holding a
+    Flow row use get_for() so an edited flow is recompiled, while hot paths
+    that only know the flow id use get() and rely on invalidate() being
+    called when a flow changes.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, CompiledFlow]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, flow_id: Any) -> Optional[CompiledFlow]:
+        key = str(flow_id)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+            return compiled
+
+    def get_for(self, flow: Flow) -> CompiledFlow:
+        compiled = self.get(flow.id)
+        if compiled is not None and compiled.updated_at == flow.updated_at:
+            return compiled
+        compiled = CompiledFlow(flow)
+        self.put(compiled)
+        return compiled
+
+    def put(self, compiled: CompiledFlow) -> None:
+        key = str(compiled.flow_id)
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, flow_id: Any) -> None:
+        with self._lock:
+            self._entries.pop(str(flow_id), None)
+
+    def invalidate_account(self, instagram_account_id: Any) -> None:
+        with self._lock:
+            stale = [
+                key for key, compiled in self._entries.items()
+                if str(compiled.instagram_account_id) == str(instagram_account_id)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def cached_account_ids(self) -> set:
+        with self._lock:
+            return {str(compiled.instagram_account_id) for compiled in self._entries.values()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    async def preload(self, db: AsyncSession) -> int:
+        """
+        Compile the active flows, most recently edited first, so the first
+        messages after a deploy do not pay for it.
+        """
+        flows = (await db.scalars(
+            select(Flow)
+            .where(Flow.status == FlowStatus.ACTIVE)
+            .order_by(Flow.updated_at.desc())
+            .limit(self.max_size)
+        )).all()
+        for flow in flows:
+            self.put(CompiledFlow(flow))
+        return len(flows)
+
+flow_cache = FlowCache(max_size=settings.FLOW_CACHE_SIZE)
+
+async def preload_flows() -> None:
+    """Warm this process's flow cache at startup; a failure only costs warmth."""
+    try:
+        async with AsyncSessionLocal() as db:
+            count = await flow_cache.preload(db)
+        logger.info(f"Preloaded {count} compiled flows")
+    except Exception as e:
+        logger.error(f"Error preloading flows: {str(e)}")
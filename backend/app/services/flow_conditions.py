@@ -0,0 +1,90 @@
+import re
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+from app.services.flow_state import FlowState
+from app.services.message_templates import CONTACT_FIELDS
+
+if TYPE_CHECKING:
+    from app.models.contact import Contact
+    from app.models.message_log import MessageLog
+
+# Decides a conditional connection for a contact, its flow state and the
+# message being handled (None when a flow is resumed by a timer)
+Condition = Callable[["Contact", FlowState, Optional["MessageLog"]], bool]
+InputValidator = Callable[[Optional["MessageLog"]], bool]
+
+INPUT_PATTERNS: Dict[str, "re.Pattern"] = {
+    "email": re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+"),
+    "phone": re.compile(r"\+?[0-9][0-9 \-]*"),
+}
+
+def _message_text(message: Optional["MessageLog"]) -> str:
+    if message is None:
+        return ""
+    return (message.content or {}).get("text") or ""
+
+def compile_input_validator(node: Dict[str, Any]) -> InputValidator:
+    """
+    Validity of a reply to a get_input node, by its inputType; replies to
+    other nodes and to input types without a pattern are always valid.
+    """
+    pattern = INPUT_PATTERNS.get(node.get("inputType")) if node.get("type") == "get_input" else None
+    if pattern is None:
+        return lambda message: True
+    return lambda message: pattern.fullmatch(_message_text(message).strip()) is not None
+
+def _attribute_getter(attribute: str) -> Callable[["Contact", FlowState], Any]:
+    """
+    Getter for a contact attribute: a profile field (contact.firstName),
+    a flow context key (flow.<key>), tags, or a custom attribute, with or
+    without the custom. prefix.
+    """
+    namespace, _, key = attribute.partition(".")
+    if namespace == "contact" and key in CONTACT_FIELDS:
+        field = CONTACT_FIELDS[key]
+        return lambda contact, state: field(contact)
+    if namespace == "flow" and key:
+        return lambda contact, state: state.context.get(key)
+    if attribute == "tags":
+        return lambda contact, state: state.tags
+    if namespace == "custom" and key:
+        attribute = key
+    return lambda contact, state: (contact.custom_attributes or {}).get(attribute)
+
+def compile_condition(condition: Dict[str, Any]) -> Optional[Condition]:
+    """
+    Compile a keyword or attribute_equals connection condition into a
+    predicate, or return None for other types.
+
+    keyword matches any of its comma-separated keywords as a whole word of
+    the message text, ignoring case. attribute_equals compares an attribute
+    (see _attribute_getter) with the value, as strings when the types
+    differ; for tags it tests membership.
+    """
+    condition_type = condition.get("type")
+    value = condition.get("value")
+
+    if condition_type == "keyword":
+        keywords = [keyword.strip() for keyword in str(value or "").split(",") if keyword.strip()]
+        if not keywords:
+            return None
+        pattern = re.compile(
+            r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + r")\b",
+            re.IGNORECASE
+        )
+        return lambda contact, state, message: pattern.search(_message_text(message)) is not None
+
+    if condition_type == "attribute_equals":
+        attribute = condition.get("attribute")
+        if not attribute:
+            return None
+        getter = _attribute_getter(attribute)
+        expected = str(value)
+        if attribute == "tags":
+            return lambda contact, state, message: expected in getter(contact, state)
+
+        def attribute_equals(contact: "Contact", state: FlowState, message: Optional["MessageLog"]) -> bool:
+            actual = getter(contact, state)
+            return actual == value or (actual is not None and str(actual) == expected)
+        return attribute_equals
+
+    return None
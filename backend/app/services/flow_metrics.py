@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY_PREFIX = "flow_metrics"
+METRICS_TTL_SECONDS = 24 * 60 * 60
+# Flow id of series not attributable to one flow (e.g. a batch commit)
+ALL_FLOWS = "*"
+
+# Upper bounds of the latency buckets, in microseconds; one more bucket
+# counts everything slower
+BUCKET_BOUNDS_US = (
+    1, 2, 5, 10, 20, 50, 100, 200, 500,
+    1000, 2000, 5000, 10000, 20000, 50000,
+    100000, 200000, 500000, 1000000, 2000000, 5000000,
+)
+BUCKET_BOUNDS_NS = tuple(bound * 1000 for bound in BUCKET_BOUNDS_US)
+# Positions of the count fields in a series list
+COUNT, SUM_NS, ERRORS, QUERIES, FIRST_BUCKET = 0, 1, 2, 3, 4
+
+class FlowMetrics:
+    """
+    In-process registry of latency histograms, error counts and database
+    query counts, per (flow id, kind, name).
+
+    kind is what was timed: "node" (name: node type) for running a node,
+    "branch" for choosing the next node, "event" (name: event type) for
+    handling one inbound event, "send" for Graph API sends and "flush" for
+    the phases of a flush.
+
+    Series are plain lists mutated only from the event loop thread, so
+    recording takes no lock: one dict lookup, a bisect and a few integer
+    additions, well under a microsecond. The reporter swaps the registry
+    out and adds the snapshot to per-minute Redis hashes, which
+    get_summary() merges across processes.
+    """
+
+    def __init__(self):
+        self.enabled = settings.FLOW_METRICS_ENABLED
+        self.report_interval_seconds = settings.FLOW_METRICS_REPORT_SECONDS
+        self._series: Dict[Tuple[Any, str, str], List[int]] = {}
+        self.running = False
+
+    def record(
+        self,
+        flow_id: Any,
+        kind: str,
+        name: str,
+        elapsed_ns: int,
+        error: bool = False,
+        queries: int = 0
+    ) -> None:
+        # Flow ids are stringified when reported, not per call
+        key = (flow_id or ALL_FLOWS, kind, name)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (FIRST_BUCKET + len(BUCKET_BOUNDS_NS) + 1)
+        series[COUNT] += 1
+        series[SUM_NS] += elapsed_ns
+        series[FIRST_BUCKET + bisect_left(BUCKET_BOUNDS_NS, elapsed_ns)] += 1
+        if error:
+            series[ERRORS] += 1
+        if queries:
+            series[QUERIES] += queries
+
+    def snapshot(self) -> Dict[Tuple[Any, str, str], List[int]]:
+        """Take the series recorded since the last snapshot."""
+        series, self._series = self._series, {}
+        return series
+
+    async def report(self) -> None:
+        """Add the series recorded since the last report to Redis."""
+        series = self.snapshot()
+        if not series:
+            return
+        key = f"{METRICS_KEY_PREFIX}:{int(time.time() // 60)}"
+        await redis_service.init()
+        async with redis_service.redis.pipeline(transaction=False) as pipe:
+            for (flow_id, kind, name), values in series.items():
+                prefix = f"{flow_id}|{kind}|{name}|"
+                for index, value in enumerate(values):
+                    if value:
+                        pipe.hincrby(key, f"{prefix}{index}", value)
+            pipe.expire(key, METRICS_TTL_SECONDS)
+            await pipe.execute()
+
+    async def run_reporter(self) -> None:
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.report_interval_seconds)
+            try:
+                await self.report()
+            except Exception as e:
+                logger.error(f"Error reporting flow metrics: {str(e)}")
+
+    def stop(self) -> None:
+        self.running = False
+
+    async def get_summary(self, minutes: int = 60, flow_id: Optional[Any] = None) -> List[Dict[str, Any]]:
+        """
+        Series of the last minutes across all processes, optionally of one
+        flow, with count, mean, percentiles (bucket upper bounds), errors
+        and database queries per call.
+        """
+        await redis_service.init()
+        current_minute = int(time.time() // 60)
+        async with redis_service.redis.pipeline(transaction=False) as pipe:
+            for minute in range(current_minute - minutes + 1, current_minute + 1):
+                pipe.hgetall(f"{METRICS_KEY_PREFIX}:{minute}")
+            minutes_data = await pipe.execute()
+
+        merged: Dict[Tuple[str, str, str], List[int]] = {}
+        size = FIRST_BUCKET + len(BUCKET_BOUNDS_NS) + 1
+        for data in minutes_data:
+            for field, value in data.items():
+                series_flow_id, kind, name, index = field.split("|")
+                if flow_id is not None and series_flow_id != str(flow_id):
+                    continue
+                series = merged.setdefault((series_flow_id, kind, name), [0] * size)
+                series[int(index)] += int(value)
+
+        return [
+            {
+                "flow_id": series_flow_id,
+                "kind": kind,
+                "name": name,
+                "count": series[COUNT],
+                "errors": series[ERRORS],
+                "mean_us": round(series[SUM_NS] / series[COUNT] / 1000, 1) if series[COUNT] else 0.0,
+                "p50_us": _percentile_us(series, 0.50),
+                "p95_us": _percentile_us(series, 0.95),
+                "p99_us": _percentile_us(series, 0.99),
+                "queries_per_call": round(series[QUERIES] / series[COUNT], 2) if series[COUNT] else 0.0,
+            }
+            for (series_flow_id, kind, name), series in sorted(merged.items())
+        ]
+
+def _percentile_us(series: List[int], fraction: float) -> Optional[int]:
+    """Upper bound of the bucket holding the percentile; None past the last bound."""
+    rank = fraction * series[COUNT]
+    seen = 0
+    for index, count in enumerate(series[FIRST_BUCKET:]):
+        seen += count
+        if count and seen >= rank:
+            return BUCKET_BOUNDS_US[index] if index < len(BUCKET_BOUNDS_US) else None
+    return None
+
+flow_metrics = FlowMetrics()
@@ -0,0 +1,372 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+import orjson
+from sqlalchemy import bindparam, update
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.contact import Contact
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY_PREFIX = "flow_state:"
+DIRTY_KEY = "flow_state:dirty"
+FLUSHING_KEY = "flow_state:flushing"
+
+# Leases dirty contacts (ARGV[3..], state hashes in KEYS[3..]) to the
+# flusher until ARGV[1] + ARGV[2] ms, returning each id still dirty with
+# its current hash.
+CLAIM_SCRIPT = """
+local claimed = {}
+for i = 3, #ARGV do
+    local id = ARGV[i]
+    if redis.call('ZREM', KEYS[1], id) == 1 then
+        redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[2]), id)
+        table.insert(claimed, id)
+        table.insert(claimed, redis.call('HGETALL', KEYS[i]))
+    end
+end
+return claimed
+"""
+
+# Marks contacts (ARGV[2..], state hashes in KEYS[3..]) as persisted. A
+# contact changed again while it was being written is still in the dirty
+# set and keeps no TTL.
+ACK_SCRIPT = """
+for i = 2, #ARGV do
+    local id = ARGV[i]
+    redis.call('ZREM', KEYS[1], id)
+    if not redis.call('ZSCORE', KEYS[2], id) then
+        redis.call('EXPIRE', KEYS[i + 1], tonumber(ARGV[1]))
+    end
+end
+return 1
+"""
+
+# Puts contacts whose flush lease ran out (the flusher died) back into the
+# dirty set.
+REAP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], 'NX', ARGV[1], id)
+end
+return #expired
+"""
+
+# Saves states (KEYS[2..]) saved last at the version they were loaded at;
+# ARGV[1] is the time, then per state its id, that version and its fields.
+# A state is journaled in the dirty set and its version bumped; states
+# saved meanwhile by another worker are left alone and their ids returned.
+# Tags added meanwhile (see ADD_TAGS_SCRIPT) are kept.
+SAVE_SCRIPT = """
+local conflicts = {}
+for i = 2, #KEYS do
+    local base = (i - 2) * 7 + 1
+    local id = ARGV[base + 1]
+    local version = tonumber(redis.call('HGET', KEYS[i], 'v') or '0')
+    if version ~= tonumber(ARGV[base + 2]) then
+        table.insert(conflicts, id)
+    else
+        local tags = ARGV[base + 7]
+        local current = redis.call('HGET', KEYS[i], 'tags')
+        if current then
+            local merged = cjson.decode(tags)
+            local present = {}
+            for _, tag in ipairs(merged) do
+                present[tag] = true
+            end
+            local added = false
+            for _, tag in ipairs(cjson.decode(current)) do
+                if not present[tag] then
+                    table.insert(merged, tag)
+                    present[tag] = true
+                    added = true
+                end
+            end
+            if added then
+                tags = cjson.encode(merged)
+            end
+        end
+        redis.call(
+            'HSET', KEYS[i],
+            'flow', ARGV[base + 3], 'ver', ARGV[base + 4], 'node', ARGV[base + 5],
+            'ctx', ARGV[base + 6], 'tags', tags, 'v', version + 1
+        )
+        -- Unflushed state must not expire
+        redis.call('PERSIST', KEYS[i])
+        -- NX keeps the time of the oldest unflushed change
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[1], id)
+    end
+end
+return conflicts
+"""
+
+# Adds tags (ARGV[3..]) to a cached state (KEYS[2]) of contact ARGV[2], if
+# there is one, and journals it in the dirty set (KEYS[1]) at ARGV[1].
+ADD_TAGS_SCRIPT = """
+local tags = redis.call('HGET', KEYS[2], 'tags')
+if not tags then
+    return 0
+end
+tags = cjson.decode(tags)
+local present = {}
+for _, tag in ipairs(tags) do
+    present[tag] = true
+end
+for i = 3, #ARGV do
+    local tag = ARGV[i]
+    if not present[tag] then
+        table.insert(tags, tag)
+        present[tag] = true
+    end
+end
+redis.call('HSET', KEYS[2], 'tags', cjson.encode(tags))
+redis.call('PERSIST', KEYS[2])
+redis.call('ZADD', KEYS[1], 'NX', ARGV[1], ARGV[2])
+return 1
+"""
+
+class FlowState:
+    """
+    Flow position (flow, pinned flow version and node), flow context and
+    tags of one contact.
+
+    The automation engine reads and writes these instead of the Contact
+    columns; FlowStateStore persists them. `version` counts the saves of
+    the cached state, so a save can tell another one came in between.
+    """
+    __slots__ = ("contact_id", "flow_id", "version_id", "node_id", "context", "tags", "version", "_loaded")
+
+    def __init__(
+        self,
+        contact_id: uuid.UUID,
+        flow_id: Optional[uuid.UUID],
+        node_id: Optional[str],
+        context: Dict[str, Any],
+        tags: List[str],
+        version_id: Optional[uuid.UUID] = None,
+        version: int = 0
+    ):
+        self.contact_id = contact_id
+        self.flow_id = flow_id
+        self.version_id = version_id
+        self.node_id = node_id
+        self.context = context
+        self.tags = tags
+        self.version = version
+        self._loaded = self.to_hash()
+
+    @classmethod
+    def from_contact(cls, contact: Contact) -> "FlowState":
+        return cls(
+            contact_id=contact.id,
+            flow_id=contact.current_flow_id,
+            version_id=contact.current_flow_version_id,
+            node_id=contact.current_flow_step_node_id,
+            context=dict(contact.flow_context or {}),
+            tags=list(contact.tags or [])
+        )
+
+    @classmethod
+    def from_hash(cls, contact_id: uuid.UUID, data: Dict[str, str]) -> "FlowState":
+        return cls(
+            contact_id=contact_id,
+            flow_id=uuid.UUID(data["flow"]) if data.get("flow") else None,
+            version_id=uuid.UUID(data["ver"]) if data.get("ver") else None,
+            node_id=data.get("node") or None,
+            context=orjson.loads(data.get("ctx") or "{}"),
+            tags=orjson.loads(data.get("tags") or "[]"),
+            version=int(data.get("v") or 0)
+        )
+
+    def to_hash(self) -> Dict[str, str]:
+        return {
+            "flow": str(self.flow_id) if self.flow_id else "",
+            "ver": str(self.version_id) if self.version_id else "",
+            "node": self.node_id or "",
+            "ctx": orjson.dumps(self.context).decode("utf-8"),
+            "tags": orjson.dumps(self.tags).decode("utf-8"),
+        }
+
+    def clear(self) -> None:
+        """Leave the current flow."""
+        self.flow_id = None
+        self.version_id = None
+        self.node_id = None
+        self.context = {}
+
+    def is_changed(self) -> bool:
+        return self.to_hash() != self._loaded
+
+    def mark_saved(self) -> None:
+        self._loaded = self.to_hash()
+
+class FlowStateStore:
+    """
+    Write-behind store of contacts' flow state.
+
+    The state of contacts with recent activity lives in one small Redis
+    hash each and is read and written there on the message path. Saving a
+    state compares its version first, so a worker never overwrites a state
+    saved since it read it, and adds the contact to a dirty sorted set in
+    the same script; that set is the journal the flusher drains into the
+    contacts table in batches, so many changes to one contact cost one
+    UPDATE. The journal survives process crashes, and contacts leased by a
+    flusher that died are put back after FLOW_STATE_FLUSH_LEASE_SECONDS.
+    Durability across Redis restarts depends on Redis persistence (AOF).
+
+    Persisted states expire from Redis after FLOW_STATE_TTL_SECONDS and
+    are loaded from the contact row again on the next message.
+    """
+
+    def __init__(self):
+        self.ttl_seconds = settings.FLOW_STATE_TTL_SECONDS
+        self.flush_batch_size = settings.FLOW_STATE_FLUSH_BATCH_SIZE
+        self.flush_interval_seconds = settings.FLOW_STATE_FLUSH_INTERVAL_SECONDS
+        self.lease_ms = settings.FLOW_STATE_FLUSH_LEASE_SECONDS * 1000
+        self.running = False
+
+    async def load_many(self, contacts: Iterable[Contact]) -> Dict[uuid.UUID, FlowState]:
+        """Current state of each contact, from Redis or else from its row."""
+        contacts = list(contacts)
+        if not contacts:
+            return {}
+        await redis_service.init()
+        async with redis_service.redis.pipeline(transaction=False) as pipe:
+            for contact in contacts:
+                pipe.hgetall(f"{STATE_KEY_PREFIX}{contact.id}")
+            cached = await pipe.execute()
+        return {
+            contact.id: FlowState.from_hash(contact.id, data) if data else FlowState.from_contact(contact)
+            for contact, data in zip(contacts, cached)
+        }
+
+    async def save_many(self, states: Iterable[FlowState]) -> List[uuid.UUID]:
+        """
+        Store states in Redis and journal them for the flusher, in one
+        transaction. Returns the contacts whose state another worker saved
+        since it was loaded; those states are not stored.
+        """
+        states = list(states)
+        if not states:
+            return []
+        args: List[Any] = [int(time.time() * 1000)]
+        for state in states:
+            fields = state.to_hash()
+            args.extend((
+                str(state.contact_id), state.version,
+                fields["flow"], fields["ver"], fields["node"], fields["ctx"], fields["tags"]
+            ))
+        conflicts = set(await redis_service.eval_script(
+            SAVE_SCRIPT,
+            keys=[DIRTY_KEY, *(f"{STATE_KEY_PREFIX}{state.contact_id}" for state in states)],
+            args=args
+        ))
+        conflicted = []
+        for state in states:
+            if str(state.contact_id) in conflicts:
+                logger.warning(f"Flow state of contact {state.contact_id} was saved concurrently; not overwritten")
+                conflicted.append(state.contact_id)
+            else:
+                state.version += 1
+                state.mark_saved()
+        return conflicted
+
+    async def add_tags(self, contact_id: Any, tags: List[str]) -> None:
+        """Apply tags added outside the engine to a cached state."""
+        if tags:
+            await redis_service.eval_script(
+                ADD_TAGS_SCRIPT,
+                keys=[DIRTY_KEY, f"{STATE_KEY_PREFIX}{contact_id}"],
+                args=[int(time.time() * 1000), str(contact_id), *tags]
+            )
+
+    async def flush(self) -> int:
+        """Write one batch of dirty states to the contacts table."""
+        await redis_service.init()
+        # Oldest change first; the script passes over ids claimed meanwhile
+        dirty_ids = await redis_service.redis.zrange(DIRTY_KEY, 0, self.flush_batch_size - 1)
+        if not dirty_ids:
+            return 0
+        now = int(time.time() * 1000)
+        claimed = await redis_service.eval_script(
+            CLAIM_SCRIPT,
+            keys=[DIRTY_KEY, FLUSHING_KEY, *(f"{STATE_KEY_PREFIX}{contact_id}" for contact_id in dirty_ids)],
+            args=[now, self.lease_ms, *dirty_ids]
+        )
+        if not claimed:
+            return 0
+
+        rows = []
+        contact_ids = []
+        for index in range(0, len(claimed), 2):
+            contact_id, flat = claimed[index], claimed[index + 1]
+            contact_ids.append(contact_id)
+            if not flat:
+                # Expired or deleted meanwhile; nothing newer to write
+                continue
+            state = FlowState.from_hash(uuid.UUID(contact_id), dict(zip(flat[::2], flat[1::2])))
+            rows.append({
+                "contact_id": state.contact_id,
+                "flow_id": state.flow_id,
+                "version_id": state.version_id,
+                "node_id": state.node_id,
+                "context": state.context,
+                "state_tags": state.tags,
+            })
+
+        if rows:
+            contacts = Contact.__table__
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(contacts)
+                    .where(contacts.c.id == bindparam("contact_id"))
+                    .values(
+                        current_flow_id=bindparam("flow_id"),
+                        current_flow_version_id=bindparam("version_id"),
+                        current_flow_step_node_id=bindparam("node_id"),
+                        flow_context=bindparam("context"),
+                        tags=bindparam("state_tags")
+                    ),
+                    rows
+                )
+                await db.commit()
+
+        await redis_service.eval_script(
+            ACK_SCRIPT,
+            keys=[FLUSHING_KEY, DIRTY_KEY, *(f"{STATE_KEY_PREFIX}{contact_id}" for contact_id in contact_ids)],
+            args=[self.ttl_seconds, *contact_ids]
+        )
+        return len(contact_ids)
+
+    async def reap(self) -> int:
+        return await redis_service.eval_script(
+            REAP_SCRIPT,
+            keys=[FLUSHING_KEY, DIRTY_KEY],
+            args=[int(time.time() * 1000)]
+        )
+
+    async def run_flusher(self) -> None:
+        """
+        Flush dirty states until stopped. Run a single flusher: two could
+        write snapshots of one contact out of order.
+        """
+        self.running = True
+        while self.running:
+            try:
+                await self.reap()
+                # Keep going while full batches come back
+                while self.running and await self.flush() == self.flush_batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Error flushing flow states: {str(e)}")
+            await asyncio.sleep(self.flush_interval_seconds)
+
+    def stop(self) -> None:
+        self.running = False
+
+flow_state_store = FlowStateStore()
@@ -0,0 +1,30 @@
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models.flow import Flow, FlowVersion
+from app.services.flow_compiler import definition_hash
+
+def record_flow_version(db: Session, flow: Flow) -> FlowVersion:
+    """
+    Make the flow's current definition a version and point the flow at it.
+
+    Saving a definition the flow already had (e.g. reverting an edit)
+    reuses that version instead of adding an identical one. The caller
+    commits.
+    """
+    content_hash = definition_hash(flow.flow_definition)
+    version = db.query(FlowVersion).filter(
+        FlowVersion.flow_id == flow.id,
+        FlowVersion.content_hash == content_hash
+    ).first()
+    if version is None:
+        latest = db.query(func.max(FlowVersion.version)).filter(FlowVersion.flow_id == flow.id).scalar()
+        version = FlowVersion(
+            flow_id=flow.id,
+            version=(latest or 0) + 1,
+            content_hash=content_hash,
+            flow_definition=flow.flow_definition
+        )
+        db.add(version)
+        db.flush()
+    flow.current_version_id = version.id
+    return version
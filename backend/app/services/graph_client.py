@@ -0,0 +1,150 @@
+import logging
+from typing import Any, Dict, Optional
+import httpx
+import orjson
+from app.core.config import settings
+from app.services.graph_concurrency import graph_concurrency
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401 (needed by httpx for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Graph error codes of rate limits: of the app, and of a user, page or
+# business use case (the account)
+APP_THROTTLE_ERROR_CODES = frozenset({4})
+ACCOUNT_THROTTLE_ERROR_CODES = frozenset({17, 32, 613, 80002, 80006})
+
+class InstagramAPIError(Exception):
+    def __init__(self, message: str, status_code: int = None, response: Dict = None):
+        self.message = message
+        self.status_code = status_code
+        self.response = response
+        super().__init__(self.message)
+
+    @property
+    def code(self) -> Optional[int]:
+        """Graph error code of the response, if any."""
+        if not isinstance(self.response, dict):
+            return None
+        return (self.response.get("error") or {}).get("code")
+
+class GraphClient:
+    """
+    The process's one connection pool to the Graph API.
+
+    Connections are kept alive (multiplexed over HTTP/2 when h2 is
+    installed) so sends do not pay a TLS handshake each. The httpx client
+    is created on first use, inside the event loop and process that use
+    it, and closed by close() on shutdown. Bodies are encoded and decoded
+    with orjson.
+
+    Calls made for an account (account_key, its Instagram id) run within
+    the adaptive concurrency limits of graph_concurrency, which every
+    response's usage headers and status feed back into.
+    """
+
+    def __init__(self):
+        self.base_url = f"{settings.INSTAGRAM_GRAPH_API_URL}/{settings.INSTAGRAM_GRAPH_API_VERSION}"
+        self.http2 = settings.GRAPH_API_HTTP2 and HTTP2_AVAILABLE
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            if settings.GRAPH_API_HTTP2 and not HTTP2_AVAILABLE:
+                logger.warning("h2 is not installed; using HTTP/1.1 for the Graph API")
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=settings.GRAPH_API_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.GRAPH_API_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.GRAPH_API_KEEPALIVE_EXPIRY_SECONDS
+                ),
+                timeout=httpx.Timeout(
+                    settings.GRAPH_API_TIMEOUT_SECONDS,
+                    connect=settings.GRAPH_API_CONNECT_TIMEOUT_SECONDS
+                )
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(
+        self,
+        method: str,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        account_key: Optional[str] = None
+    ) -> Any:
+        """
+        Make a Graph API request and return the decoded response; raises
+        InstagramAPIError for error statuses, transport failures and
+        accounts Meta has blocked for now.
+        """
+        blocked_for = graph_concurrency.blocked_for(account_key)
+        if blocked_for:
+            raise InstagramAPIError(
+                message=f"Account {account_key} is rate limited for another {blocked_for:.0f}s",
+                status_code=429
+            )
+        headers = dict(headers or {})
+        content = None
+        if json is not None:
+            content = orjson.dumps(json)
+            headers["Content-Type"] = "application/json"
+        async with graph_concurrency.slot(account_key):
+            try:
+                response = await self.client.request(
+                    method,
+                    endpoint if endpoint.startswith("/") else f"/{endpoint}",
+                    params=params,
+                    content=content,
+                    headers=headers,
+                    timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+                )
+            except httpx.HTTPError as e:
+                graph_concurrency.observe(account_key, None, {})
+                raise InstagramAPIError(message=f"{type(e).__name__}: {str(e)}")
+
+        body = _decode(response.content)
+        error = None
+        if response.is_error:
+            details = (body.get("error") or {}) if isinstance(body, dict) else {}
+            error = InstagramAPIError(
+                message=details.get("message") or f"Graph API returned {response.status_code}",
+                status_code=response.status_code,
+                response=body
+            )
+        graph_concurrency.observe(
+            account_key,
+            response.status_code,
+            response.headers,
+            throttled=error is not None and (
+                response.status_code == 429 or error.code in ACCOUNT_THROTTLE_ERROR_CODES
+            ),
+            app_throttled=error is not None and error.code in APP_THROTTLE_ERROR_CODES
+        )
+        if error is not None:
+            raise error
+        return body
+
+def _decode(content: bytes) -> Any:
+    if not content:
+        return {}
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return {"raw": content.decode("utf-8", errors="replace")}
+
+graph_client = GraphClient()
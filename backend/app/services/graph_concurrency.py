@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Mapping, Optional
+import orjson
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+APP_USAGE_HEADER = "x-app-usage"
+BUSINESS_USAGE_HEADER = "x-business-use-case-usage"
+# Usage fields, each a percentage of the limit Meta enforces
+USAGE_FIELDS = ("call_count", "total_cputime", "total_time")
+
+def parse_app_usage(value: Optional[str]) -> Optional[float]:
+    """Highest percentage in an X-App-Usage header."""
+    if not value:
+        return None
+    try:
+        usage = orjson.loads(value)
+        return float(max(usage.get(field) or 0 for field in USAGE_FIELDS))
+    except (orjson.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return None
+
+def parse_business_usage(value: Optional[str]) -> Optional[Dict[str, float]]:
+    """
+    Highest percentage and longest estimated_time_to_regain_access
+    (minutes) in an X-Business-Use-Case-Usage header.
+    """
+    if not value:
+        return None
+    try:
+        usage = orjson.loads(value)
+        percent = regain_minutes = 0.0
+        for use_cases in usage.values():
+            for use_case in use_cases:
+                percent = max(percent, *(float(use_case.get(field) or 0) for field in USAGE_FIELDS))
+                regain_minutes = max(regain_minutes, float(use_case.get("estimated_time_to_regain_access") or 0))
+        return {"percent": percent, "regain_minutes": regain_minutes}
+    except (orjson.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return None
+
+class AdaptiveLimit:
+    """
+    A semaphore whose size moves by AIMD: +1 per window of successful
+    calls while it is the bottleneck, halved (at most once per
+    decrease interval, so one burst of bad responses counts once) when
+    usage crosses the target, a call is throttled or the server fails.
+    """
+
+    __slots__ = (
+        "limit", "min_limit", "max_limit", "in_flight", "waiters", "usage",
+        "blocked_until", "last_decrease", "requests", "throttled", "errors"
+    )
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.usage: Optional[float] = None
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    async def acquire(self) -> None:
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # Woken and cancelled at once; pass the wake-up on
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def increase(self) -> None:
+        if self.in_flight >= int(self.limit) - 1 and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake()
+
+    def decrease(self, factor: float, interval: float) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease >= interval:
+            self.last_decrease = now
+            self.limit = max(self.min_limit, self.limit * factor)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "usage_percent": self.usage,
+            "blocked_seconds": max(0.0, round(self.blocked_until - time.monotonic(), 1)),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "errors": self.errors,
+        }
+
+class GraphConcurrencyController:
+    """
+    Adapts how many Graph API calls a process has in flight, per account
+    and for the app, to what Meta reports.
+
+    Every call holds a slot of its account's limit and of the app's limit
+    for its duration. Responses feed back: X-Business-Use-Case-Usage
+    steers the account's limit and X-App-Usage the app's, with increases
+    while usage stays under GRAPH_USAGE_TARGET_PERCENT and decreases
+    above it, on throttling errors and on 5xx or transport failures. An
+    account Meta has blocked (estimated_time_to_regain_access) is not
+    called until it regains access. The headers carry usage across all
+    processes, so independent controllers converge on the same ceiling.
+    Past GRAPH_CONCURRENCY_MAX_ACCOUNTS accounts, the least recently used
+    idle ones are forgotten and start over from the initial limit.
+    """
+
+    def __init__(self):
+        self.enabled = settings.GRAPH_ADAPTIVE_CONCURRENCY_ENABLED
+        self.target_percent = settings.GRAPH_USAGE_TARGET_PERCENT
+        self.backoff = settings.GRAPH_CONCURRENCY_BACKOFF
+        self.decrease_interval = settings.GRAPH_CONCURRENCY_DECREASE_INTERVAL_SECONDS
+        self.app = AdaptiveLimit(
+            settings.GRAPH_APP_CONCURRENCY_INITIAL,
+            settings.GRAPH_CONCURRENCY_MIN,
+            settings.GRAPH_APP_CONCURRENCY_MAX
+        )
+        self.max_accounts = settings.GRAPH_CONCURRENCY_MAX_ACCOUNTS
+        self.accounts: "OrderedDict[str, AdaptiveLimit]" = OrderedDict()
+
+    def _account(self, account_key: str) -> AdaptiveLimit:
+        limit = self.accounts.get(account_key)
+        if limit is None:
+            limit = self.accounts[account_key] = AdaptiveLimit(
+                settings.GRAPH_CONCURRENCY_INITIAL,
+                settings.GRAPH_CONCURRENCY_MIN,
+                settings.GRAPH_CONCURRENCY_MAX
+            )
+            self._evict_idle()
+        else:
+            self.accounts.move_to_end(account_key)
+        return limit
+
+    def _evict_idle(self) -> None:
+        """Forget the least recently used accounts beyond the cap that are idle."""
+        excess = len(self.accounts) - self.max_accounts
+        if excess <= 0:
+            return
+        now = time.monotonic()
+        idle = []
+        for key, limit in self.accounts.items():
+            if len(idle) == excess:
+                break
+            # A blocked account is kept so it stays blocked
+            if limit.in_flight == 0 and not limit.waiters and limit.blocked_until <= now:
+                idle.append(key)
+        for key in idle:
+            del self.accounts[key]
+
+    def blocked_for(self, account_key: Optional[str]) -> float:
+        """Seconds until a blocked account regains access, else 0."""
+        if account_key is None or account_key not in self.accounts:
+            return 0.0
+        return max(0.0, self.accounts[account_key].blocked_until - time.monotonic())
+
+    @asynccontextmanager
+    async def slot(self, account_key: Optional[str]) -> AsyncIterator[None]:
+        """Hold a slot of the account's (if any) and the app's limits."""
+        if not self.enabled:
+            yield
+            return
+        account = self._account(account_key) if account_key is not None else None
+        if account is not None:
+            await account.acquire()
+        try:
+            await self.app.acquire()
+            try:
+                yield
+            finally:
+                self.app.release()
+        finally:
+            if account is not None:
+                account.release()
+
+    def observe(
+        self,
+        account_key: Optional[str],
+        status_code: Optional[int],
+        headers: Mapping[str, str],
+        throttled: bool = False,
+        app_throttled: bool = False
+    ) -> None:
+        """
+        Adjust the limits after a call: status_code None for a transport
+        failure, throttled for a rate limit error of the account,
+        app_throttled for one of the app.
+        """
+        if not self.enabled:
+            return
+        failed = status_code is None or status_code >= 500
+        account = self._account(account_key) if account_key is not None else None
+
+        app_usage = parse_app_usage(headers.get(APP_USAGE_HEADER))
+        self.app.requests += 1
+        if app_usage is not None:
+            self.app.usage = app_usage
+        if app_throttled:
+            self.app.throttled += 1
+        if failed:
+            self.app.errors += 1
+        if app_throttled or failed or (app_usage is not None and app_usage >= self.target_percent):
+            self.app.decrease(self.backoff, self.decrease_interval)
+        elif status_code is not None and status_code < 400:
+            self.app.increase()
+
+        if account is None:
+            return
+        business_usage = parse_business_usage(headers.get(BUSINESS_USAGE_HEADER))
+        account.requests += 1
+        if business_usage is not None:
+            account.usage = business_usage["percent"]
+            if business_usage["regain_minutes"] > 0:
+                account.blocked_until = time.monotonic() + business_usage["regain_minutes"] * 60
+                logger.warning(
+                    f"Graph API blocked account {account_key} for {business_usage['regain_minutes']} minutes"
+                )
+        if throttled:
+            account.throttled += 1
+        if failed:
+            account.errors += 1
+        high_usage = business_usage is not None and business_usage["percent"] >= self.target_percent
+        if throttled or failed or high_usage:
+            account.decrease(self.backoff, self.decrease_interval)
+        elif status_code is not None and status_code < 400:
+            account.increase()
+
+    def get_stats(self, account_key: Optional[str] = None) -> Dict[str, Any]:
+        """This process's limits: the app's and one account's, or every account's."""
+        if account_key is not None:
+            accounts = {account_key: self.accounts[account_key]} if account_key in self.accounts else {}
+        else:
+            accounts = self.accounts
+        return {
+            "app": self.app.get_stats(),
+            "accounts": {key: limit.get_stats() for key, limit in accounts.items()},
+        }
+
+graph_concurrency = GraphConcurrencyController()
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import orjson
+from app.core.config import settings
+from app.services.graph_client import InstagramAPIError
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "graph_cache"
+# Stands in for a response that was a 404
+NOT_FOUND = {"__not_found__": True}
+
+class GraphResponseCache:
+    """
+    Cache of read-only Graph API responses, in two tiers.
+
+    Lookups go to an in-process LRU first, then to Redis (shared by all
+    processes), and only then to the Graph API. Each endpoint has its own
+    TTL; the local tier keeps entries at most GRAPH_CACHE_LOCAL_TTL_SECONDS
+    so it never lags Redis by long. A 404 is cached too, for
+    GRAPH_CACHE_NEGATIVE_TTL_SECONDS, and raised again from the cache.
+    Concurrent misses for one key in a process share a single in-flight
+    request.
+    """
+
+    def __init__(self):
+        self.ttls: Dict[str, int] = {
+            "profile": settings.GRAPH_CACHE_PROFILE_TTL_SECONDS,
+            "account_profile": settings.GRAPH_CACHE_PROFILE_TTL_SECONDS,
+            "conversations": settings.GRAPH_CACHE_CONVERSATIONS_TTL_SECONDS,
+        }
+        self.negative_ttl_seconds = settings.GRAPH_CACHE_NEGATIVE_TTL_SECONDS
+        self.local_ttl_seconds = settings.GRAPH_CACHE_LOCAL_TTL_SECONDS
+        self.max_local_entries = settings.GRAPH_CACHE_LOCAL_SIZE
+        # key -> (expires at on the monotonic clock, value)
+        self._local: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "coalesced": 0, "not_found": 0}
+
+    def _key(self, endpoint: str, key: str) -> str:
+        return f"{CACHE_KEY_PREFIX}:{endpoint}:{key}"
+
+    def _get_local(self, cache_key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._local.get(cache_key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._local[cache_key]
+                return None
+            self._local.move_to_end(cache_key)
+            return entry[1]
+
+    def _put_local(self, cache_key: str, value: Any, ttl_seconds: int) -> None:
+        with self._lock:
+            self._local[cache_key] = (time.monotonic() + min(ttl_seconds, self.local_ttl_seconds), value)
+            self._local.move_to_end(cache_key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
+
+    async def get(self, endpoint: str, key: str) -> Optional[Any]:
+        """A cached response (NOT_FOUND for a cached 404), or None."""
+        cache_key = self._key(endpoint, key)
+        value = self._get_local(cache_key)
+        if value is not None:
+            self.stats["local_hits"] += 1
+            return value
+        try:
+            await redis_service.init()
+            data = await redis_service.redis.get(cache_key)
+        except Exception as e:
+            logger.warning(f"Error reading Graph cache: {str(e)}")
+            return None
+        if data is None:
+            return None
+        value = orjson.loads(data)
+        ttl_seconds = self.negative_ttl_seconds if value == NOT_FOUND else self.ttls[endpoint]
+        self._put_local(cache_key, value, ttl_seconds)
+        self.stats["redis_hits"] += 1
+        return value
+
+    async def get_many(self, endpoint: str, keys: List[str]) -> Dict[str, Any]:
+        """Cached responses by key, with one MGET for the keys not held locally."""
+        values = {}
+        remote = []
+        for key in keys:
+            value = self._get_local(self._key(endpoint, key))
+            if value is not None:
+                self.stats["local_hits"] += 1
+                values[key] = value
+            else:
+                remote.append(key)
+        if not remote:
+            return values
+        try:
+            await redis_service.init()
+            cached = await redis_service.redis.mget([self._key(endpoint, key) for key in remote])
+        except Exception as e:
+            logger.warning(f"Error reading Graph cache: {str(e)}")
+            return values
+        for key, data in zip(remote, cached):
+            if data is None:
+                continue
+            value = values[key] = orjson.loads(data)
+            ttl_seconds = self.negative_ttl_seconds if value == NOT_FOUND else self.ttls[endpoint]
+            self._put_local(self._key(endpoint, key), value, ttl_seconds)
+            self.stats["redis_hits"] += 1
+        return values
+
+    async def put_many(self, endpoint: str, values: Dict[str, Any]) -> None:
+        """Cache several responses, written to Redis in one pipeline."""
+        if not values:
+            return
+        entries = []
+        for key, value in values.items():
+            ttl_seconds = self.negative_ttl_seconds if value == NOT_FOUND else self.ttls[endpoint]
+            self._put_local(self._key(endpoint, key), value, ttl_seconds)
+            entries.append((self._key(endpoint, key), orjson.dumps(value).decode("utf-8"), ttl_seconds))
+        try:
+            await redis_service.init()
+            async with redis_service.redis.pipeline(transaction=False) as pipe:
+                for cache_key, data, ttl_seconds in entries:
+                    pipe.set(cache_key, data, ex=ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Error writing Graph cache: {str(e)}")
+
+    async def put(self, endpoint: str, key: str, value: Any) -> None:
+        cache_key = self._key(endpoint, key)
+        ttl_seconds = self.negative_ttl_seconds if value == NOT_FOUND else self.ttls[endpoint]
+        self._put_local(cache_key, value, ttl_seconds)
+        try:
+            await redis_service.init()
+            await redis_service.redis.set(cache_key, orjson.dumps(value).decode("utf-8"), ex=ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Error writing Graph cache: {str(e)}")
+
+    async def get_or_fetch(self, endpoint: str, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """The response for key from the cache, or from fetch() on a miss."""
+        value = await self.get(endpoint, key)
+        if value is None:
+            value = await self._fetch_once(endpoint, key, fetch)
+        if value == NOT_FOUND:
+            raise InstagramAPIError(message=f"{endpoint} {key} not found (cached)", status_code=404)
+        return value
+
+    async def _fetch_once(self, endpoint: str, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        cache_key = self._key(endpoint, key)
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        try:
+            self.stats["misses"] += 1
+            try:
+                value = await fetch()
+            except InstagramAPIError as e:
+                if e.status_code != 404:
+                    raise
+                self.stats["not_found"] += 1
+                value = NOT_FOUND
+            await self.put(endpoint, key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so a failure nobody else awaited is not logged
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[cache_key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            local_entries = len(self._local)
+        return {**self.stats, "local_entries": local_entries, "in_flight": len(self._in_flight)}
+
+graph_response_cache = GraphResponseCache()
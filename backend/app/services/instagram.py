@@ -1,44 +1,25 @@
-from typing import Any, Dict, List, Optional
-import httpx
+from typing import Any, Dict, List, Optional, Tuple
+import orjson
 from app.core.config import settings
 from datetime import datetime, timedelta
 from app.models.instagram_account import InstagramAccount
-
-class InstagramAPIError(Exception):
-    def __init__(self, message: str, status_code: int = None, response: Dict = None):
-        self.message = message
-        self.status_code = status_code
-        self.response = response
-        super().__init__(self.message)
+from app.services.graph_client import GraphClient, graph_client
+from app.services.graph_response_cache import NOT_FOUND, graph_response_cache
+from app.services.rate_limiter import MESSAGING, PROFILE, graph_rate_limiter
 
 class InstagramAPI:
-    BASE_URL = "https://graph.facebook.com/v18.0"
+    """Graph API calls made with a user or page access token."""
 
-    def __init__(self):
-        self.client = httpx.AsyncClient(base_url=self.BASE_URL)
+    def __init__(self, client: GraphClient = graph_client):
+        self.client = client
 
     async def close(self):
-        await self.client.aclose()
+        await self.client.close()
 
     async def _make_request(
-        self, method: str, endpoint: str, params: Dict = None, json: Dict = None
+        self, method: str, endpoint: str, params: Dict = None, json: Dict = None, account_key: str = None
     ) -> Dict:
-        try:
-            response = await self.client.request(
-                method,
-                endpoint,
-                params=params,
-                json=json
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPError as e:
-            error_response = e.response.json() if e.response else None
-            raise InstagramAPIError(
-                message=str(e),
-                status_code=e.response.status_code if e.response else None,
-                response=error_response
-            )
+        return await self.client.request(method, endpoint, params=params, json=json, account_key=account_key)
 
     async def exchange_token(self, short_lived_token: str) -> Dict[str, Any]:
         """Exchange a short-lived token for a long-lived token."""
@@ -56,7 +37,78 @@ class InstagramAPI:
             "fields": "id,username,profile_picture_url",
             "access_token": access_token
         }
-        return await self._make_request("GET", f"/{instagram_user_id}", params=params)
+
+        async def fetch() -> Dict[str, Any]:
+            await graph_rate_limiter.acquire(PROFILE, instagram_user_id)
+            return await self._make_request(
+                "GET", f"/{instagram_user_id}", params=params, account_key=instagram_user_id
+            )
+
+        return await graph_response_cache.get_or_fetch("account_profile", instagram_user_id, fetch)
+
+    async def get_user_profiles(
+        self,
+        user_ids: List[str],
+        access_token: str,
+        instagram_user_id: str
+    ) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """
+        Get messaging profiles for several users of an account in one batch
+        request; each lookup counts against the account's profile budget.
+        Profiles already cached are not looked up again.
+
+        Returns the profiles keyed by user id, and the users whose lookup
+        failed and is worth retrying. Users that do not exist are in
+        neither.
+        """
+        cached = await graph_response_cache.get_many(
+            "profile", [f"{instagram_user_id}:{user_id}" for user_id in user_ids]
+        )
+        profiles = {}
+        missing = []
+        for user_id in user_ids:
+            profile = cached.get(f"{instagram_user_id}:{user_id}")
+            if profile is None:
+                missing.append(user_id)
+            elif profile != NOT_FOUND:
+                profiles[user_id] = profile
+        if not missing:
+            return profiles, []
+
+        requests = [
+            {"method": "GET", "relative_url": f"{user_id}?fields=id,username,name,profile_pic"}
+            for user_id in missing
+        ]
+        await graph_rate_limiter.acquire(PROFILE, instagram_user_id, cost=len(requests))
+        responses = await self.batch(requests, access_token, account_key=instagram_user_id)
+        failed = []
+        fetched = {}
+        for user_id, response in zip(missing, responses):
+            if response and response.get("code") == 200:
+                profiles[user_id] = fetched[f"{instagram_user_id}:{user_id}"] = orjson.loads(response["body"])
+            elif response and response.get("code") == 404:
+                fetched[f"{instagram_user_id}:{user_id}"] = NOT_FOUND
+            else:
+                # Timed out within the batch (null) or failed otherwise
+                failed.append(user_id)
+        # A batch answers every request; any left over did not run
+        failed.extend(missing[len(responses):])
+        await graph_response_cache.put_many("profile", fetched)
+        return profiles, failed
+
+    async def batch(
+        self,
+        requests: List[Dict[str, Any]],
+        access_token: str,
+        account_key: Optional[str] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Run up to 50 Graph API requests in a single HTTP round trip."""
+        params = {
+            "access_token": access_token,
+            "batch": orjson.dumps(requests).decode("utf-8"),
+            "include_headers": "false"
+        }
+        return await self._make_request("POST", "/", params=params, account_key=account_key)
 
     async def send_message(
         self,
@@ -71,13 +123,46 @@ class InstagramAPI:
             "recipient": {"id": recipient_id},
             "message": message
         }
+        await graph_rate_limiter.acquire(MESSAGING, instagram_user_id)
         return await self._make_request(
             "POST",
             f"/{instagram_user_id}/messages",
             params=params,
-            json=json_data
+            json=json_data,
+            account_key=instagram_user_id
         )
 
+    async def send_private_reply(
+        self,
+        instagram_user_id: str,
+        comment_id: str,
+        message: Dict[str, Any],
+        access_token: str
+    ) -> Dict[str, Any]:
+        """
+        Reply to a comment in the commenter's DMs. Only one private reply
+        is allowed per comment, within 7 days of it.
+        """
+        params = {"access_token": access_token}
+        json_data = {
+            "recipient": {"comment_id": comment_id},
+            "message": message
+        }
+        await graph_rate_limiter.acquire(MESSAGING, instagram_user_id)
+        return await self._make_request(
+            "POST",
+            f"/{instagram_user_id}/messages",
+            params=params,
+            json=json_data,
+            account_key=instagram_user_id
+        )
+
+    async def get_media_permalink(self, media_id: str, access_token: str) -> Optional[str]:
+        """Permalink of a post, reel or story."""
+        params = {"fields": "permalink", "access_token": access_token}
+        response = await self._make_request("GET", f"/{media_id}", params=params)
+        return response.get("permalink")
+
     async def get_conversations(
         self,
         instagram_user_id: str,
@@ -96,7 +181,15 @@ class InstagramAPI:
             params["before"] = before
         if after:
             params["after"] = after
-        return await self._make_request("GET", f"/{instagram_user_id}/conversations", params=params)
+
+        async def fetch() -> Dict[str, Any]:
+            return await self._make_request(
+                "GET", f"/{instagram_user_id}/conversations", params=params, account_key=instagram_user_id
+            )
+
+        return await graph_response_cache.get_or_fetch(
+            "conversations", f"{instagram_user_id}:{limit}:{before or ''}:{after or ''}", fetch
+        )
 
     async def get_messages(
         self,
@@ -133,43 +226,42 @@ class InstagramAPI:
             "fields": ",".join(fields),
             "include_values": "true"
         }
-        return await self._make_request("POST", f"/{instagram_user_id}/subscriptions", params=params)
+        return await self._make_request(
+            "POST", f"/{instagram_user_id}/subscriptions", params=params, account_key=instagram_user_id
+        )
 
 class InstagramService:
-    def __init__(self):
-        self.base_url = settings.INSTAGRAM_API_BASE_URL
-        self.version = settings.INSTAGRAM_GRAPH_API_VERSION
+    """Graph API calls made on behalf of a connected account."""
+
+    def __init__(self, client: GraphClient = graph_client):
+        self.client = client
 
-    def _make_request(
+    async def _make_request(
         self,
         method: str,
         endpoint: str,
         access_token: str,
         params: Optional[Dict[str, Any]] = None,
-        json: Optional[Dict[str, Any]] = None
+        json: Optional[Dict[str, Any]] = None,
+        account_key: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Make a request to the Instagram Graph API.
         """
-        url = f"{self.base_url}/{endpoint}"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.request(
-            method=method,
-            url=url,
-            headers=headers,
+        return await self.client.request(
+            method,
+            endpoint,
             params=params,
-            json=json
+            json=json,
+            headers={"Authorization": f"Bearer {access_token}"},
+            account_key=account_key
         )
-        response.raise_for_status()
-        return response.json()
 
-    def refresh_access_token(self, account: InstagramAccount) -> None:
+    async def refresh_access_token(self, account: InstagramAccount) -> Tuple[str, datetime]:
         """
-        Refresh the long-lived access token before it expires.
+        Exchange the account's long-lived access token for a fresh one
+        before it expires; returns the new token and its expiry. The
+        caller stores them.
         """
         params = {
             "grant_type": "fb_exchange_token",
@@ -178,46 +270,52 @@ class InstagramService:
             "client_secret": settings.INSTAGRAM_APP_SECRET
         }
         
-        response = self._make_request(
+        response = await self._make_request(
             method="GET",
             endpoint="oauth/access_token",
             access_token=account.access_token,
+            account_key=account.instagram_page_id,
             params=params
         )
         
-        account.access_token = response["access_token"]
-        account.token_expires_at = datetime.utcnow() + timedelta(seconds=response["expires_in"])
+        # Long-lived tokens last 60 days when no expiry is returned
+        expires_in = response.get("expires_in") or 60 * 24 * 60 * 60
+        return response["access_token"], datetime.utcnow() + timedelta(seconds=expires_in)
 
-    def setup_webhooks(self, account: InstagramAccount) -> None:
+    async def setup_webhooks(self, account: InstagramAccount) -> None:
         """
         Set up webhooks for the Instagram account.
         """
         # Subscribe to messages
-        self._make_request(
+        await self._make_request(
             method="POST",
             endpoint=f"{account.instagram_page_id}/subscribed_apps",
             access_token=account.access_token,
+            account_key=account.instagram_page_id,
             json={
                 "subscribed_fields": [
                     "messages",
                     "messaging_postbacks",
                     "message_reactions",
-                    "messaging_seen"
+                    "messaging_seen",
+                    "comments",
+                    "live_comments"
                 ]
             }
         )
 
-    def remove_webhooks(self, account: InstagramAccount) -> None:
+    async def remove_webhooks(self, account: InstagramAccount) -> None:
         """
         Remove webhooks for the Instagram account.
         """
-        self._make_request(
+        await self._make_request(
             method="DELETE",
             endpoint=f"{account.instagram_page_id}/subscribed_apps",
-            access_token=account.access_token
+            access_token=account.access_token,
+            account_key=account.instagram_page_id
         )
 
-    def send_message(
+    async def send_message(
         self,
         account: InstagramAccount,
         recipient_id: str,
@@ -226,25 +324,34 @@ class InstagramService:
         """
         Send a message to a user.
         """
-        return self._make_request(
+        await graph_rate_limiter.acquire(MESSAGING, account.instagram_page_id)
+        return await self._make_request(
             method="POST",
             endpoint=f"{account.instagram_page_id}/messages",
             access_token=account.access_token,
+            account_key=account.instagram_page_id,
             json={
                 "recipient": {"id": recipient_id},
                 "message": message
             }
         )
 
-    def get_profile(self, account: InstagramAccount, user_id: str) -> Dict[str, Any]:
+    async def get_profile(self, account: InstagramAccount, user_id: str) -> Dict[str, Any]:
         """
         Get a user's Instagram profile information.
         """
-        return self._make_request(
-            method="GET",
-            endpoint=f"{user_id}",
-            access_token=account.access_token,
-            params={"fields": "id,username,name,profile_pic"}
-        )
 
-instagram_api = InstagramAPI() 
\ No newline at end of file
+        async def fetch() -> Dict[str, Any]:
+            await graph_rate_limiter.acquire(PROFILE, account.instagram_page_id)
+            return await self._make_request(
+                method="GET",
+                endpoint=f"{user_id}",
+                access_token=account.access_token,
+                account_key=account.instagram_page_id,
+                params={"fields": "id,username,name,profile_pic"}
+            )
+
+        return await graph_response_cache.get_or_fetch("profile", f"{account.instagram_page_id}:{user_id}", fetch)
+
+instagram_api = InstagramAPI()
+instagram_service = InstagramService() 
\ No newline at end of file
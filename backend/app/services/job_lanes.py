@@ -0,0 +1,29 @@
+import zlib
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+
+AUTOMATION_QUEUE = "automation_tasks"
+
+def lane_for(contact_id: Any) -> int:
+    """
+    Map a contact to its worker lane.
+
+    All jobs of one contact land on the same lane and therefore run in
+    order; the hash is stable across processes, unlike hash(). Contact
+    ids are unique across accounts, so the contact id alone decides, and
+    jobs that carry no account id still agree.
+    """
+    return zlib.crc32(str(contact_id).encode("utf-8")) % settings.WORKER_LANES
+
+def lane_queue(lane: int) -> str:
+    return f"{AUTOMATION_QUEUE}:lane:{lane}"
+
+def lanes_for_process(process_index: int, process_count: int) -> List[int]:
+    return [lane for lane in range(settings.WORKER_LANES) if lane % process_count == process_index]
+
+def job_lane(job: Dict[str, Any]) -> Optional[int]:
+    """Lane of a job, or None if it does not belong to a contact."""
+    contact_id = job.get("contact_id") or job.get("trigger_data", {}).get("contact_id")
+    if not contact_id:
+        return None
+    return lane_for(contact_id)
@@ -0,0 +1,126 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from app.models.contact import Contact
+
+# Renders one value of a message for a contact and its flow context
+Renderer = Callable[[Contact, Dict[str, Any]], Any]
+Resolver = Callable[[Contact, Dict[str, Any]], str]
+
+OPEN = "{{"
+CLOSE = "}}"
+
+# Profile fields available as {{contact.<name>}}
+CONTACT_FIELDS: Dict[str, Callable[[Contact], Optional[str]]] = {
+    "firstName": lambda contact: contact.first_name,
+    "lastName": lambda contact: contact.last_name,
+    "fullName": lambda contact: " ".join(part for part in (contact.first_name, contact.last_name) if part),
+    "username": lambda contact: contact.instagram_username,
+}
+
+def _variable_resolver(expression: str) -> Optional[Resolver]:
+    """
+    Resolver for the inside of a {{...}} placeholder, or None if it is not
+    a known variable.
+
+    Supported are contact.<field>, custom.<attribute> (custom_attributes)
+    and flow.<key> (flow_context), each optionally followed by
+    "|default" used when the value is missing or empty.
+    """
+    name, _, default = expression.partition("|")
+    name = name.strip()
+    default = default.strip()
+    namespace, _, key = name.partition(".")
+    if not key:
+        return None
+
+    if namespace == "contact":
+        field = CONTACT_FIELDS.get(key)
+        if field is None:
+            return None
+        getter = lambda contact, flow_context: field(contact)
+    elif namespace == "custom":
+        getter = lambda contact, flow_context: (contact.custom_attributes or {}).get(key)
+    elif namespace == "flow":
+        getter = lambda contact, flow_context: flow_context.get(key)
+    else:
+        return None
+
+    def resolve(contact: Contact, flow_context: Dict[str, Any]) -> str:
+        value = getter(contact, flow_context)
+        if value is None or value == "":
+            return default
+        return value if isinstance(value, str) else str(value)
+    return resolve
+
+class MessageTemplate:
+    """
+    A string split once into literal and variable segments.
+
+    Rendering joins the literals with the resolved variables; nothing is
+    searched or replaced per contact. Placeholders that are not known
+    variables are kept as literal text.
+    """
+    __slots__ = ("source", "segments", "is_static")
+
+    def __init__(self, source: str):
+        self.source = source
+        segments: List[Union[str, Resolver]] = []
+        literal: List[str] = []
+        position = 0
+        while True:
+            start = source.find(OPEN, position)
+            end = source.find(CLOSE, start + len(OPEN)) if start != -1 else -1
+            if end == -1:
+                literal.append(source[position:])
+                break
+            # "{{ a {{contact.firstName}}" opens at the innermost brace pair
+            start = source.rfind(OPEN, start, end)
+            resolver = _variable_resolver(source[start + len(OPEN):end])
+            if resolver is None:
+                literal.append(source[position:end + len(CLOSE)])
+            else:
+                literal.append(source[position:start])
+                segments.append("".join(literal))
+                segments.append(resolver)
+                literal = []
+            position = end + len(CLOSE)
+        segments.append("".join(literal))
+
+        self.segments = tuple(segment for segment in segments if segment != "")
+        self.is_static = all(isinstance(segment, str) for segment in self.segments)
+
+    def render(self, contact: Contact, flow_context: Dict[str, Any]) -> str:
+        if self.is_static:
+            return self.source
+        return "".join([
+            segment if segment.__class__ is str else segment(contact, flow_context)
+            for segment in self.segments
+        ])
+
+def compile_content(value: Any) -> Tuple[Renderer, bool]:
+    """
+    Compile every string inside a message content structure (text, media
+    URL, button titles, payloads and URLs).
+
+    Returns a renderer building a fresh structure per contact and whether
+    the value is static. Static parts are shared between renders, so the
+    result must be treated as read-only.
+    """
+    if isinstance(value, str):
+        template = MessageTemplate(value)
+        if template.is_static:
+            return (lambda contact, flow_context: value), True
+        return template.render, False
+
+    if isinstance(value, dict):
+        compiled = [(key, *compile_content(item)) for key, item in value.items()]
+        if all(is_static for _, _, is_static in compiled):
+            return (lambda contact, flow_context: value), True
+        return (lambda contact, flow_context: {key: render(contact, flow_context) for key, render, _ in compiled}), False
+
+    if isinstance(value, list):
+        compiled = [compile_content(item) for item in value]
+        if all(is_static for _, is_static in compiled):
+            return (lambda contact, flow_context: value), True
+        return (lambda contact, flow_context: [render(contact, flow_context) for render, _ in compiled]), False
+
+    return (lambda contact, flow_context: value), True
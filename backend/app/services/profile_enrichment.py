@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+from typing import Iterable, List
+from app.core.config import settings
+from app.services.redis_service import redis_service
+from app.services.resilience import retry_delay
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENRICHMENT_QUEUE = "profile_enrichment:pending"
+PROFILE_ENRICHMENT_ATTEMPTS = "profile_enrichment:attempts"
+
+# Pops up to ARGV[2] contacts whose score (enqueue or retry time) is due
+CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+"""
+
+async def enqueue_profile_enrichment(contact_ids: Iterable) -> bool:
+    """
+    Queue contacts whose Instagram profile fields still need to be fetched.
+
+    The queue is a sorted set scored by the time a contact is due, so a
+    contact queued twice is only looked up once and the oldest requests go
+    first.
+    """
+    members = {str(contact_id): time.time() for contact_id in contact_ids}
+    if not members:
+        return True
+    try:
+        await redis_service.init()
+        await redis_service.redis.zadd(PROFILE_ENRICHMENT_QUEUE, members, nx=True)
+        return True
+    except Exception as e:
+        logger.error(f"Error queueing profile enrichment: {str(e)}")
+        return False
+
+async def retry_profile_enrichment(contact_ids: Iterable) -> List[str]:
+    """
+    Queue contacts again after a failed lookup, due after a backoff that
+    grows with their number of attempts. Contacts that failed
+    PROFILE_ENRICHMENT_MAX_ATTEMPTS times are given up on and returned.
+    """
+    contact_ids = [str(contact_id) for contact_id in contact_ids]
+    if not contact_ids:
+        return []
+    await redis_service.init()
+    pipe = redis_service.redis.pipeline(transaction=False)
+    for contact_id in contact_ids:
+        pipe.hincrby(PROFILE_ENRICHMENT_ATTEMPTS, contact_id, 1)
+    attempts = await pipe.execute()
+
+    now = time.time()
+    retries = {}
+    given_up = []
+    for contact_id, attempt in zip(contact_ids, attempts):
+        if attempt >= settings.PROFILE_ENRICHMENT_MAX_ATTEMPTS:
+            given_up.append(contact_id)
+        else:
+            retries[contact_id] = now + retry_delay(attempt)
+
+    pipe = redis_service.redis.pipeline(transaction=False)
+    if retries:
+        pipe.zadd(PROFILE_ENRICHMENT_QUEUE, retries, nx=True)
+    if given_up:
+        pipe.hdel(PROFILE_ENRICHMENT_ATTEMPTS, *given_up)
+    await pipe.execute()
+    if given_up:
+        logger.warning(f"Gave up enriching {len(given_up)} contacts after {settings.PROFILE_ENRICHMENT_MAX_ATTEMPTS} attempts")
+    return given_up
+
+async def clear_profile_enrichment_attempts(contact_ids: Iterable) -> None:
+    """Forget the failed attempts of contacts that were looked up."""
+    contact_ids = [str(contact_id) for contact_id in contact_ids]
+    if contact_ids:
+        await redis_service.init()
+        await redis_service.redis.hdel(PROFILE_ENRICHMENT_ATTEMPTS, *contact_ids)
+
+async def claim_profile_enrichment_batch(
+    batch_size: int,
+    timeout_seconds: float = 5,
+    poll_seconds: float = 0.5
+) -> List[str]:
+    """
+    Wait up to timeout_seconds for contacts to be due, then claim up to
+    batch_size of them. Contacts waiting on a retry backoff are not due.
+    """
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        contact_ids = await redis_service.eval_script(
+            CLAIM_SCRIPT, [PROFILE_ENRICHMENT_QUEUE], [time.time(), batch_size]
+        )
+        if contact_ids or time.monotonic() >= deadline:
+            return list(contact_ids or [])
+        await asyncio.sleep(poll_seconds)
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.graph_client import InstagramAPIError
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY_PREFIX = "graph:rate"
+
+# Kinds of Graph API calls with buckets of their own
+MESSAGING = "messaging"
+PROFILE = "profile"
+
+# KEYS: buckets (hashes of level `t` and refill time `ts` in ms)
+# ARGV: cost, then rate per second and capacity of each bucket
+# Takes cost tokens from every bucket if all of them have enough, on the
+# Redis clock so every process refills alike. A cost above a bucket's
+# capacity waits for a full bucket and leaves it in debt. Returns the ms
+# to wait (0 if taken) followed by the tokens left in each bucket.
+TOKEN_BUCKET_SCRIPT = """
+-- Writes after TIME need effect replication before Redis 5; Redis 7
+-- deprecates the call and other implementations may not have it
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i]) / 1000
+    local capacity = tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 't', 'ts')
+    local level = tonumber(bucket[1]) or capacity
+    local refilled_at = tonumber(bucket[2]) or now
+    level = math.min(capacity, level + math.max(0, now - refilled_at) * rate)
+    levels[i] = level
+    local needed = math.min(cost, capacity)
+    if level < needed then
+        wait = math.max(wait, math.ceil((needed - level) / rate))
+    end
+end
+if wait == 0 and cost > 0 then
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[2 * i]) / 1000
+        local capacity = tonumber(ARGV[2 * i + 1])
+        levels[i] = levels[i] - cost
+        redis.call('HSET', key, 't', levels[i], 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil((capacity - levels[i]) / rate) + 1000)
+    end
+end
+local result = {wait}
+for i = 1, #levels do
+    result[i + 1] = math.floor(levels[i])
+end
+return result
+"""
+
+class RateLimitTimeout(InstagramAPIError):
+    """No budget for a Graph API call before the caller's deadline."""
+
+    def __init__(self, message: str):
+        super().__init__(message, status_code=429)
+
+class GraphRateLimiter:
+    """
+    Token buckets in Redis pacing Graph API calls below Instagram's rate
+    limits, shared by every API and worker process.
+
+    Each kind of call (messaging, profile) has a bucket per account and
+    one for the app; a call takes a token from both in one Lua call.
+    Callers out of budget sleep until the script says a token will be
+    there, so a burst (a broadcast, a comment storm) goes out at the
+    limit instead of into 429s, and give up with RateLimitTimeout at
+    their deadline. If Redis is unreachable, calls are let through.
+    """
+
+    def __init__(self):
+        self.enabled = settings.GRAPH_RATE_LIMIT_ENABLED
+        self.max_wait_seconds = settings.GRAPH_RATE_LIMIT_MAX_WAIT_SECONDS
+        # (rate per second, capacity) of the account and app buckets
+        self.limits: Dict[str, Tuple[Tuple[float, int], Tuple[float, int]]] = {
+            MESSAGING: (
+                (settings.GRAPH_MESSAGING_RATE_PER_SECOND, settings.GRAPH_MESSAGING_BURST),
+                (settings.GRAPH_APP_MESSAGING_RATE_PER_SECOND, settings.GRAPH_APP_MESSAGING_BURST)
+            ),
+            PROFILE: (
+                (settings.GRAPH_PROFILE_RATE_PER_SECOND, settings.GRAPH_PROFILE_BURST),
+                (settings.GRAPH_APP_PROFILE_RATE_PER_SECOND, settings.GRAPH_APP_PROFILE_BURST)
+            ),
+        }
+        # Per kind, since the process started
+        self.stats: Dict[str, Dict[str, float]] = {
+            kind: {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "timeouts": 0, "errors": 0}
+            for kind in self.limits
+        }
+
+    def _keys(self, kind: str, account_key: str) -> List[str]:
+        return [
+            f"{RATE_LIMIT_KEY_PREFIX}:{kind}:account:{account_key}",
+            f"{RATE_LIMIT_KEY_PREFIX}:{kind}:app:{settings.INSTAGRAM_APP_ID}",
+        ]
+
+    async def _take(self, kind: str, account_key: str, cost: int) -> List[int]:
+        account_limit, app_limit = self.limits[kind]
+        return await redis_service.eval_script(
+            TOKEN_BUCKET_SCRIPT,
+            keys=self._keys(kind, account_key),
+            args=[cost, *account_limit, *app_limit]
+        )
+
+    async def acquire(
+        self,
+        kind: str,
+        account_key: str,
+        cost: int = 1,
+        timeout: Optional[float] = None
+    ) -> None:
+        """
+        Take cost tokens for a call on behalf of an account (its Instagram
+        id), waiting up to timeout seconds (GRAPH_RATE_LIMIT_MAX_WAIT_SECONDS
+        by default) for them.
+        """
+        if not self.enabled:
+            return
+        stats = self.stats[kind]
+        started = time.monotonic()
+        deadline = started + (self.max_wait_seconds if timeout is None else timeout)
+        while True:
+            try:
+                wait_ms = (await self._take(kind, account_key, cost))[0]
+            except Exception as e:
+                stats["errors"] += 1
+                logger.warning(f"Rate limiter unavailable, not limiting {kind} call: {str(e)}")
+                return
+            if wait_ms == 0:
+                stats["acquired"] += 1
+                stats["wait_seconds"] += time.monotonic() - started
+                return
+            # Waiters of one bucket wake spread out rather than all at once
+            wake_at = time.monotonic() + wait_ms / 1000 * (1 + random.random() * 0.1)
+            if wake_at > deadline:
+                stats["timeouts"] += 1
+                raise RateLimitTimeout(f"No {kind} budget for account {account_key} within the deadline")
+            stats["waited"] += 1
+            await asyncio.sleep(wake_at - time.monotonic())
+
+    async def remaining(self, account_key: str) -> Dict[str, Dict[str, int]]:
+        """Tokens left per kind in the account's and the app's buckets."""
+        budgets = {}
+        for kind in self.limits:
+            _, account_tokens, app_tokens = await self._take(kind, account_key, 0)
+            budgets[kind] = {"account": account_tokens, "app": app_tokens}
+        return budgets
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Acquires, waits and timeouts of this process, per kind."""
+        return {
+            kind: {
+                **stats,
+                "wait_seconds": round(stats["wait_seconds"], 3),
+                "mean_wait_seconds": round(stats["wait_seconds"] / stats["acquired"], 4) if stats["acquired"] else 0.0,
+            }
+            for kind, stats in self.stats.items()
+        }
+
+graph_rate_limiter = GraphRateLimiter()
@@ -1,11 +1,13 @@
 import json
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import aioredis
+from aioredis.exceptions import ResponseError
 from app.core.config import settings
 
 class RedisService:
     def __init__(self):
         self.redis = None
+        self._scripts: Dict[str, Any] = {}
 
     async def init(self):
         """Initialize Redis connection."""
@@ -42,53 +44,58 @@ class RedisService:
             print(f"Error getting from queue: {str(e)}")
             return None
 
-    async def add_to_delayed_queue(
+    async def add_to_stream(
         self,
-        queue_name: str,
-        data: Dict[str, Any],
-        delay_seconds: int
-    ) -> bool:
-        """Add a job to a delayed queue using sorted set."""
+        stream: str,
+        fields: Dict[str, Any],
+        maxlen: Optional[int] = None
+    ) -> Optional[str]:
+        """Append an entry to a stream, returning its id."""
         try:
             await self.init()
-            score = await self.redis.time()
-            score = score[0] + delay_seconds
-            await self.redis.zadd(
-                f"{queue_name}:delayed",
-                {json.dumps(data): score}
-            )
-            return True
+            return await self.redis.xadd(stream, fields, maxlen=maxlen, approximate=True)
         except Exception as e:
-            print(f"Error adding to delayed queue: {str(e)}")
-            return False
+            print(f"Error adding to stream: {str(e)}")
+            return None
 
-    async def get_ready_delayed_jobs(self, queue_name: str) -> list[Dict[str, Any]]:
-        """Get jobs that are ready to be processed from delayed queue."""
+    async def ensure_consumer_group(self, stream: str, group: str) -> None:
+        """Create a consumer group (and its stream) if it does not exist yet."""
+        await self.init()
         try:
-            await self.init()
-            current_time = (await self.redis.time())[0]
-            
-            # Get jobs with score <= current time
-            jobs = await self.redis.zrangebyscore(
-                f"{queue_name}:delayed",
-                "-inf",
-                current_time
-            )
-            
-            if not jobs:
-                return []
-            
-            # Remove these jobs from the delayed queue
-            await self.redis.zremrangebyscore(
-                f"{queue_name}:delayed",
-                "-inf",
-                current_time
-            )
-            
-            return [json.loads(job) for job in jobs]
-        except Exception as e:
-            print(f"Error getting delayed jobs: {str(e)}")
-            return []
+            await self.redis.xgroup_create(stream, group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read_stream_group(
+        self,
+        group: str,
+        consumer: str,
+        streams: Dict[str, str],
+        count: int,
+        block_ms: Optional[int] = None
+    ) -> List[Tuple[str, List[Tuple[str, Dict[str, str]]]]]:
+        """Read entries for a consumer of a consumer group."""
+        await self.init()
+        return await self.redis.xreadgroup(
+            group,
+            consumer,
+            streams,
+            count=count,
+            block=block_ms
+        ) or []
+
+    async def ack_stream(self, stream: str, group: str, *message_ids: str) -> int:
+        """Acknowledge processed stream entries."""
+        await self.init()
+        return await self.redis.xack(stream, group, *message_ids)
+
+    async def eval_script(self, script: str, keys: List[str], args: List[Any]) -> Any:
+        """Run a Lua script, registering it once so later calls go by SHA."""
+        await self.init()
+        if script not in self._scripts:
+            self._scripts[script] = self.redis.register_script(script)
+        return await self._scripts[script](keys=keys, args=args)
 
     async def set_lock(self, key: str, value: str, expiry_seconds: int) -> bool:
         """Set a distributed lock."""
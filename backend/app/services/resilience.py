@@ -0,0 +1,220 @@
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import orjson
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.instagram_account import InstagramAccount
+from app.services.graph_client import (
+    ACCOUNT_THROTTLE_ERROR_CODES,
+    APP_THROTTLE_ERROR_CODES,
+    InstagramAPIError
+)
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+# What to do about a failed call or job
+RETRYABLE = "retryable"
+TOKEN_EXPIRED = "token_expired"
+PERMANENT = "permanent"
+# Why an account's circuit breaker is open, besides TOKEN_EXPIRED
+FAILING = "failing"
+
+# OAuthException codes of an expired, revoked or otherwise invalid token
+TOKEN_ERROR_CODES = frozenset({102, 190})
+# Unknown and temporary service errors, and rate limits
+TRANSIENT_ERROR_CODES = frozenset({1, 2}) | APP_THROTTLE_ERROR_CODES | ACCOUNT_THROTTLE_ERROR_CODES
+
+BREAKER_KEY_PREFIX = "breaker:account"
+# Set of the accounts whose breaker is open for TOKEN_EXPIRED
+TOKEN_EXPIRED_ACCOUNTS_KEY = "breaker:token_expired"
+DEAD_LETTER_STREAM = "jobs:dead_letters"
+
+def classify_error(error: BaseException) -> str:
+    """
+    RETRYABLE for transport failures, rate limits, 5xx and transient Graph
+    errors; TOKEN_EXPIRED when the account's token no longer works;
+    PERMANENT for other Graph errors (bad request, permissions, a user
+    that cannot be messaged). Other exceptions (database, Redis) are
+    assumed to be transient.
+    """
+    if not isinstance(error, InstagramAPIError):
+        return RETRYABLE
+    if error.code in TOKEN_ERROR_CODES or error.status_code == 401:
+        return TOKEN_EXPIRED
+    details = (error.response.get("error") or {}) if isinstance(error.response, dict) else {}
+    if (
+        error.status_code is None
+        or error.status_code == 429
+        or error.status_code >= 500
+        or error.code in TRANSIENT_ERROR_CODES
+        or details.get("is_transient")
+    ):
+        return RETRYABLE
+    return PERMANENT
+
+def retry_delay(attempt: int) -> float:
+    """
+    Seconds before retry number attempt (1 for the first): exponential,
+    capped, with full jitter so retries of one outage spread out.
+    """
+    ceiling = min(settings.RETRY_MAX_DELAY_SECONDS, settings.RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(settings.RETRY_BASE_DELAY_SECONDS, max(settings.RETRY_BASE_DELAY_SECONDS, ceiling))
+
+class AccountCircuitBreaker:
+    """
+    Per-account circuit breakers shared through Redis.
+
+    A breaker opens for CIRCUIT_BREAKER_OPEN_SECONDS after
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD retryable failures in a row, and
+    until closed when the account's token expired (the account is in
+    `error` status then); the token refresh sweeper closes those once the
+    account is connected again or its token was refreshed. While open,
+    work for the account fails fast instead of calling the Graph API.
+    States are cached in process for a few seconds, so checking costs no
+    round trip per job.
+    """
+
+    def __init__(self):
+        self.failure_threshold = settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        self.open_seconds = settings.CIRCUIT_BREAKER_OPEN_SECONDS
+        self.cache_seconds = 5.0
+        self._failures: Dict[str, int] = {}
+        # account id -> (reason the breaker is open or None, cached at)
+        self._cache: Dict[str, Tuple[Optional[str], float]] = {}
+
+    async def check(self, account_id: Any) -> Optional[str]:
+        """Why the account's breaker is open, or None if it is closed."""
+        account_id = str(account_id)
+        cached = self._cache.get(account_id)
+        now = time.monotonic()
+        if cached is not None and now - cached[1] < self.cache_seconds:
+            return cached[0]
+        try:
+            await redis_service.init()
+            reason = await redis_service.redis.get(f"{BREAKER_KEY_PREFIX}:{account_id}")
+        except Exception as e:
+            logger.warning(f"Error checking circuit breaker of account {account_id}: {str(e)}")
+            reason = None
+        self._cache[account_id] = (reason, now)
+        return reason
+
+    async def open(self, account_id: Any, reason: str, seconds: Optional[int] = None) -> None:
+        account_id = str(account_id)
+        await redis_service.init()
+        async with redis_service.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"{BREAKER_KEY_PREFIX}:{account_id}", reason, ex=seconds)
+            if reason == TOKEN_EXPIRED:
+                pipe.sadd(TOKEN_EXPIRED_ACCOUNTS_KEY, account_id)
+            await pipe.execute()
+        self._cache[account_id] = (reason, time.monotonic())
+        self._failures.pop(account_id, None)
+        logger.warning(f"Circuit breaker of account {account_id} opened: {reason}")
+
+    async def close(self, account_id: Any) -> None:
+        await self.close_many([account_id])
+
+    async def close_many(self, account_ids: Iterable[Any]) -> None:
+        account_ids = [str(account_id) for account_id in account_ids]
+        if not account_ids:
+            return
+        await redis_service.init()
+        async with redis_service.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*(f"{BREAKER_KEY_PREFIX}:{account_id}" for account_id in account_ids))
+            pipe.srem(TOKEN_EXPIRED_ACCOUNTS_KEY, *account_ids)
+            await pipe.execute()
+        for account_id in account_ids:
+            self._cache.pop(account_id, None)
+            self._failures.pop(account_id, None)
+
+    async def token_expired_accounts(self) -> List[str]:
+        """Accounts whose breaker is open because their token expired."""
+        await redis_service.init()
+        return list(await redis_service.redis.smembers(TOKEN_EXPIRED_ACCOUNTS_KEY))
+
+    async def record_failure(self, account_id: Any) -> None:
+        account_id = str(account_id)
+        failures = self._failures[account_id] = self._failures.get(account_id, 0) + 1
+        if failures >= self.failure_threshold:
+            await self.open(account_id, FAILING, self.open_seconds)
+
+    def record_success(self, account_id: Any) -> None:
+        self._failures.pop(str(account_id), None)
+
+account_breaker = AccountCircuitBreaker()
+
+async def mark_tokens_expired(db: AsyncSession, account_ids: Iterable[Any]) -> None:
+    """Put accounts whose token stopped working in `error` status."""
+    account_ids = list(account_ids)
+    if not account_ids:
+        return
+    await db.execute(
+        update(InstagramAccount)
+        .where(InstagramAccount.id.in_(account_ids))
+        .values(status="error")
+    )
+    await db.commit()
+    for account_id in account_ids:
+        await account_breaker.open(account_id, TOKEN_EXPIRED)
+
+class DeadLetterQueue:
+    """
+    Jobs that failed for good, on a Redis stream with why and when, to be
+    inspected and replayed with scripts/replay_dead_letters.py.
+    """
+
+    def __init__(self):
+        self.stream = DEAD_LETTER_STREAM
+        self.maxlen = settings.DEAD_LETTER_STREAM_MAXLEN
+
+    async def add(self, job: Dict[str, Any], reason: str, error: str = "") -> Optional[str]:
+        logger.error(f"Dead-lettering {job.get('type')} job {job.get('job_id')} ({reason}): {error}")
+        return await redis_service.add_to_stream(
+            self.stream,
+            {
+                "job": orjson.dumps(job).decode("utf-8"),
+                "reason": reason,
+                "error": error[:1000],
+                "failed_at": datetime.utcnow().isoformat(),
+            },
+            maxlen=self.maxlen
+        )
+
+    async def read(self, count: int = 100, start: str = "-") -> List[Tuple[str, Dict[str, Any]]]:
+        """Entries from start (an entry id, inclusive), oldest first."""
+        await redis_service.init()
+        entries = await redis_service.redis.xrange(self.stream, min=start, count=count)
+        return [(entry_id, {**fields, "job": orjson.loads(fields["job"])}) for entry_id, fields in entries]
+
+    async def delete(self, *entry_ids: str) -> int:
+        if not entry_ids:
+            return 0
+        await redis_service.init()
+        return await redis_service.redis.xdel(self.stream, *entry_ids)
+
+    async def length(self) -> int:
+        await redis_service.init()
+        return await redis_service.redis.xlen(self.stream)
+
+dead_letters = DeadLetterQueue()
+
+async def retry_or_dead_letter(
+    job: Dict[str, Any],
+    error: BaseException
+) -> Optional[Tuple[Dict[str, Any], float]]:
+    """
+    (job, delay_seconds) for the delayed job scheduler if the job should
+    run again, with its attempt count raised; otherwise dead-letter it and
+    return None.
+    """
+    classification = classify_error(error)
+    attempt = job.get("attempt", 0) + 1
+    if classification == RETRYABLE and attempt < settings.RETRY_MAX_ATTEMPTS:
+        return {**job, "attempt": attempt}, retry_delay(attempt)
+    reason = "retries_exhausted" if classification == RETRYABLE else classification
+    await dead_letters.add(job, reason, str(error))
+    return None
@@ -0,0 +1,66 @@
+from typing import Any, List, Tuple
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel.
+
+    Level 0 has one slot per tick; every higher level has slots
+    wheel_size times wider. A timer goes to the lowest level whose span
+    covers its delay and cascades down one level each time the wheel
+    reaches its slot, so adding and expiring a timer are O(1) regardless of
+    how many timers are held.
+    """
+
+    def __init__(self, tick_ms: int, wheel_size: int = 64, levels: int = 3, start_ms: int = 0):
+        self.tick_ms = tick_ms
+        self.wheel_size = wheel_size
+        self.levels: List[List[List[Tuple[int, Any]]]] = [
+            [[] for _ in range(wheel_size)] for _ in range(levels)
+        ]
+        # Next tick to expire
+        self.current_tick = start_ms // tick_ms
+        self.span_ticks = wheel_size ** levels
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, due_ms: int, item: Any) -> None:
+        """Add a timer; timers already due expire on the next advance()."""
+        due_tick = max(due_ms // self.tick_ms, self.current_tick)
+        if due_tick - self.current_tick >= self.span_ticks:
+            raise ValueError("Timer is beyond the span of the wheel")
+        self._insert(due_tick, item)
+        self._size += 1
+
+    def _insert(self, due_tick: int, item: Any) -> None:
+        delta = due_tick - self.current_tick
+        for level, slots in enumerate(self.levels):
+            if delta < self.wheel_size ** (level + 1):
+                slot = (due_tick // self.wheel_size ** level) % self.wheel_size
+                slots[slot].append((due_tick, item))
+                return
+
+    def advance(self, now_ms: int) -> List[Any]:
+        """Move the wheel up to now_ms and return the timers that expired."""
+        expired = []
+        target_tick = now_ms // self.tick_ms
+        while self.current_tick <= target_tick:
+            # Crossing a slot boundary of a higher level moves that slot's
+            # timers one or more levels down; higher levels go first
+            for level in range(len(self.levels) - 1, 0, -1):
+                if self.current_tick % self.wheel_size ** level:
+                    continue
+                slot = (self.current_tick // self.wheel_size ** level) % self.wheel_size
+                timers = self.levels[level][slot]
+                self.levels[level][slot] = []
+                for due_tick, item in timers:
+                    self._insert(due_tick, item)
+
+            slot = self.current_tick % self.wheel_size
+            timers = self.levels[0][slot]
+            self.levels[0][slot] = []
+            expired.extend(item for _, item in timers)
+            self._size -= len(timers)
+            self.current_tick += 1
+        return expired
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+from sqlalchemy import bindparam, select, update
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.instagram_account import InstagramAccount
+from app.services.instagram import instagram_service
+from app.services.redis_service import redis_service
+from app.services.resilience import TOKEN_EXPIRED, account_breaker, classify_error, mark_tokens_expired
+
+logger = logging.getLogger(__name__)
+
+SWEEP_LOCK_KEY = "token_refresh_sweep"
+
+class TokenRefreshSweeper:
+    """
+    Refreshes access tokens before they expire, off the send path.
+
+    Each sweep reads the accounts whose token expires within the window
+    (a range scan of the token_expires_at index) and refreshes those that
+    are due, at most TOKEN_REFRESH_BATCH_SIZE, with at most
+    TOKEN_REFRESH_CONCURRENCY calls in flight, then stores the new tokens
+    with one UPDATE. An account is due at its own, stable point in the
+    first half of the window, so accounts connected together (or migrated
+    with the same expiry) refresh spread over days instead of at once.
+    Tokens that can no longer be refreshed put their account in error
+    status, which keeps it out of later sweeps until it is reconnected;
+    other failures are tried again by the next sweep. Each sweep also
+    closes the token-expired circuit breakers of accounts that are
+    connected again, and a refresh closes the breaker of its account.
+    """
+
+    def __init__(self):
+        self.window = timedelta(days=settings.TOKEN_REFRESH_WINDOW_DAYS)
+        self.interval_seconds = settings.TOKEN_REFRESH_SWEEP_INTERVAL_SECONDS
+        self.batch_size = settings.TOKEN_REFRESH_BATCH_SIZE
+        self.concurrency = settings.TOKEN_REFRESH_CONCURRENCY
+        self.owner = str(uuid.uuid4())
+        self.running = False
+
+    def due_at(self, account_id: Any, token_expires_at: datetime) -> datetime:
+        """When an account's token is refreshed: within the window's first half."""
+        offset = zlib.crc32(str(account_id).encode("utf-8")) / 2 ** 32 * self.window / 2
+        return token_expires_at - self.window + offset
+
+    async def sweep(self) -> int:
+        """Refresh the tokens that are due; returns how many were refreshed."""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            expiring = (await db.execute(
+                select(InstagramAccount.id, InstagramAccount.token_expires_at)
+                .where(
+                    InstagramAccount.token_expires_at <= now + self.window,
+                    # Not disconnected, nor in error: its token was rejected
+                    # and refreshing it again would fail every sweep
+                    InstagramAccount.status == "connected"
+                )
+                .order_by(InstagramAccount.token_expires_at)
+            )).all()
+            due_ids = [
+                account_id for account_id, token_expires_at in expiring
+                if self.due_at(account_id, token_expires_at) <= now
+            ][:self.batch_size]
+            if not due_ids:
+                return 0
+            accounts = (await db.execute(
+                select(
+                    InstagramAccount.id,
+                    InstagramAccount.instagram_page_id,
+                    InstagramAccount.access_token
+                ).where(InstagramAccount.id.in_(due_ids))
+            )).all()
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def refresh(account: Any) -> Tuple[Any, Any]:
+                async with semaphore:
+                    try:
+                        return account, await instagram_service.refresh_access_token(account)
+                    except Exception as e:
+                        return account, e
+
+            results = await asyncio.gather(*(refresh(account) for account in accounts))
+
+            refreshed: List[Dict[str, Any]] = []
+            expired = []
+            for account, result in results:
+                if not isinstance(result, Exception):
+                    token, expires_at = result
+                    refreshed.append({"account_id": account.id, "token": token, "expires_at": expires_at})
+                elif classify_error(result) == TOKEN_EXPIRED:
+                    expired.append(account.id)
+                else:
+                    logger.warning(f"Error refreshing token of account {account.id}: {str(result)}")
+
+            if refreshed:
+                accounts_table = InstagramAccount.__table__
+                await db.execute(
+                    update(accounts_table)
+                    .where(accounts_table.c.id == bindparam("account_id"))
+                    .values(
+                        access_token=bindparam("token"),
+                        token_expires_at=bindparam("expires_at"),
+                        updated_at=now
+                    ),
+                    refreshed
+                )
+                await db.commit()
+                await account_breaker.close_many(row["account_id"] for row in refreshed)
+            await mark_tokens_expired(db, expired)
+
+        logger.info(
+            f"Refreshed {len(refreshed)} of {len(accounts)} due access tokens; {len(expired)} expired"
+        )
+        return len(refreshed)
+
+    async def close_reconnected_breakers(self) -> int:
+        """
+        Close the token-expired breakers of accounts that left `error`
+        status, e.g. because they were reconnected with a new token.
+        """
+        account_ids = await account_breaker.token_expired_accounts()
+        if not account_ids:
+            return 0
+        async with AsyncSessionLocal() as db:
+            reconnected = (await db.scalars(
+                select(InstagramAccount.id).where(
+                    InstagramAccount.id.in_([uuid.UUID(account_id) for account_id in account_ids]),
+                    InstagramAccount.status == "connected"
+                )
+            )).all()
+        await account_breaker.close_many(reconnected)
+        if reconnected:
+            logger.info(f"Closed the circuit breakers of {len(reconnected)} reconnected accounts")
+        return len(reconnected)
+
+    async def run(self) -> None:
+        """Sweep until stopped; one sweeper at a time across processes."""
+        self.running = True
+        while self.running:
+            try:
+                if await redis_service.set_lock(SWEEP_LOCK_KEY, self.owner, expiry_seconds=self.interval_seconds):
+                    try:
+                        await self.close_reconnected_breakers()
+                        # Keep going while full batches are due
+                        while self.running and await self.sweep() == self.batch_size:
+                            pass
+                    finally:
+                        await redis_service.release_lock(SWEEP_LOCK_KEY, self.owner)
+            except Exception as e:
+                logger.error(f"Error sweeping access tokens: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def stop(self) -> None:
+        self.running = False
+
+token_refresh_sweeper = TokenRefreshSweeper()
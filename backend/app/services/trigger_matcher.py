@@ -0,0 +1,268 @@
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.flow import Flow, FlowStatus, Trigger, TriggerType
+
+class TriggerRule(NamedTuple):
+    trigger_id: Any
+    flow_id: Any
+    type: TriggerType
+    keyword: Optional[str]
+    priority: int
+    whole_word: bool
+    post_permalink: Optional[str]
+
+    @classmethod
+    def from_trigger(cls, trigger: Trigger) -> "TriggerRule":
+        return cls(
+            trigger_id=trigger.id,
+            flow_id=trigger.flow_id,
+            type=trigger.type,
+            keyword=trigger.keyword,
+            priority=trigger.priority or 0,
+            whole_word=bool(trigger.match_whole_word),
+            post_permalink=trigger.post_permalink
+        )
+
+    def keywords(self) -> List[str]:
+        """Keywords of the rule; the keyword field may be comma-separated."""
+        if not self.keyword:
+            return []
+        return [keyword.strip().lower() for keyword in self.keyword.split(",") if keyword.strip()]
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over lower-cased keywords.
+
+    Finds every occurrence of every keyword in a single pass over the text,
+    so matching cost depends on the text length, not on the keyword count.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, Any]]] = [[]]
+
+        for keyword, payload in patterns:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(keyword), payload))
+
+        # Breadth-first pass to wire failure links and merge outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (start, end, payload) for every keyword occurrence in text."""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, payload in output[state]:
+                yield index - length + 1, index + 1, payload
+
+def post_key(post: str) -> str:
+    """
+    Key a comment trigger's post is indexed by: a media id as is, or a
+    permalink without scheme, www., query and trailing slash and with
+    /reel/ and /tv/ read as /p/, so that the variants Instagram hands out
+    compare equal.
+    """
+    post = post.strip()
+    if post.isdigit():
+        return post
+    parts = urlsplit(post if "//" in post else f"//{post}")
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[len("www."):]
+    path = parts.path.rstrip("/")
+    # Reels and IGTV are also reachable under /p/
+    for prefix in ("/reel/", "/tv/"):
+        if path.startswith(prefix):
+            path = "/p/" + path[len(prefix):]
+    return f"{host}{path}"
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+def _select_match(automaton: KeywordAutomaton, text: str) -> Optional[TriggerRule]:
+    """
+    Pick the matching rule with the highest priority, then the longest
+    keyword, then the earliest occurrence.
+    """
+    match = _best_match(automaton, text)
+    return match[1] if match else None
+
+def _best_match(automaton: KeywordAutomaton, text: str) -> Optional[Tuple[Tuple[int, int, int], TriggerRule]]:
+    lowered = text.lower()
+    best = None
+    best_key = None
+    for start, end, rule in automaton.iter_matches(lowered):
+        if rule.whole_word and (
+            (start > 0 and _is_word_char(lowered[start - 1]))
+            or (end < len(lowered) and _is_word_char(lowered[end]))
+        ):
+            continue
+        key = (rule.priority, end - start, -start)
+        if best_key is None or key > best_key:
+            best, best_key = rule, key
+    return (best_key, best) if best is not None else None
+
+class AccountTriggerMatcher:
+    """
+    Active triggers of one Instagram account, indexed for matching.
+
+    One automaton is kept per keyword trigger type, except that comment
+    triggers limited to one post get an automaton per post, keyed by
+    post_key(). Rebuilding after a change reuses every automaton whose
+    rules did not change.
+    """
+
+    KEYWORD_TYPES = (TriggerType.DM_KEYWORD, TriggerType.COMMENT_KEYWORD)
+
+    def __init__(self, rules: List[TriggerRule], previous: Optional["AccountTriggerMatcher"] = None):
+        self.rules = rules
+        self._rules_by_type: Dict[TriggerType, frozenset] = {}
+        self._automata: Dict[TriggerType, KeywordAutomaton] = {}
+        for trigger_type in self.KEYWORD_TYPES:
+            typed_rules = frozenset(
+                rule for rule in rules
+                if rule.type == trigger_type and not (trigger_type == TriggerType.COMMENT_KEYWORD and rule.post_permalink)
+            )
+            self._rules_by_type[trigger_type] = typed_rules
+            if previous is not None and previous._rules_by_type.get(trigger_type) == typed_rules:
+                self._automata[trigger_type] = previous._automata[trigger_type]
+            else:
+                self._automata[trigger_type] = KeywordAutomaton(
+                    (keyword, rule) for rule in typed_rules for keyword in rule.keywords()
+                )
+
+        post_rules: Dict[str, set] = {}
+        for rule in rules:
+            if rule.type == TriggerType.COMMENT_KEYWORD and rule.post_permalink:
+                post_rules.setdefault(post_key(rule.post_permalink), set()).add(rule)
+        self._rules_by_post: Dict[str, frozenset] = {key: frozenset(rules) for key, rules in post_rules.items()}
+        self._post_automata: Dict[str, KeywordAutomaton] = {}
+        for key, typed_rules in self._rules_by_post.items():
+            if previous is not None and previous._rules_by_post.get(key) == typed_rules:
+                self._post_automata[key] = previous._post_automata[key]
+            else:
+                self._post_automata[key] = KeywordAutomaton(
+                    (keyword, rule) for rule in typed_rules for keyword in rule.keywords()
+                )
+        # Posts given by permalink can only be matched once a comment's
+        # media id has been resolved to its permalink
+        self.has_permalink_rules = any(not key.isdigit() for key in self._rules_by_post)
+
+        others = sorted(
+            (rule for rule in rules if rule.type not in self.KEYWORD_TYPES),
+            key=lambda rule: -rule.priority
+        )
+        self.welcome_rule = next((rule for rule in others if rule.type == TriggerType.WELCOME_MESSAGE), None)
+        self.story_mention_rule = next((rule for rule in others if rule.type == TriggerType.STORY_MENTION), None)
+
+    def match_dm(self, text: str) -> Optional[TriggerRule]:
+        if not text:
+            return None
+        return _select_match(self._automata[TriggerType.DM_KEYWORD], text)
+
+    def match_comment(
+        self,
+        text: str,
+        media_id: Optional[str] = None,
+        permalink: Optional[str] = None
+    ) -> Optional[TriggerRule]:
+        """
+        Match a comment against the comment_keyword triggers of every post
+        and those of the commented post, given by media id and/or
+        permalink, with the precedence of _select_match across both.
+        """
+        if not text:
+            return None
+        automata = [self._automata[TriggerType.COMMENT_KEYWORD]]
+        for post in (media_id, permalink):
+            if post and post_key(post) in self._post_automata:
+                automata.append(self._post_automata[post_key(post)])
+        matches = [match for match in (_best_match(automaton, text) for automaton in automata) if match]
+        if not matches:
+            return None
+        return max(matches, key=lambda match: match[0])[1]
+
+class TriggerIndex:
+    """
+    Per-process cache of AccountTriggerMatcher by account id.
+
+    Accounts are loaded on first use and rebuilt one at a time when their
+    triggers change; the previous matcher keeps serving until the new one
+    has been swapped in.
+    """
+
+    def __init__(self):
+        self._matchers: Dict[str, AccountTriggerMatcher] = {}
+        self._stale: set = set()
+        self._lock = threading.Lock()
+
+    async def get(self, db: AsyncSession, instagram_account_id: Any) -> AccountTriggerMatcher:
+        key = str(instagram_account_id)
+        matcher = self._matchers.get(key)
+        if matcher is None or key in self._stale:
+            matcher = await self.rebuild(db, instagram_account_id)
+        return matcher
+
+    async def rebuild(self, db: AsyncSession, instagram_account_id: Any) -> AccountTriggerMatcher:
+        """Reload the active triggers of an account and swap in a new matcher."""
+        triggers = (await db.scalars(
+            select(Trigger).join(Flow).where(
+                Flow.instagram_account_id == instagram_account_id,
+                Trigger.status == FlowStatus.ACTIVE
+            )
+        )).all()
+        key = str(instagram_account_id)
+        matcher = AccountTriggerMatcher(
+            [TriggerRule.from_trigger(trigger) for trigger in triggers],
+            previous=self._matchers.get(key)
+        )
+        with self._lock:
+            self._matchers[key] = matcher
+            self._stale.discard(key)
+        return matcher
+
+    def invalidate(self, instagram_account_id: Any) -> None:
+        """Mark an account for rebuild; its matcher is kept for reuse."""
+        with self._lock:
+            self._stale.add(str(instagram_account_id))
+
+    def cached_account_ids(self) -> set:
+        with self._lock:
+            return set(self._matchers)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._matchers.clear()
+            self._stale.clear()
+
+trigger_index = TriggerIndex()
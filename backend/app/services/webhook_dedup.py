@@ -0,0 +1,223 @@
+import logging
+import time
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.services.comment_triggers import change_key
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+SEEN_KEY_PREFIX = "webhook:seen"
+STATS_KEY_PREFIX = "webhook:dedup:stats"
+STATS_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# KEYS: current bucket, previous bucket, stats hash
+# ARGV: stats ttl, event keys...
+# Returns 1 for every event not seen yet, 0 for duplicates, including
+# repeats within the same call. Only the stats are written.
+SET_CHECK_SCRIPT = """
+local result = {}
+local duplicates = 0
+local repeated = {}
+for i = 2, #ARGV do
+    local key = ARGV[i]
+    if repeated[key]
+        or redis.call('SISMEMBER', KEYS[1], key) == 1
+        or redis.call('SISMEMBER', KEYS[2], key) == 1 then
+        result[i - 1] = 0
+        duplicates = duplicates + 1
+    else
+        result[i - 1] = 1
+    end
+    repeated[key] = true
+end
+redis.call('HINCRBY', KEYS[3], 'total', #ARGV - 1)
+redis.call('HINCRBY', KEYS[3], 'duplicates', duplicates)
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+return result
+"""
+
+# Same contract as SET_CHECK_SCRIPT, over Bloom filters.
+BLOOM_CHECK_SCRIPT = """
+local check = {}
+for i = 1, 2 do
+    check[i] = redis.call('EXISTS', KEYS[i]) == 1
+end
+local result = {}
+local duplicates = 0
+local repeated = {}
+for i = 2, #ARGV do
+    local key = ARGV[i]
+    if repeated[key]
+        or (check[1] and redis.call('BF.EXISTS', KEYS[1], key) == 1)
+        or (check[2] and redis.call('BF.EXISTS', KEYS[2], key) == 1) then
+        result[i - 1] = 0
+        duplicates = duplicates + 1
+    else
+        result[i - 1] = 1
+    end
+    repeated[key] = true
+end
+redis.call('HINCRBY', KEYS[3], 'total', #ARGV - 1)
+redis.call('HINCRBY', KEYS[3], 'duplicates', duplicates)
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+return result
+"""
+
+# KEYS: current bucket
+# ARGV: bucket ttl, error rate, capacity, event keys...
+# The filter is reserved with a low error rate on first use.
+BLOOM_MARK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('BF.RESERVE', KEYS[1], ARGV[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+for i = 4, #ARGV do
+    redis.call('BF.ADD', KEYS[1], ARGV[i])
+end
+return 1
+"""
+
+def event_key(messaging: Dict[str, Any]) -> Optional[str]:
+    """Idempotency key of a messaging event: its message or postback mid."""
+    for kind in ("message", "postback"):
+        if kind in messaging:
+            mid = messaging[kind].get("mid")
+            return f"{kind}:{mid}" if mid else None
+    return None
+
+def _event_keys(payload: Dict[str, Any]) -> List[str]:
+    """Keys of the messaging events, then the changes, of each entry."""
+    keys = []
+    for entry in payload.get("entry", []):
+        keys.extend(key for key in map(event_key, entry.get("messaging", [])) if key)
+        keys.extend(key for key in map(change_key, entry.get("changes", [])) if key)
+    return keys
+
+class WebhookDeduplicator:
+    """
+    Drops redelivered webhook events before they reach the database.
+
+    Seen event keys live in time-bucketed Redis sets (or Bloom filters);
+    an event is a duplicate if it is in the current or the previous bucket.
+    Events are only marked as seen once the payload carrying them has been
+    processed and committed, so a delivery lost to a crash or a failed
+    transaction is processed again when it is replayed or redelivered.
+    The unique index on message_logs.instagram_message_id (and the comment
+    pipeline's claims) keep concurrent and post-crash duplicates from
+    running twice.
+    """
+
+    def __init__(self):
+        self.window_seconds = settings.WEBHOOK_DEDUP_WINDOW_SECONDS
+        self.backend = settings.WEBHOOK_DEDUP_BACKEND
+
+    def _bucket_keys(self, now: float) -> List[str]:
+        bucket = int(now // self.window_seconds)
+        return [
+            f"{SEEN_KEY_PREFIX}:{self.backend}:{bucket}",
+            f"{SEEN_KEY_PREFIX}:{self.backend}:{bucket - 1}",
+        ]
+
+    def _stats_key(self, now: float) -> str:
+        return f"{STATS_KEY_PREFIX}:{int(now // 3600)}"
+
+    async def drop_duplicates(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the payload without messaging events and comments that were
+        already processed, and without repeats within the payload.
+
+        Events without a mid or comment id are kept. If Redis is unavailable the payload
+        is returned unchanged and the database constraint is relied upon.
+        """
+        keys = _event_keys(payload)
+        if not keys:
+            return payload
+
+        try:
+            flags = await self._check(keys)
+        except Exception as e:
+            logger.error(f"Webhook deduplication unavailable: {str(e)}")
+            return payload
+
+        if all(flags):
+            return payload
+
+        # Flags follow event order
+        flags = iter(flags)
+        entries = []
+        for entry in payload.get("entry", []):
+            messaging = [
+                event for event in entry.get("messaging", [])
+                if event_key(event) is None or next(flags)
+            ]
+            changes = [
+                change for change in entry.get("changes", [])
+                if change_key(change) is None or next(flags)
+            ]
+            entries.append({**entry, "messaging": messaging, "changes": changes})
+        return {**payload, "entry": entries}
+
+    async def _check(self, keys: List[str]) -> List[int]:
+        now = time.time()
+        script = BLOOM_CHECK_SCRIPT if self.backend == "bloom" else SET_CHECK_SCRIPT
+        return await redis_service.eval_script(
+            script,
+            keys=self._bucket_keys(now) + [self._stats_key(now)],
+            args=[STATS_TTL_SECONDS, *keys]
+        )
+
+    async def mark_seen(self, payload: Dict[str, Any]) -> None:
+        """
+        Mark the events of a payload as processed; call it once the payload
+        has been committed. A failure is only logged: a redelivery is then
+        stopped by the database constraint instead.
+        """
+        keys = _event_keys(payload)
+        if not keys:
+            return
+        current_bucket = self._bucket_keys(time.time())[0]
+        # Keep each bucket alive for the window after it stops being current
+        bucket_ttl = 2 * self.window_seconds
+        try:
+            if self.backend == "bloom":
+                await redis_service.eval_script(
+                    BLOOM_MARK_SCRIPT,
+                    keys=[current_bucket],
+                    args=[
+                        bucket_ttl,
+                        settings.WEBHOOK_DEDUP_BLOOM_ERROR_RATE,
+                        settings.WEBHOOK_DEDUP_BLOOM_CAPACITY,
+                        *keys,
+                    ]
+                )
+                return
+            await redis_service.init()
+            async with redis_service.redis.pipeline(transaction=True) as pipe:
+                pipe.sadd(current_bucket, *keys)
+                pipe.expire(current_bucket, bucket_ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error marking webhook events as seen: {str(e)}")
+
+    async def get_stats(self, hours: int = 24) -> Dict[str, Any]:
+        """Event and duplicate counts over the last hours."""
+        await redis_service.init()
+        current_hour = int(time.time() // 3600)
+        async with redis_service.redis.pipeline(transaction=False) as pipe:
+            for hour in range(current_hour - hours + 1, current_hour + 1):
+                pipe.hgetall(f"{STATS_KEY_PREFIX}:{hour}")
+            hourly_counts = await pipe.execute()
+
+        total = duplicates = 0
+        for counts in hourly_counts:
+            total += int(counts.get("total", 0))
+            duplicates += int(counts.get("duplicates", 0))
+        return {
+            "hours": hours,
+            "total_events": total,
+            "duplicate_events": duplicates,
+            "duplicate_rate": duplicates / total if total else 0.0,
+        }
+
+webhook_deduplicator = WebhookDeduplicator()
@@ -0,0 +1,291 @@
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import Boolean, literal_column, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.instagram_account import InstagramAccount
+from app.models.contact import Contact, ConversationStatus
+from app.models.conversation import Conversation, OPEN_CONVERSATION_PREDICATE
+from app.models.message_log import MessageLog
+from app.services.automation import AutomationEngine
+from app.services.comment_triggers import CommentEvent, collect_comment_events, comment_trigger_pipeline
+
+class WebhookEvent(NamedTuple):
+    instagram_page_id: str
+    sender_id: str
+    kind: str  # "message" or "postback"
+    body: Dict[str, Any]
+    timestamp: datetime
+    instagram_message_id: Optional[str]
+
+class WebhookResult(NamedTuple):
+    # Contacts created for new senders, whose profiles still have to be enriched
+    new_contact_ids: List[uuid.UUID]
+    # (job, delay_seconds) pairs for flows that reached a wait node and
+    # for comments to reply to
+    scheduled_jobs: List[Tuple[Dict[str, Any], float]]
+
+async def process_webhook_payload(db: AsyncSession, payload: Dict[str, Any]) -> WebhookResult:
+    """
+    Process a verified Instagram webhook payload.
+
+    Used by the webhook endpoint in inline ingestion mode and by the
+    webhook stream consumer otherwise. The caller does the follow-up
+    work in the result once the payload has been processed.
+    """
+    processor = WebhookBatchProcessor(db)
+    await processor.process(payload)
+    return WebhookResult(processor.new_contact_ids, processor.scheduled_jobs)
+
+class WebhookBatchProcessor:
+    """
+    Set-based processing of every event in a webhook payload.
+
+    Accounts are resolved with one IN query, senders and open conversations
+    are upserted with one INSERT ... ON CONFLICT each and message logs are
+    written in one batch. They are committed together with the changes of
+    the flows the events advance, in one transaction, so the number of
+    round trips does not grow with the number of events or with the nodes
+    they run. A payload whose flows fail leaves no logs behind, and its
+    redelivery runs them again.
+
+    Comments (`changes` entries) take the comment trigger pipeline: only
+    matching commenters are upserted, and their flows run later as paced
+    jobs.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.new_contact_ids: List[uuid.UUID] = []
+        self.scheduled_jobs: List[Tuple[Dict[str, Any], float]] = []
+
+    async def process(self, payload: Dict[str, Any]) -> None:
+        events = self._collect_events(payload)
+        comments = collect_comment_events(payload)
+        if not events and not comments:
+            return
+
+        accounts = await self._load_accounts(
+            {event.instagram_page_id for event in events} | {comment.instagram_page_id for comment in comments}
+        )
+        events = [event for event in events if event.instagram_page_id in accounts]
+        if events:
+            await self._process_messages(accounts, events)
+        if comments:
+            await self._process_comments(accounts, comments)
+
+    async def _process_messages(self, accounts: Dict[str, InstagramAccount], events: List[WebhookEvent]) -> None:
+        contacts = await self._upsert_contacts({
+            (accounts[event.instagram_page_id].id, event.sender_id): None for event in events
+        })
+        conversations = await self._upsert_conversations(contacts.values())
+        message_logs = await self._log_messages(accounts, contacts, conversations, events)
+
+        # Committed by the flush, with what the flows changed
+        automation_engine = AutomationEngine(self.db)
+        await automation_engine.load_states(contacts.values())
+        now = datetime.utcnow()
+        for event, message_log in zip(events, message_logs):
+            if message_log is None:
+                # Already logged by an earlier delivery of the same event
+                continue
+            account = accounts[event.instagram_page_id]
+            contact = contacts[(account.id, event.sender_id)]
+            if event.kind == "message":
+                await automation_engine.process_message(account, contact, message_log)
+            else:
+                await automation_engine.process_postback(account, contact, message_log)
+            # Set only once the engine has seen the event, so a sender's
+            # first DM gets the welcome flow; written by the flush
+            contact.last_interaction_at = now
+        await automation_engine.flush()
+        self.scheduled_jobs.extend(automation_engine.scheduled_jobs)
+
+    async def _process_comments(self, accounts: Dict[str, InstagramAccount], comments: List[CommentEvent]) -> None:
+        matches = await comment_trigger_pipeline.match(self.db, accounts, comments)
+        matches = await comment_trigger_pipeline.claim(matches)
+        if not matches:
+            return
+        try:
+            # Commenting is not a DM, so a later first message still gets
+            # the welcome flow
+            contacts = await self._upsert_contacts(
+                {(match.account.id, match.event.sender_id): match.event.username for match in matches}
+            )
+            await self.db.commit()
+            self.scheduled_jobs.extend(await comment_trigger_pipeline.schedule(matches, contacts))
+        except Exception:
+            # Let a redelivery claim the commenters again
+            await comment_trigger_pipeline.release(matches)
+            raise
+
+    def _collect_events(self, payload: Dict[str, Any]) -> List[WebhookEvent]:
+        events = []
+        for entry in payload.get("entry", []):
+            instagram_page_id = entry.get("id")
+            for messaging in entry.get("messaging", []):
+                sender_id = messaging.get("sender", {}).get("id")
+                if not instagram_page_id or not sender_id:
+                    continue
+                if "message" in messaging:
+                    kind = "message"
+                elif "postback" in messaging:
+                    kind = "postback"
+                else:
+                    continue
+                events.append(WebhookEvent(
+                    instagram_page_id=instagram_page_id,
+                    sender_id=sender_id,
+                    kind=kind,
+                    body=messaging[kind],
+                    timestamp=_event_timestamp(messaging),
+                    instagram_message_id=messaging[kind].get("mid")
+                ))
+        return events
+
+    async def _load_accounts(self, page_ids: set) -> Dict[str, InstagramAccount]:
+        accounts = (await self.db.scalars(
+            select(InstagramAccount).where(InstagramAccount.instagram_page_id.in_(page_ids))
+        )).all()
+        return {account.instagram_page_id: account for account in accounts}
+
+    async def _upsert_contacts(
+        self,
+        senders: Dict[Tuple[uuid.UUID, str], Optional[str]]
+    ) -> Dict[Tuple[uuid.UUID, str], Contact]:
+        """
+        Upsert the contacts of (account id, sender id) pairs, mapped to the
+        sender's username where the event carried it. last_interaction_at
+        is returned as it was before the event.
+        """
+        now = datetime.utcnow()
+        rows = {}
+        for (account_id, sender_id), username in senders.items():
+            # Keyed by sender: ON CONFLICT cannot touch the same row twice
+            # in one statement. Profile fields are placeholders until the
+            # enrichment worker has looked the sender up.
+            rows[(account_id, sender_id)] = {
+                "id": uuid.uuid4(),
+                "instagram_account_id": account_id,
+                "instagram_user_id": sender_id,
+                "instagram_username": username or sender_id,
+                "tags": [],
+                "custom_attributes": {},
+                "created_at": now,
+                "updated_at": now,
+            }
+
+        # xmax is 0 for a row version this statement inserted, and set for
+        # an existing row it updated
+        inserted = literal_column("xmax = 0", Boolean).label("inserted")
+        stmt = insert(Contact).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Contact.instagram_account_id, Contact.instagram_user_id],
+            set_={"updated_at": now}
+        ).returning(Contact, inserted)
+        results = (await self.db.execute(
+            select(Contact, inserted).from_statement(stmt).execution_options(populate_existing=True)
+        )).all()
+
+        self.new_contact_ids.extend(contact.id for contact, is_new in results if is_new)
+
+        return {(contact.instagram_account_id, contact.instagram_user_id): contact for contact, _ in results}
+
+    async def _upsert_conversations(self, contacts) -> Dict[uuid.UUID, Conversation]:
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "instagram_account_id": contact.instagram_account_id,
+                "contact_id": contact.id,
+                "status": ConversationStatus.OPEN,
+                "started_at": now,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for contact in contacts
+        ]
+
+        stmt = insert(Conversation).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Conversation.instagram_account_id, Conversation.contact_id],
+            index_where=OPEN_CONVERSATION_PREDICATE,
+            set_={"updated_at": now}
+        ).returning(Conversation)
+        conversations = (await self.db.scalars(
+            select(Conversation).from_statement(stmt).execution_options(populate_existing=True)
+        )).all()
+        return {conversation.contact_id: conversation for conversation in conversations}
+
+    async def _log_messages(
+        self,
+        accounts: Dict[str, InstagramAccount],
+        contacts: Dict[Tuple[uuid.UUID, str], Contact],
+        conversations: Dict[uuid.UUID, Conversation],
+        events: List[WebhookEvent]
+    ) -> List[Optional[MessageLog]]:
+        """
+        Insert one message log per event in a single statement.
+
+        Returns the logs aligned with events, with None for events whose mid
+        was already logged.
+        """
+        rows = []
+        for event in events:
+            contact = contacts[(accounts[event.instagram_page_id].id, event.sender_id)]
+            if event.kind == "message":
+                message_type = "text"
+                content = {"text": event.body.get("text", "")}
+                for attachment in event.body.get("attachments") or []:
+                    if attachment.get("type") == "story_mention":
+                        content["story_mention_url"] = (attachment.get("payload") or {}).get("url")
+            else:
+                message_type = "button_response"
+                content = {"payload": event.body.get("payload")}
+
+            rows.append({
+                "id": uuid.uuid4(),
+                "instagram_account_id": contact.instagram_account_id,
+                "contact_id": contact.id,
+                "conversation_id": conversations[contact.id].id,
+                "direction": "inbound",
+                "type": message_type,
+                "content": content,
+                "timestamp": event.timestamp,
+                "is_automated": False,
+                "instagram_message_id": event.instagram_message_id,
+            })
+
+        stmt = insert(MessageLog).values(rows).on_conflict_do_nothing(
+            index_elements=[MessageLog.instagram_message_id],
+            index_where=text("instagram_message_id IS NOT NULL")
+        ).returning(MessageLog.id)
+        inserted_ids = set((await self.db.scalars(stmt)).all())
+
+        message_logs = []
+        last_messages = {}
+        for row in rows:
+            if row["id"] not in inserted_ids:
+                message_logs.append(None)
+                continue
+            message_log = MessageLog(**row)
+            message_logs.append(message_log)
+            last_messages[row["conversation_id"]] = message_log
+
+        if last_messages:
+            await self.db.execute(
+                update(Conversation),
+                [
+                    {"id": conversation_id, "last_message_id": message_log.id, "updated_at": message_log.timestamp}
+                    for conversation_id, message_log in last_messages.items()
+                ]
+            )
+        return message_logs
+
+def _event_timestamp(messaging: Dict[str, Any]) -> datetime:
+    """Webhook timestamps are epoch milliseconds on the messaging event."""
+    timestamp: Optional[int] = messaging.get("timestamp")
+    if timestamp is None:
+        return datetime.utcnow()
+    return datetime.utcfromtimestamp(timestamp / 1000)
@@ -0,0 +1,52 @@
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List
+import orjson
+from app.core.config import settings
+from app.services.redis_service import redis_service
+
+WEBHOOK_STREAM_PREFIX = "webhooks:instagram"
+
+def partition_for(instagram_page_id: str) -> int:
+    """Map a page id to its stream partition (stable across processes)."""
+    return zlib.crc32(str(instagram_page_id).encode("utf-8")) % settings.WEBHOOK_STREAM_PARTITIONS
+
+def stream_key(partition: int) -> str:
+    return f"{WEBHOOK_STREAM_PREFIX}:{partition}"
+
+def all_stream_keys() -> List[str]:
+    return [stream_key(partition) for partition in range(settings.WEBHOOK_STREAM_PARTITIONS)]
+
+async def publish_webhook(raw_body: bytes, payload: Dict[str, Any]) -> bool:
+    """
+    Append a verified webhook delivery to the stream partition of its page.
+
+    The raw body is stored untouched when every entry belongs to the same
+    partition, which is the common case. Deliveries spanning several
+    partitions are split so each page's events stay ordered in one stream.
+    Returns False if any append failed, in which case the caller should
+    answer with an error so that Meta redelivers.
+    """
+    entries_by_partition: Dict[int, List[Dict[str, Any]]] = {}
+    for entry in payload.get("entry", []):
+        entries_by_partition.setdefault(partition_for(entry.get("id", "")), []).append(entry)
+
+    if len(entries_by_partition) <= 1:
+        partition = next(iter(entries_by_partition), 0)
+        bodies = {partition: raw_body.decode("utf-8")}
+    else:
+        bodies = {
+            partition: orjson.dumps({"object": payload.get("object"), "entry": entries}).decode("utf-8")
+            for partition, entries in entries_by_partition.items()
+        }
+
+    received_at = datetime.utcnow().isoformat()
+    for partition, body in bodies.items():
+        message_id = await redis_service.add_to_stream(
+            stream_key(partition),
+            {"body": body, "received_at": received_at},
+            maxlen=settings.WEBHOOK_STREAM_MAXLEN
+        )
+        if not message_id:
+            return False
+    return True
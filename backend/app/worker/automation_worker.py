@@ -1,71 +1,384 @@
+import argparse
 import asyncio
-import json
 import logging
-from typing import Dict, Any
+import multiprocessing
+import signal
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Set
+import uuid
+from datetime import datetime
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.contact import Contact
+from app.models.instagram_account import InstagramAccount
+from app.models.message_log import MessageLog
+from app.services.job_lanes import AUTOMATION_QUEUE, job_lane, lane_queue, lanes_for_process
 from app.services.redis_service import redis_service
-from app.services.automation import AutomationService
-from app.db.session import SessionLocal
+from app.services.automation import AutomationEngine, get_automation_engine
+from app.services.cache_invalidation import cache_invalidation_bus
+from app.services.delayed_jobs import delayed_job_scheduler
+from app.services.flow_compiler import preload_flows
+from app.services.flow_metrics import flow_metrics
+from app.services.flow_state import flow_state_store
+from app.services.graph_client import graph_client
+from app.services.resilience import FAILING, account_breaker, dead_letters, retry_delay, retry_or_dead_letter
+from app.services.token_refresh import token_refresh_sweeper
 
 logger = logging.getLogger(__name__)
 
-class AutomationWorker:
-    def __init__(self):
-        self.automation_service = AutomationService()
-        self.queue_name = "automation_tasks"
+class PartitionedExecutor:
+    """
+    Runs jobs on a fixed set of lanes, one asyncio task per lane.
+
+    Jobs on the same lane run strictly in submission order while different
+    lanes run concurrently. Each lane has a bounded queue, and the fetcher
+    only takes as many jobs of a lane as its queue has room for, leaving
+    the rest in Redis instead of buffering without limit.
+    """
+
+    def __init__(
+        self,
+        lanes: List[int],
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        max_lane_depth: int
+    ):
+        self.handler = handler
+        self.queues: Dict[int, asyncio.Queue] = {
+            lane: asyncio.Queue(maxsize=max_lane_depth) for lane in lanes
+        }
+        self.stats: Dict[int, Dict[str, float]] = {
+            lane: {"processed": 0, "failed": 0, "full_skips": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for lane in lanes
+        }
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._run_lane(lane)) for lane in self.queues]
+
+    def free_slots(self, lane: int) -> int:
+        """How many more jobs the lane's queue takes; counts a full lane."""
+        queue = self.queues[lane]
+        free = queue.maxsize - queue.qsize()
+        if free <= 0:
+            self.stats[lane]["full_skips"] += 1
+        return free
+
+    def submit(self, lane: int, job: Dict[str, Any]):
+        """Queue a job on a lane the caller made sure has room."""
+        self.queues[lane].put_nowait((time.monotonic(), job))
+
+    async def _run_lane(self, lane: int):
+        queue = self.queues[lane]
+        stats = self.stats[lane]
+        while True:
+            submitted_at, job = await queue.get()
+            waited = time.monotonic() - submitted_at
+            stats["wait_seconds"] += waited
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+            try:
+                await self.handler(job)
+                stats["processed"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.exception(f"Error in lane {lane}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def drain(self):
+        """Wait until every submitted job has run."""
+        for queue in self.queues.values():
+            await queue.join()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def metrics(self) -> Dict[int, Dict[str, float]]:
+        """Per-lane depth, counters and queueing delay."""
+        return {
+            lane: {
+                **stats,
+                "depth": self.queues[lane].qsize(),
+                "avg_wait_seconds": stats["wait_seconds"] / stats["processed"] if stats["processed"] else 0.0,
+            }
+            for lane, stats in self.stats.items()
+        }
+
+class Worker:
+    def __init__(self, process_index: int = None, process_count: int = None):
+        self.running = True
+        self.active_jobs: Set[str] = set()
+        self.worker_id = str(uuid.uuid4())
+        self.process_index = settings.WORKER_PROCESS_INDEX if process_index is None else process_index
+        self.process_count = settings.WORKER_PROCESS_COUNT if process_count is None else process_count
+        self.lanes = lanes_for_process(self.process_index, self.process_count)
+        self.lane_by_queue = {lane_queue(lane): lane for lane in self.lanes}
+        # Position in self.lanes of the lane BLPOP looks at first
+        self.next_lane = 0
+        self.executor = PartitionedExecutor(self.lanes, self.process_job, settings.WORKER_MAX_LANE_DEPTH)
+        self.fetch_batch_size = 50
+        self.metrics_interval_seconds = 10
+
+    async def start(self):
+        """Start the worker."""
+        logger.info(
+            f"Starting worker {self.worker_id} ({self.process_index + 1}/{self.process_count}, {len(self.lanes)} lanes)"
+        )
+
+        # Set up signal handlers
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.shutdown)
+
+        self.executor.start()
+        await cache_invalidation_bus.start()
+        await preload_flows()
+        background = [
+            asyncio.create_task(self.report_metrics()),
+            asyncio.create_task(flow_metrics.run_reporter())
+        ]
+        # Claims are atomic, so every process fires its share of delayed jobs
+        scheduler = asyncio.create_task(delayed_job_scheduler.run())
+        if self.process_index == 0:
+            # A single router keeps unpartitioned jobs in order per contact
+            background.append(asyncio.create_task(self.route_unpartitioned_jobs()))
+            # and a single flusher writes each contact's states in order
+            background.append(asyncio.create_task(flow_state_store.run_flusher()))
+            # Tokens are refreshed ahead of expiry rather than failing sends
+            background.append(asyncio.create_task(token_refresh_sweeper.run()))
+        try:
+            # Main worker loop
+            while self.running:
+                await self.process_queues()
+        finally:
+            # A flush cut short here is re-queued by the next flusher's reaper
+            flow_state_store.stop()
+            flow_metrics.stop()
+            token_refresh_sweeper.stop()
+            for task in background:
+                task.cancel()
+            # Hands the jobs held in its timing wheel back to Redis
+            delayed_job_scheduler.stop()
+            await scheduler
+            await self.cleanup()
+
+    def shutdown(self, signum, frame):
+        """Handle shutdown signals."""
+        logger.info(f"Received signal {signum}. Shutting down...")
         self.running = False
 
-    async def process_task(self, task_data: Dict[str, Any]):
-        """Process a single automation task."""
+    async def cleanup(self):
+        """Clean up resources."""
+        logger.info("Cleaning up...")
+        # Let jobs already handed to the lanes finish
+        await self.executor.drain()
+        await self.executor.stop()
+        # What was recorded since the last report
+        await flow_metrics.report()
+
+        await cache_invalidation_bus.stop()
+        await graph_client.close()
+        await redis_service.close()
+        logger.info("Cleanup complete")
+
+    async def process_queues(self):
+        """
+        Move jobs from this worker's lane queues onto its executor lanes.
+
+        Only lanes with room are fetched from, so a full lane waits in
+        Redis without holding up the others. BLPOP serves the first
+        non-empty key, so the key order starts after the lane served last
+        and every lane gets its turn.
+        """
         try:
-            db = SessionLocal()
-            flow_id = task_data.get("flow_id")
-            trigger_data = task_data.get("trigger_data", {})
-            
-            if not flow_id:
-                logger.error("Invalid task data: missing flow_id")
+            lanes = self.lanes[self.next_lane:] + self.lanes[:self.next_lane]
+            queue_names = [lane_queue(lane) for lane in lanes if self.executor.free_slots(lane) > 0]
+            if not queue_names:
+                await asyncio.sleep(0.05)
+                return
+            await redis_service.init()
+            popped = await redis_service.redis.blpop(queue_names, timeout=1)
+            if not popped:
                 return
+            queue_name, data = popped
+            lane = self.lane_by_queue[queue_name]
+            self.next_lane = (self.lanes.index(lane) + 1) % len(self.lanes)
+            self.executor.submit(lane, orjson.loads(data))
+
+            # Take what else is waiting on that lane, as far as it has room,
+            # in the same round trip
+            free = self.executor.free_slots(lane)
+            if free > 0:
+                more = await redis_service.redis.lpop(queue_name, min(free, self.fetch_batch_size))
+                for data in more or []:
+                    self.executor.submit(lane, orjson.loads(data))
 
-            await self.automation_service.execute_flow(
-                db=db,
-                flow_id=flow_id,
-                trigger_data=trigger_data
-            )
         except Exception as e:
-            logger.error(f"Error processing task: {str(e)}")
-        finally:
-            db.close()
+            logger.exception(f"Error processing queues: {str(e)}")
+            await asyncio.sleep(1)
 
-    async def start(self):
-        """Start the worker process."""
-        self.running = True
-        logger.info("Starting automation worker...")
-        
+    async def route_unpartitioned_jobs(self):
+        """Move jobs queued without a lane onto the lane of their contact."""
         while self.running:
             try:
-                # Get task from queue
-                task = await redis_service.get_from_queue(self.queue_name)
-                
-                if task:
-                    logger.info(f"Processing task: {task}")
-                    await self.process_task(task)
-                else:
-                    # If no task, wait a bit before checking again
-                    await asyncio.sleep(1)
-                    
+                job = await redis_service.get_from_queue(AUTOMATION_QUEUE)
+                if not job:
+                    await asyncio.sleep(0.5)
+                    continue
+                lane = job_lane(job)
+                if lane is None:
+                    # No contact, no ordering constraint
+                    lane = hash(job.get("job_id", id(job))) % settings.WORKER_LANES
+                await redis_service.add_to_queue(lane_queue(lane), job)
             except Exception as e:
-                logger.error(f"Error in worker loop: {str(e)}")
-                await asyncio.sleep(5)  # Wait longer on error
+                logger.exception(f"Error routing jobs: {str(e)}")
+                await asyncio.sleep(1)
 
-    def stop(self):
-        """Stop the worker process."""
-        self.running = False
-        logger.info("Stopping automation worker...")
+    async def report_metrics(self):
+        """Publish lane metrics so backpressure is visible outside the process."""
+        key = f"worker:metrics:{self.process_index}"
+        while True:
+            await asyncio.sleep(self.metrics_interval_seconds)
+            try:
+                await redis_service.init()
+                await redis_service.redis.set(
+                    key,
+                    orjson.dumps({
+                        "worker_id": self.worker_id,
+                        "reported_at": datetime.utcnow().isoformat(),
+                        "lanes": self.executor.metrics(),
+                    }).decode("utf-8"),
+                    ex=self.metrics_interval_seconds * 3
+                )
+            except Exception as e:
+                logger.exception(f"Error reporting metrics: {str(e)}")
+
+    async def process_job(self, job: dict):
+        """Process a single job."""
+        job_id = job.get("job_id", str(uuid.uuid4()))
+
+        try:
+            # Try to acquire lock for this job
+            if not await redis_service.set_lock(
+                f"job:{job_id}",
+                self.worker_id,
+                expiry_seconds=300  # 5 minutes
+            ):
+                logger.debug(f"Job {job_id} is already being processed")
+                return
+
+            self.active_jobs.add(job_id)
+            if await self.skip_for_broken_account({**job, "job_id": job_id}):
+                return
+
+            # Get database session
+            async with AsyncSessionLocal() as db:
+                # Get automation engine
+                automation_engine = get_automation_engine(db)
+
+                # Process job based on type
+                job_type = job.get("type")
+                if job_type == "execute_flow":
+                    await automation_engine.execute_flow(
+                        flow_id=job["flow_id"],
+                        trigger_data=job["trigger_data"]
+                    )
+                elif job_type == "resume_flow":
+                    await automation_engine.resume_flow(job)
+                    await automation_engine.flush()
+                elif job_type == "comment_trigger":
+                    await automation_engine.start_comment_flow(job)
+                    await automation_engine.flush()
+                elif job_type == "send_messages":
+                    await automation_engine.retry_send(job)
+                    await automation_engine.flush()
+                elif job_type == "process_message":
+                    await self.process_message(db, automation_engine, job)
+                else:
+                    logger.warning(f"Unknown job type: {job_type}")
 
-async def run_worker():
-    """Run the automation worker."""
-    worker = AutomationWorker()
+            # Waits reached by the job, now that their state is committed
+            await delayed_job_scheduler.schedule_many(automation_engine.scheduled_jobs)
+
+        except Exception as e:
+            logger.exception(f"Error processing job {job_id}: {str(e)}")
+            await self.retry_job({**job, "job_id": job_id}, e)
+
+        finally:
+            self.active_jobs.discard(job_id)
+            await redis_service.release_lock(f"job:{job_id}", self.worker_id)
+
+    async def skip_for_broken_account(self, job: dict) -> bool:
+        """
+        Keep jobs of an account with an open circuit breaker off the lanes:
+        put off while it is failing, dead-lettered while its token is
+        expired.
+        """
+        if not job.get("account_id"):
+            return False
+        reason = await account_breaker.check(job["account_id"])
+        if reason is None:
+            return False
+        if reason == FAILING:
+            await delayed_job_scheduler.schedule(job, retry_delay(job.get("attempt", 0) + 1))
+        else:
+            await dead_letters.add(job, reason)
+        return True
+
+    async def retry_job(self, job: dict, error: Exception):
+        """Schedule a failed job to run again later, or dead-letter it."""
+        try:
+            retry = await retry_or_dead_letter(job, error)
+            if retry is not None:
+                await delayed_job_scheduler.schedule(*retry)
+        except Exception as e:
+            logger.exception(f"Error retrying job {job['job_id']}: {str(e)}")
+
+    async def process_message(self, db: AsyncSession, automation_engine: AutomationEngine, job: dict):
+        """Run the flows of an already logged inbound message."""
+        account = await db.get(InstagramAccount, uuid.UUID(job["account_id"]))
+        contact = await db.get(Contact, uuid.UUID(job["contact_id"]))
+        message = await db.get(MessageLog, uuid.UUID(job["message_id"]))
+        if not account or not contact or not message:
+            logger.warning(f"Skipping message job for missing records: {job}")
+            return
+        await automation_engine.process_message(account, contact, message)
+        await automation_engine.flush()
+
+def run_worker_process(process_index: int, process_count: int):
+    """Entry point of one worker process."""
+    worker = Worker(process_index=process_index, process_count=process_count)
+    asyncio.run(worker.start())
+
+async def main():
+    """Main entry point for the worker."""
+    worker = Worker()
     await worker.start()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run automation workers")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Spawn this many worker processes, each owning a share of the lanes"
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(run_worker()) 
\ No newline at end of file
+    if args.processes <= 1:
+        asyncio.run(main())
+        sys.exit(0)
+
+    processes = [
+        multiprocessing.Process(target=run_worker_process, args=(index, args.processes))
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
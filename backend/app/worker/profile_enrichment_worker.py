@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+from sqlalchemy import bindparam, func, select, update
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.contact import Contact
+from app.models.instagram_account import InstagramAccount
+from app.services.graph_client import InstagramAPIError
+from app.services.instagram import instagram_api
+from app.services.profile_enrichment import (
+    claim_profile_enrichment_batch,
+    clear_profile_enrichment_attempts,
+    retry_profile_enrichment
+)
+
+logger = logging.getLogger(__name__)
+
+class ProfileEnrichmentWorker:
+    """
+    Backfills Instagram profile fields of newly created contacts.
+
+    Contacts are created with placeholder profile fields so that the first
+    message of a new user never waits on the Graph API. This worker claims
+    queued contacts in batches, looks their profiles up with one Graph API
+    batch request per account and writes them back with one UPDATE.
+    """
+
+    def __init__(self):
+        self.batch_size = settings.PROFILE_ENRICHMENT_BATCH_SIZE
+        self.running = False
+
+    async def enrich(self, contact_ids: List[str]) -> List[str]:
+        """
+        Fetch and store profiles for a batch of contacts. Returns the
+        contacts whose lookup failed.
+        """
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(
+                    Contact.id,
+                    Contact.instagram_user_id,
+                    InstagramAccount.instagram_page_id,
+                    InstagramAccount.access_token
+                )
+                .join(InstagramAccount, Contact.instagram_account_id == InstagramAccount.id)
+                .where(Contact.id.in_(contact_ids))
+            )).all()
+
+            users_by_account: Dict[Tuple[str, str], Dict[str, str]] = {}
+            for contact_id, instagram_user_id, instagram_page_id, access_token in rows:
+                users_by_account.setdefault((instagram_page_id, access_token), {})[instagram_user_id] = contact_id
+
+            updates = []
+            failed = []
+            for (instagram_page_id, access_token), contacts_by_user in users_by_account.items():
+                try:
+                    profiles, failed_users = await instagram_api.get_user_profiles(
+                        list(contacts_by_user), access_token, instagram_page_id
+                    )
+                except InstagramAPIError as e:
+                    logger.error(f"Profile lookup failed: {e.message}")
+                    failed.extend(contacts_by_user.values())
+                    continue
+                failed.extend(contacts_by_user[instagram_user_id] for instagram_user_id in failed_users)
+                for instagram_user_id, profile in profiles.items():
+                    updates.append({
+                        "contact_id": contacts_by_user[instagram_user_id],
+                        "username": profile.get("username") or instagram_user_id,
+                        "name": profile.get("name"),
+                        "profile_pic": profile.get("profile_pic"),
+                    })
+
+            if updates:
+                # Names entered by hand are not overwritten
+                contacts = Contact.__table__
+                await db.execute(
+                    update(contacts)
+                    .where(contacts.c.id == bindparam("contact_id"))
+                    .values(
+                        instagram_username=bindparam("username"),
+                        first_name=func.coalesce(contacts.c.first_name, bindparam("name")),
+                        profile_picture_url=bindparam("profile_pic")
+                    ),
+                    updates
+                )
+                await db.commit()
+        return failed
+
+    async def start(self):
+        """Start the worker loop."""
+        self.running = True
+        logger.info("Starting profile enrichment worker...")
+
+        while self.running:
+            contact_ids = []
+            try:
+                contact_ids = await claim_profile_enrichment_batch(self.batch_size)
+                if contact_ids:
+                    failed = await self.enrich(contact_ids)
+                    await retry_profile_enrichment(failed)
+                    failed = {str(contact_id) for contact_id in failed}
+                    await clear_profile_enrichment_attempts(
+                        contact_id for contact_id in contact_ids if contact_id not in failed
+                    )
+            except Exception as e:
+                logger.error(f"Error in profile enrichment loop: {str(e)}")
+                # The claimed contacts left the queue, put them back
+                try:
+                    await retry_profile_enrichment(contact_ids)
+                except Exception as e:
+                    logger.error(f"Error queueing profile enrichment retries: {str(e)}")
+                await asyncio.sleep(5)
+
+        await instagram_api.close()
+
+    def stop(self):
+        """Stop the worker loop."""
+        self.running = False
+        logger.info("Stopping profile enrichment worker...")
+
+async def run_worker():
+    """Run the profile enrichment worker."""
+    worker = ProfileEnrichmentWorker()
+    await worker.start()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker())
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+import orjson
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.services.cache_invalidation import cache_invalidation_bus
+from app.services.delayed_jobs import delayed_job_scheduler
+from app.services.flow_compiler import preload_flows
+from app.services.flow_metrics import flow_metrics
+from app.services.graph_client import graph_client
+from app.services.profile_enrichment import enqueue_profile_enrichment
+from app.services.redis_service import redis_service
+from app.services.resilience import dead_letters, retry_delay
+from app.services.webhook_dedup import webhook_deduplicator
+from app.services.webhook_processor import process_webhook_payload
+from app.services.webhook_stream import stream_key
+
+logger = logging.getLogger(__name__)
+
+# Moves the entries of group ARGV[1] on stream KEYS[1] that have been
+# pending for at least ARGV[3] ms to consumer ARGV[2]; returns how many.
+CLAIM_SCRIPT = """
+local start = '0-0'
+local claimed = 0
+repeat
+    local result = redis.call('XAUTOCLAIM', KEYS[1], ARGV[1], ARGV[2], ARGV[3], start, 'COUNT', 100, 'JUSTID')
+    start = result[1]
+    claimed = claimed + #result[2]
+until start == '0-0'
+return claimed
+"""
+
+class WebhookConsumer:
+    """
+    Drains webhook deliveries from the partitioned Redis streams.
+
+    Consumers join one consumer group, and each partition is read by one
+    consumer only, so a page's events are handled in order. Entries are
+    acknowledged only after processing. A failed entry is retried, after
+    a backoff, before anything after it in its stream, and dead-lettered
+    once it has failed RETRY_MAX_ATTEMPTS times. The consumer's name is
+    stable across restarts, so a restarted consumer replays its own
+    pending entries; entries left pending under any other name (a
+    consumer that was scaled away, or an old one still shutting down) are
+    claimed once idle for WEBHOOK_CLAIM_MIN_IDLE_SECONDS.
+    """
+
+    def __init__(
+        self,
+        partitions: Optional[List[int]] = None,
+        consumer_index: Optional[int] = None,
+        consumer_count: Optional[int] = None
+    ):
+        self.group = settings.WEBHOOK_CONSUMER_GROUP
+        consumer_index = settings.WEBHOOK_CONSUMER_INDEX if consumer_index is None else consumer_index
+        consumer_count = settings.WEBHOOK_CONSUMER_COUNT if consumer_count is None else consumer_count
+        self.consumer_name = f"consumer-{consumer_index}"
+        if partitions is None:
+            partitions = [
+                partition for partition in range(settings.WEBHOOK_STREAM_PARTITIONS)
+                if partition % consumer_count == consumer_index
+            ]
+        self.streams = [stream_key(partition) for partition in partitions]
+        self.batch_size = 100
+        self.block_ms = 5000
+        self.claim_min_idle_ms = settings.WEBHOOK_CLAIM_MIN_IDLE_SECONDS * 1000
+        self.claim_interval_seconds = settings.WEBHOOK_CLAIM_MIN_IDLE_SECONDS
+        self.max_attempts = settings.RETRY_MAX_ATTEMPTS
+        # Streams to read from this consumer's pending entries before new ones
+        self.replaying = set(self.streams)
+        # Stream -> when its failed entry is retried (monotonic clock)
+        self.retry_at: Dict[str, float] = {}
+        # Entry id -> failed attempts so far
+        self.attempts: Dict[str, int] = {}
+        self.running = False
+
+    async def setup(self):
+        """Make sure the consumer group exists on every stream."""
+        for stream in self.streams:
+            await redis_service.ensure_consumer_group(stream, self.group)
+
+    async def process_delivery(self, stream: str, message_id: str, fields: Dict[str, Any]) -> bool:
+        """
+        Process a single stream entry and acknowledge it. Returns False if
+        it failed and is to be retried.
+        """
+        try:
+            payload = orjson.loads(fields["body"])
+        except orjson.JSONDecodeError:
+            logger.error(f"Dropping undecodable webhook {stream}/{message_id}")
+            await redis_service.ack_stream(stream, self.group, message_id)
+            return True
+
+        payload = await webhook_deduplicator.drop_duplicates(payload)
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await process_webhook_payload(db, payload)
+        except Exception as e:
+            logger.error(f"Error processing webhook {stream}/{message_id}: {str(e)}")
+            attempts = self.attempts[message_id] = self.attempts.get(message_id, 0) + 1
+            if attempts < self.max_attempts:
+                # Left unacknowledged, and retried from the pending list
+                self.retry_at[stream] = time.monotonic() + retry_delay(attempts)
+                return False
+            await dead_letters.add(
+                {"type": "webhook", "stream": stream, "message_id": message_id, "body": fields["body"]},
+                "retries_exhausted",
+                str(e)
+            )
+        else:
+            # Marked once committed, so a replay of an entry that was cut
+            # short is not taken for a duplicate
+            await webhook_deduplicator.mark_seen(payload)
+            await delayed_job_scheduler.schedule_many(result.scheduled_jobs)
+            await enqueue_profile_enrichment(result.new_contact_ids)
+        self.attempts.pop(message_id, None)
+        await redis_service.ack_stream(stream, self.group, message_id)
+        return True
+
+    async def claim_abandoned(self) -> int:
+        """
+        Move entries left pending by other consumers of this consumer's
+        partitions to it, to be processed before any new entry.
+        """
+        claimed = 0
+        for stream in self.streams:
+            count = await redis_service.eval_script(
+                CLAIM_SCRIPT,
+                keys=[stream],
+                args=[self.group, self.consumer_name, self.claim_min_idle_ms]
+            )
+            if count:
+                logger.info(f"Claimed {count} abandoned webhook entries of {stream}")
+                self.replaying.add(stream)
+                claimed += count
+        return claimed
+
+    async def consume(self, block_ms: Optional[int] = None) -> int:
+        """
+        Read one batch and process it: this consumer's pending entries of
+        the streams that have some, else new entries. Streams waiting to
+        retry a failed entry are left alone. Returns how many entries were
+        read.
+        """
+        now = time.monotonic()
+        streams = [stream for stream in self.streams if self.retry_at.get(stream, 0) <= now]
+        replaying = [stream for stream in streams if stream in self.replaying]
+        if replaying:
+            stream_ids = {stream: "0" for stream in replaying}
+            block_ms = None
+        elif streams:
+            stream_ids = {stream: ">" for stream in streams}
+        else:
+            wait_seconds = min(self.retry_at.values()) - now
+            await asyncio.sleep(min(wait_seconds, block_ms / 1000) if block_ms else wait_seconds)
+            return 0
+
+        response = await redis_service.read_stream_group(
+            self.group,
+            self.consumer_name,
+            stream_ids,
+            count=self.batch_size,
+            block_ms=block_ms
+        )
+        for stream, messages in response:
+            if not messages:
+                # Nothing pending any more; on to new entries
+                self.replaying.discard(stream)
+        # Partitions are independent, entries within one stay in order
+        await asyncio.gather(*(
+            self._process_stream(stream, messages) for stream, messages in response if messages
+        ))
+        return sum(len(messages) for _, messages in response)
+
+    async def _process_stream(self, stream: str, messages: List[Any]):
+        for message_id, fields in messages:
+            if not await self.process_delivery(stream, message_id, fields):
+                # What follows waits for the failed entry, so the stream is
+                # read from its pending entries again once the backoff ends
+                self.replaying.add(stream)
+                return
+        self.retry_at.pop(stream, None)
+
+    async def start(self):
+        """Start the consumer loop."""
+        self.running = True
+        logger.info(f"Starting webhook consumer {self.consumer_name}...")
+        await self.setup()
+        await cache_invalidation_bus.start()
+        await preload_flows()
+        reporter = asyncio.create_task(flow_metrics.run_reporter())
+
+        claimed_at = 0.0
+        while self.running:
+            try:
+                if time.monotonic() - claimed_at >= self.claim_interval_seconds:
+                    await self.claim_abandoned()
+                    claimed_at = time.monotonic()
+                await self.consume(block_ms=self.block_ms)
+            except Exception as e:
+                logger.error(f"Error in webhook consumer loop: {str(e)}")
+                await asyncio.sleep(5)
+
+        flow_metrics.stop()
+        reporter.cancel()
+        await cache_invalidation_bus.stop()
+        await graph_client.close()
+
+    def stop(self):
+        """Stop the consumer loop."""
+        self.running = False
+        logger.info("Stopping webhook consumer...")
+
+async def run_consumer():
+    """Run the webhook consumer."""
+    consumer = WebhookConsumer()
+    await consumer.start()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_consumer())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+List or replay dead-lettered jobs.
+
+Jobs land on the dead-letter stream when they failed permanently, ran out
+of retries or belonged to an account whose token expired, and so do
+webhook deliveries the consumer kept failing on. Replaying puts a job
+back through the delayed job scheduler with a fresh attempt count, or a
+webhook delivery back onto its stream, and removes it from the
+dead-letter stream. Fix the cause first (e.g. reconnect the account; the
+token refresh sweeper closes its circuit breaker within a sweep interval,
+or pass --close-breaker), or the job comes right back.
+
+    python scripts/replay_dead_letters.py
+    python scripts/replay_dead_letters.py --replay --reason token_expired --account <account id>
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import Any, Dict, List
+
+import orjson
+
+from app.services.delayed_jobs import delayed_job_scheduler
+from app.services.redis_service import redis_service
+from app.services.resilience import account_breaker, dead_letters
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--replay", action="store_true", help="replay the matching entries (default: list them)")
+    parser.add_argument("--reason", help="only entries dead-lettered for this reason")
+    parser.add_argument("--type", help="only jobs of this type")
+    parser.add_argument("--account", help="only jobs of this account id")
+    parser.add_argument("--close-breaker", action="store_true", help="close the --account's circuit breaker first")
+    parser.add_argument("--count", type=int, default=1000, help="entries to look at, oldest first")
+    parser.add_argument("--start", default="-", help="first entry id to look at")
+    parser.add_argument("--spread-seconds", type=float, default=0.0, help="spread replays over this many seconds")
+    return parser.parse_args(argv)
+
+def matches(args: argparse.Namespace, entry: Dict[str, Any]) -> bool:
+    job = entry["job"]
+    return (
+        (args.reason is None or entry["reason"] == args.reason)
+        and (args.type is None or job.get("type") == args.type)
+        and (args.account is None or job.get("account_id") == args.account)
+    )
+
+async def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    try:
+        entries = [
+            (entry_id, entry)
+            for entry_id, entry in await dead_letters.read(count=args.count, start=args.start)
+            if matches(args, entry)
+        ]
+        if not args.replay:
+            for entry_id, entry in entries:
+                print(orjson.dumps({"id": entry_id, **entry}).decode("utf-8"))
+            print(f"{len(entries)} matching of {await dead_letters.length()} dead-lettered jobs", file=sys.stderr)
+            return
+
+        if args.close_breaker and args.account:
+            await account_breaker.close(args.account)
+        for index, (entry_id, entry) in enumerate(entries):
+            job = entry["job"]
+            if job.get("type") == "webhook":
+                if not await redis_service.add_to_stream(
+                    job["stream"],
+                    {"body": job["body"], "received_at": datetime.utcnow().isoformat()}
+                ):
+                    print(f"Could not replay {entry_id}; left dead-lettered", file=sys.stderr)
+                    continue
+            else:
+                delay = args.spread_seconds * index / len(entries)
+                await delayed_job_scheduler.schedule({**job, "attempt": 0}, delay)
+            await dead_letters.delete(entry_id)
+        print(f"Replayed {len(entries)} jobs", file=sys.stderr)
+    finally:
+        await redis_service.close()
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import asyncio
 import logging
-from app.worker import Worker
+from app.worker.automation_worker import Worker
 
 logging.basicConfig(
     level=logging.INFO,
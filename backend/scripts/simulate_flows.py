@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Offline flow simulator and throughput benchmark for the automation engine.
+
+Runs synthetic contacts through a flow definition with AutomationEngine,
+sending into memory instead of the Graph API, and reports events/sec,
+per-node latency percentiles and database round trips per event.
+
+By default the database is simulated in memory as well: every get,
+execute and commit the engine issues is counted as one round trip. With
+--database-url the engine runs against a real Postgres database (use a
+scratch one; tables are created if missing and seeded rows are left
+behind). SQLite is not supported, the models use Postgres ARRAY and
+JSONB columns.
+
+    python scripts/simulate_flows.py --contacts 1000 --events 10
+    python scripts/simulate_flows.py --flow my_flow.json --json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import orjson
+from sqlalchemy import event
+
+from app.db.base_class import Base
+from app.models.contact import Contact
+from app.models.flow import Flow, FlowStatus, Trigger, TriggerType
+from app.models.instagram_account import InstagramAccount
+from app.models.message_log import MessageLog
+from app.models.user import User
+from app.services.automation import AutomationEngine
+from app.services.flow_compiler import CompiledNode, flow_cache
+from app.services.flow_state import FlowState, flow_state_store
+from app.services.trigger_matcher import trigger_index
+
+# Sample flow of the PRD, with the two nodes it leaves out added
+DEFAULT_FLOW_DEFINITION: Dict[str, Any] = {
+    "startNodeId": "node_1",
+    "nodes": [
+        {
+            "id": "node_1",
+            "type": "start",
+            "connections": [{"targetNodeId": "node_2", "condition": None}]
+        },
+        {
+            "id": "node_2",
+            "type": "message",
+            "content": {
+                "text": "Hello {{contact.firstName}}! Welcome to our page. How can I help you today?",
+                "mediaUrl": None,
+                "buttons": [
+                    {"type": "quick_reply", "text": "Browse Products", "payload": "BROWSE_PRODUCTS"},
+                    {"type": "quick_reply", "text": "Contact Support", "payload": "CONTACT_SUPPORT"}
+                ]
+            },
+            "connections": [
+                {"targetNodeId": "node_3", "condition": {"type": "button_payload", "value": "BROWSE_PRODUCTS"}},
+                {"targetNodeId": "node_4", "condition": {"type": "button_payload", "value": "CONTACT_SUPPORT"}}
+            ]
+        },
+        {
+            "id": "node_3",
+            "type": "tag_contact",
+            "tagName": "browsed_products",
+            "connections": [{"targetNodeId": "node_5", "condition": None}]
+        },
+        {
+            "id": "node_4",
+            "type": "human_takeover",
+            "messageToAgent": "User requested support.",
+            "connections": []
+        },
+        {
+            "id": "node_5",
+            "type": "wait",
+            "durationSeconds": 3600,
+            "connections": [{"targetNodeId": "node_6", "condition": None}]
+        },
+        {
+            "id": "node_6",
+            "type": "get_input",
+            "prompt": "Can I get your email for updates?",
+            "inputType": "email",
+            "saveToAttribute": "email",
+            "connections": [
+                {"targetNodeId": "node_7", "condition": {"type": "input_valid", "value": True}},
+                {"targetNodeId": "node_8", "condition": {"type": "input_valid", "value": False}}
+            ]
+        },
+        {
+            "id": "node_7",
+            "type": "message",
+            "content": {"text": "Thanks {{contact.firstName|there}}, you're on the list."},
+            "connections": []
+        },
+        {
+            "id": "node_8",
+            "type": "message",
+            "content": {"text": "That doesn't look like an email address."},
+            "connections": []
+        }
+    ]
+}
+
+class MemorySender:
+    """Stands in for instagram_api; optionally sleeps like a Graph API call."""
+
+    def __init__(self, latency_seconds: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.sent = 0
+
+    async def send_message(self, instagram_user_id: str, recipient_id: str, message: Dict[str, Any], access_token: str) -> Dict[str, Any]:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        self.sent += 1
+        return {"recipient_id": recipient_id, "message_id": f"m_{self.sent}"}
+
+    async def send_private_reply(self, instagram_user_id: str, comment_id: str, message: Dict[str, Any], access_token: str) -> Dict[str, Any]:
+        return await self.send_message(instagram_user_id, comment_id, message, access_token)
+
+class ClosedBreaker:
+    """Stands in for account_breaker: every account is healthy."""
+
+    async def check(self, account_id: Any) -> None:
+        return None
+
+    async def record_failure(self, account_id: Any) -> None:
+        pass
+
+    def record_success(self, account_id: Any) -> None:
+        pass
+
+class MemoryStateStore:
+    """Stands in for flow_state_store, serializing states as it would."""
+
+    def __init__(self):
+        self.hashes: Dict[Any, Dict[str, str]] = {}
+
+    async def load_many(self, contacts) -> Dict[Any, FlowState]:
+        return {
+            contact.id: (
+                FlowState.from_hash(contact.id, self.hashes[contact.id])
+                if contact.id in self.hashes else FlowState.from_contact(contact)
+            )
+            for contact in contacts
+        }
+
+    async def save_many(self, states) -> List[Any]:
+        for state in states:
+            state.version += 1
+            self.hashes[state.contact_id] = {**state.to_hash(), "v": str(state.version)}
+            state.mark_saved()
+        return []
+
+class MemorySession:
+    """
+    The part of AsyncSession the engine uses, over seeded objects. Each
+    call that would be a database round trip is counted.
+    """
+
+    def __init__(self, objects: Dict[Any, Any], counter: List[int]):
+        self.objects = objects
+        self.counter = counter
+
+    async def get(self, model: Any, ident: Any) -> Any:
+        self.counter[0] += 1
+        return self.objects.get((model, ident))
+
+    async def scalars(self, statement: Any) -> Any:
+        self.counter[0] += 1
+        entity = statement.column_descriptions[0]["entity"]
+        return _Result([obj for (model, _), obj in self.objects.items() if model is entity])
+
+    async def execute(self, statement: Any, params: Any = None) -> None:
+        self.counter[0] += 1
+
+    async def commit(self) -> None:
+        self.counter[0] += 1
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self) -> "MemorySession":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+class _Result:
+    def __init__(self, items: List[Any]):
+        self.items = items
+
+    def all(self) -> List[Any]:
+        return self.items
+
+class InstrumentedEngine(AutomationEngine):
+    """AutomationEngine recording the time spent per node type and in flush()."""
+
+    def __init__(self, db: Any, timings: Dict[str, List[float]], **kwargs):
+        super().__init__(db, **kwargs)
+        self.timings = timings
+
+    def _execute_node(self, account: InstagramAccount, contact: Contact, compiled_node: CompiledNode) -> None:
+        started = time.perf_counter()
+        super()._execute_node(account, contact, compiled_node)
+        self.timings.setdefault(compiled_node.type, []).append(time.perf_counter() - started)
+
+    async def flush(self) -> None:
+        started = time.perf_counter()
+        await super().flush()
+        self.timings.setdefault("flush", []).append(time.perf_counter() - started)
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class Simulation:
+    def __init__(self, args: argparse.Namespace, flow_definition: Dict[str, Any]):
+        self.args = args
+        self.flow_definition = flow_definition
+        self.random = random.Random(args.seed)
+        self.sender = MemorySender(args.send_latency_ms / 1000)
+        self.state_store = flow_state_store if args.redis else MemoryStateStore()
+        self.timings: Dict[str, List[float]] = {}
+        self.queries = [0]
+        self.events = 0
+        self.objects: Dict[Any, Any] = {}
+        self.session_factory = None
+        # Per contact: the node it waits on and the wait it should resume
+        self.node_ids: Dict[Any, Optional[str]] = {}
+        self.pending_jobs: Dict[Any, Dict[str, Any]] = {}
+
+    def _seed_objects(self) -> List[Any]:
+        user = User(
+            id=uuid.uuid4(),
+            email=f"simulator-{uuid.uuid4().hex[:12]}@example.com",
+            password_hash="!",
+            is_active=True
+        )
+        account = InstagramAccount(
+            id=uuid.uuid4(),
+            user_id=user.id,
+            instagram_page_id=f"sim_page_{uuid.uuid4().hex[:12]}",
+            instagram_user_id=f"sim_ig_{uuid.uuid4().hex[:12]}",
+            instagram_username="simulator",
+            access_token="simulated",
+            token_expires_at=datetime.utcnow() + timedelta(days=60),
+            status="connected"
+        )
+        flow = Flow(
+            id=uuid.uuid4(),
+            instagram_account_id=account.id,
+            name="Simulated flow",
+            flow_definition=self.flow_definition,
+            status=FlowStatus.ACTIVE,
+            updated_at=datetime.utcnow()
+        )
+        trigger = Trigger(
+            id=uuid.uuid4(),
+            flow_id=flow.id,
+            type=TriggerType.DM_KEYWORD,
+            keyword=self.args.keyword,
+            priority=0,
+            match_whole_word=False,
+            status=FlowStatus.ACTIVE
+        )
+        contacts = [
+            Contact(
+                id=uuid.uuid4(),
+                instagram_account_id=account.id,
+                instagram_user_id=f"sim_user_{index}",
+                instagram_username=f"sim_user_{index}",
+                first_name=self.random.choice(["Ada", "Grace", "Linus", None]),
+                tags=[],
+                custom_attributes={}
+            )
+            for index in range(self.args.contacts)
+        ]
+        self.account_id = account.id
+        self.flow_id = flow.id
+        self.contact_ids = [contact.id for contact in contacts]
+        return [user, account, flow, trigger, *contacts]
+
+    async def setup(self) -> None:
+        flow_cache.clear()
+        trigger_index.clear()
+        seeded = self._seed_objects()
+        if not self.args.database_url:
+            self.objects = {(type(obj), obj.id): obj for obj in seeded}
+            self.session_factory = lambda: MemorySession(self.objects, self.queries)
+            return
+
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        db_engine = create_async_engine(self.args.database_url, pool_size=self.args.concurrency)
+
+        @event.listens_for(db_engine.sync_engine, "before_cursor_execute")
+        def count_query(*_):
+            self.queries[0] += 1
+
+        @event.listens_for(db_engine.sync_engine, "commit")
+        def count_commit(*_):
+            self.queries[0] += 1
+
+        async with db_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self.session_factory = async_sessionmaker(db_engine, autoflush=False, expire_on_commit=False)
+        async with self.session_factory() as db:
+            for obj in seeded:
+                db.add(obj)
+                # Rows referenced by the next ones must exist first
+                await db.flush()
+            await db.commit()
+        self.queries[0] = 0
+
+    def _next_event(self, contact_id: Any) -> Dict[str, Any]:
+        """Pick what the contact does next, from the node it waits on."""
+        if contact_id in self.pending_jobs:
+            return {"resume": self.pending_jobs.pop(contact_id)}
+
+        node_id = self.node_ids.get(contact_id)
+        compiled = flow_cache.get(self.flow_id)
+        node = compiled.node(node_id) if compiled and node_id else None
+        if node is None:
+            return {"type": "text", "content": {"text": f"{self.args.keyword} there"}}
+        if "button_payload" in node.branches:
+            payload = self.random.choice(list(node.branches["button_payload"]))
+            return {"type": "button_response", "content": {"payload": payload}}
+        if node.type == "get_input":
+            valid = self.random.random() < 0.8
+            return {"type": "text", "content": {"text": "ada@example.com" if valid else "no thanks"}}
+        return {"type": "text", "content": {"text": "ok"}}
+
+    async def run_contact(self, contact_id: Any, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            for _ in range(self.args.events):
+                await self.run_event(contact_id, self._next_event(contact_id))
+
+    async def run_event(self, contact_id: Any, simulated: Dict[str, Any]) -> None:
+        async with self.session_factory() as db:
+            engine = InstrumentedEngine(
+                db, self.timings, sender=self.sender, state_store=self.state_store, breaker=ClosedBreaker()
+            )
+            if "resume" in simulated:
+                await engine.resume_flow(simulated["resume"])
+            else:
+                account = await db.get(InstagramAccount, self.account_id)
+                contact = await db.get(Contact, contact_id)
+                message = MessageLog(type=simulated["type"], content=simulated["content"])
+                if simulated["type"] == "button_response":
+                    await engine.process_postback(account, contact, message)
+                else:
+                    await engine.process_message(account, contact, message)
+                contact.last_interaction_at = datetime.utcnow()
+            await engine.flush()
+
+        # Wait nodes resume on the contact's next turn instead of after
+        # their duration
+        for job, _ in engine.scheduled_jobs:
+            self.pending_jobs[contact_id] = job
+        state = engine.states.get(contact_id)
+        self.node_ids[contact_id] = state.node_id if state else None
+        self.events += 1
+
+    async def run(self) -> Dict[str, Any]:
+        await self.setup()
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(self.run_contact(contact_id, semaphore) for contact_id in self.contact_ids))
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        nodes = {}
+        for name, values in sorted(self.timings.items()):
+            values = sorted(values)
+            nodes[name] = {
+                "count": len(values),
+                "p50_us": round(_percentile(values, 0.50) * 1e6, 1),
+                "p95_us": round(_percentile(values, 0.95) * 1e6, 1),
+                "p99_us": round(_percentile(values, 0.99) * 1e6, 1),
+            }
+        return {
+            "backend": "postgres" if self.args.database_url else "memory",
+            "state_store": "redis" if self.args.redis else "memory",
+            "contacts": self.args.contacts,
+            "events": self.events,
+            "messages_sent": self.sender.sent,
+            "elapsed_seconds": round(elapsed, 3),
+            "events_per_second": round(self.events / elapsed, 1) if elapsed else None,
+            "db_round_trips_per_event": round(self.queries[0] / self.events, 2) if self.events else None,
+            "nodes": nodes,
+        }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"backend: {report['backend']} (flow state: {report['state_store']})")
+    print(
+        f"{report['events']} events for {report['contacts']} contacts in {report['elapsed_seconds']}s: "
+        f"{report['events_per_second']} events/s, {report['messages_sent']} messages sent, "
+        f"{report['db_round_trips_per_event']} db round trips/event"
+    )
+    print(f"{'node':<16}{'count':>10}{'p50 us':>12}{'p95 us':>12}{'p99 us':>12}")
+    for name, stats in report["nodes"].items():
+        print(f"{name:<16}{stats['count']:>10}{stats['p50_us']:>12}{stats['p95_us']:>12}{stats['p99_us']:>12}")
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--flow", help="JSON file holding a flow_definition (default: the PRD sample flow)")
+    parser.add_argument("--keyword", default="hi", help="DM keyword that starts the flow")
+    parser.add_argument("--contacts", type=int, default=200)
+    parser.add_argument("--events", type=int, default=8, help="events per contact")
+    parser.add_argument("--concurrency", type=int, default=1, help="contacts simulated at once")
+    parser.add_argument("--send-latency-ms", type=float, default=0.0, help="simulated Graph API latency per send")
+    parser.add_argument("--database-url", help="postgresql+asyncpg:// URL of a scratch database")
+    parser.add_argument("--redis", action="store_true", help="keep flow state in the configured Redis")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+async def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    flow_definition = DEFAULT_FLOW_DEFINITION
+    if args.flow:
+        with open(args.flow) as f:
+            flow_definition = json.load(f)
+        # Accept a whole exported flow as well as just its definition
+        flow_definition = flow_definition.get("flow_definition", flow_definition)
+
+    report = await Simulation(args, flow_definition).run()
+    if args.json:
+        print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode("utf-8"))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
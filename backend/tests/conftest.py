@@ -0,0 +1,39 @@
+import os
+import fakeredis
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from app import models  # noqa: F401 (registers the tables on Base)
+from app.db.base_class import Base
+from app.services.redis_service import redis_service
+
+# A PostgreSQL database the tests may wipe, e.g.
+# postgresql+asyncpg://postgres@localhost/postgres
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+@pytest.fixture
+async def redis():
+    """An in-memory Redis (with Lua) behind the redis_service singleton."""
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    previous = redis_service.redis, redis_service._scripts
+    redis_service.redis, redis_service._scripts = client, {}
+    yield client
+    await client.flushall()
+    redis_service.redis, redis_service._scripts = previous
+
+@pytest.fixture
+async def db():
+    """A session on an empty schema of the TEST_DATABASE_URL database."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(TEST_DATABASE_URL)
+    try:
+        async with engine.begin() as connection:
+            # conversations and message_logs reference each other
+            await connection.execute(text("DROP SCHEMA public CASCADE"))
+            await connection.execute(text("CREATE SCHEMA public"))
+            await connection.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine, autoflush=False, expire_on_commit=False) as session:
+            yield session
+    finally:
+        await engine.dispose()
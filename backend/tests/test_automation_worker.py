@@ -0,0 +1,59 @@
+import orjson
+from app.services.job_lanes import lane_queue
+from app.worker.automation_worker import PartitionedExecutor, Worker
+
+async def _handle(job):
+    pass
+
+def _worker(max_lane_depth=100, fetch_batch_size=50):
+    worker = Worker(process_index=0, process_count=16)
+    # Lanes are not started, so what was fetched stays in their queues
+    worker.executor = PartitionedExecutor(worker.lanes, _handle, max_lane_depth)
+    worker.fetch_batch_size = fetch_batch_size
+    return worker
+
+async def _queue_jobs(redis, lane, count):
+    await redis.rpush(lane_queue(lane), *(orjson.dumps({"lane": lane, "n": n}) for n in range(count)))
+
+def _depths(worker):
+    return [worker.executor.queues[lane].qsize() for lane in worker.lanes]
+
+async def test_lanes_take_turns(redis):
+    worker = _worker(fetch_batch_size=1)
+    for lane in worker.lanes:
+        await _queue_jobs(redis, lane, 10)
+
+    for _ in worker.lanes:
+        await worker.process_queues()
+
+    # BLPOP took one job and LPOP one more, from a different lane each time
+    assert _depths(worker) == [2] * len(worker.lanes)
+
+async def test_full_lanes_stay_in_redis_without_blocking_others(redis):
+    worker = _worker(max_lane_depth=2)
+    first, second = worker.lanes[:2]
+    await _queue_jobs(redis, first, 5)
+    await _queue_jobs(redis, second, 5)
+
+    await worker.process_queues()
+    await worker.process_queues()
+
+    assert _depths(worker)[:2] == [2, 2]
+    assert await redis.llen(lane_queue(first)) == 3
+    assert worker.executor.stats[first]["full_skips"] > 0
+
+    # Every lane with jobs is full: nothing is popped
+    await worker.process_queues()
+    assert await redis.llen(lane_queue(second)) == 3
+
+async def test_jobs_of_a_lane_keep_their_order(redis):
+    worker = _worker(fetch_batch_size=3)
+    lane = worker.lanes[0]
+    await _queue_jobs(redis, lane, 7)
+
+    # One job and three more, then one and the last two
+    await worker.process_queues()
+    await worker.process_queues()
+
+    queue = worker.executor.queues[lane]
+    assert [queue.get_nowait()[1]["n"] for _ in range(queue.qsize())] == list(range(7))
@@ -0,0 +1,21 @@
+import uuid
+from types import SimpleNamespace
+from app.services.comment_triggers import CLAIM_KEY_PREFIX, CommentEvent, CommentMatch, CommentTriggerPipeline
+
+def _match(account, sender_id, media_id="media"):
+    event = CommentEvent("page", f"comment-{uuid.uuid4()}", media_id, sender_id, None, "price?")
+    return CommentMatch(event, account, rule=None)
+
+async def test_commenters_are_claimed_once_per_post(redis):
+    pipeline = CommentTriggerPipeline()
+    account = SimpleNamespace(id=uuid.uuid4())
+    first = [_match(account, "a"), _match(account, "b")]
+
+    assert await pipeline.claim(first) == first
+    again = _match(account, "a")
+    other_post = _match(account, "a", media_id="other")
+    assert await pipeline.claim([again, other_post]) == [other_post]
+    assert await redis.ttl(f"{CLAIM_KEY_PREFIX}:{account.id}:media:a") == pipeline.claim_ttl_seconds
+
+    await pipeline.release([again])
+    assert await pipeline.claim([again]) == [again]
@@ -0,0 +1,55 @@
+import uuid
+from datetime import datetime, timedelta
+from app.api.v1.endpoints import conversations
+from app.models import Contact, Conversation, InstagramAccount, MessageLog, User
+from app.schemas.message import MessageCreate
+
+async def test_create_message_sends_and_logs_it(db, monkeypatch):
+    user = User(id=uuid.uuid4(), email="owner@example.com", password_hash="x")
+    account = InstagramAccount(
+        id=uuid.uuid4(),
+        user_id=user.id,
+        instagram_page_id="page",
+        instagram_user_id="ig",
+        instagram_username="shop",
+        access_token="token",
+        token_expires_at=datetime.utcnow() + timedelta(days=60),
+        status="connected"
+    )
+    contact = Contact(
+        id=uuid.uuid4(),
+        instagram_account_id=account.id,
+        instagram_user_id="customer",
+        instagram_username="customer",
+        tags=[],
+        custom_attributes={}
+    )
+    conversation = Conversation(id=uuid.uuid4(), instagram_account_id=account.id, contact_id=contact.id)
+    db.add_all([user, account, contact, conversation])
+    await db.commit()
+    db.expunge_all()
+
+    sent = []
+
+    async def send_message(account, recipient_id, message):
+        sent.append((account.instagram_page_id, recipient_id, message))
+
+    monkeypatch.setattr(conversations.instagram_service, "send_message", send_message)
+    message = await conversations.create_message(
+        db=db,
+        current_user=user,
+        conversation_id=conversation.id,
+        message_in=MessageCreate(
+            direction="outbound",
+            type="text",
+            content={"text": "Hi!"},
+            instagram_account_id=account.id,
+            contact_id=contact.id
+        )
+    )
+
+    assert sent == [("page", "customer", {"text": "Hi!"})]
+    db.expunge_all()
+    logged = await db.get(MessageLog, message.id)
+    assert (logged.contact_id, logged.conversation_id, logged.direction) == (contact.id, conversation.id, "outbound")
+    assert (await db.get(Conversation, conversation.id)).last_message_id == message.id
@@ -0,0 +1,118 @@
+import orjson
+import pytest
+from app.services import delayed_jobs
+from app.services.delayed_jobs import (
+    DUE_KEY,
+    INFLIGHT_KEY,
+    LEGACY_DELAYED_KEY,
+    OWNERS_KEY,
+    PAYLOADS_KEY,
+    DelayedJobScheduler
+)
+from app.services.job_lanes import AUTOMATION_QUEUE, lane_for, lane_queue
+from app.services.timing_wheel import TimingWheel
+
+START_MS = 1_000_000_000
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [START_MS]
+    monkeypatch.setattr(delayed_jobs, "_now_ms", lambda: now[0])
+    return now
+
+def _scheduler(clock):
+    scheduler = DelayedJobScheduler()
+    scheduler.wheel = TimingWheel(tick_ms=scheduler.tick_ms, start_ms=clock[0])
+    return scheduler
+
+async def _run_due(scheduler, now_ms):
+    await scheduler.claim()
+    expired = scheduler.wheel.advance(now_ms)
+    return await scheduler.fire(expired) if expired else 0
+
+async def test_jobs_fire_onto_their_lane_when_due(redis, clock):
+    scheduler = _scheduler(clock)
+    job = {"type": "wait_complete", "account_id": "a1", "contact_id": "c1"}
+    job_id = await scheduler.schedule(job, delay_seconds=2)
+
+    assert await scheduler.claim() == 1
+    assert await redis.zcard(DUE_KEY) == 0
+    assert await redis.hget(OWNERS_KEY, job_id) == scheduler.owner
+
+    assert scheduler.wheel.advance(clock[0] + 1000) == []
+    assert await scheduler.fire(scheduler.wheel.advance(clock[0] + 2000)) == 1
+
+    queued = await redis.lrange(lane_queue(lane_for("c1")), 0, -1)
+    assert [orjson.loads(payload) for payload in queued] == [{**job, "job_id": job_id}]
+    assert not await redis.exists(INFLIGHT_KEY, OWNERS_KEY, PAYLOADS_KEY)
+
+async def test_jobs_without_a_contact_go_to_the_shared_queue(redis, clock):
+    scheduler = _scheduler(clock)
+    await scheduler.schedule({"type": "broadcast"}, delay_seconds=0)
+    assert await _run_due(scheduler, clock[0]) == 1
+    assert await redis.llen(AUTOMATION_QUEUE) == 1
+
+async def test_jobs_beyond_the_horizon_stay_due(redis, clock):
+    scheduler = _scheduler(clock)
+    await scheduler.schedule({"type": "later"}, delay_seconds=scheduler.horizon_ms / 1000 + 60)
+    assert await scheduler.claim() == 0
+    assert await redis.zcard(DUE_KEY) == 1
+
+async def test_cancelled_jobs_do_not_fire(redis, clock):
+    scheduler = _scheduler(clock)
+    job_id = await scheduler.schedule({"type": "wait_complete"}, delay_seconds=1)
+    assert await scheduler.cancel(job_id)
+    assert await _run_due(scheduler, clock[0] + 1000) == 0
+    assert await redis.llen(AUTOMATION_QUEUE) == 0
+
+async def test_a_job_fires_once_after_its_lease_was_taken_over(redis, clock):
+    stalled, other = _scheduler(clock), _scheduler(clock)
+    await stalled.schedule({"type": "wait_complete"}, delay_seconds=1)
+    assert await stalled.claim() == 1
+
+    clock[0] += 1000 + stalled.lease_ms
+    assert await other.reap() == 1
+    assert await other.claim() == 1
+    assert await other.fire(other.wheel.advance(clock[0])) == 1
+    # The stalled owner wakes up and must not fire it again
+    assert await stalled.fire(stalled.wheel.advance(clock[0])) == 0
+    assert await redis.llen(AUTOMATION_QUEUE) == 1
+
+async def test_release_returns_held_jobs_at_their_due_time(redis, clock):
+    scheduler = _scheduler(clock)
+    job_id = await scheduler.schedule({"type": "wait_complete"}, delay_seconds=3)
+    await scheduler.claim()
+
+    await scheduler.release()
+
+    assert await redis.zscore(DUE_KEY, job_id) == clock[0] + 3000
+    assert not await redis.exists(INFLIGHT_KEY, OWNERS_KEY)
+    assert await redis.hexists(PAYLOADS_KEY, job_id)
+
+async def test_drain_legacy_moves_old_jobs_with_stable_ids(redis, clock):
+    scheduler = _scheduler(clock)
+    scheduler.claim_batch_size = 2
+    legacy = [
+        {"type": "wait_complete", "job_id": "kept"},
+        {"type": "wait_complete", "contact_id": "c1"},
+        {"type": "wait_complete", "contact_id": "c2"},
+    ]
+    await redis.zadd(LEGACY_DELAYED_KEY, {
+        orjson.dumps(job).decode("utf-8"): 1_000_000 + index for index, job in enumerate(legacy)
+    })
+
+    assert await scheduler.drain_legacy() == 3
+
+    assert not await redis.exists(LEGACY_DELAYED_KEY)
+    due = await redis.zrange(DUE_KEY, 0, -1, withscores=True)
+    assert [score for _, score in due] == [1_000_000_000, 1_000_001_000, 1_000_002_000]
+    assert due[0][0] == "kept"
+    assert all(job_id.startswith("legacy:") for job_id, _ in due[1:])
+    payloads = await redis.hgetall(PAYLOADS_KEY)
+    assert {orjson.loads(payload)["job_id"] for payload in payloads.values()} == set(payloads)
+
+async def test_drain_legacy_waits_for_the_lock(redis, clock):
+    await redis.zadd(LEGACY_DELAYED_KEY, {orjson.dumps({"type": "x"}).decode("utf-8"): 1})
+    await redis.set(f"lock:{LEGACY_DELAYED_KEY}", "someone else")
+    assert await _scheduler(clock).drain_legacy() == 0
+    assert await redis.zcard(LEGACY_DELAYED_KEY) == 1
@@ -0,0 +1,102 @@
+import uuid
+from types import SimpleNamespace
+from app.services.flow_compiler import CompiledGraph, CompiledNode, GraphCache, definition_hash
+from app.services.flow_state import FlowState
+
+def _contact(**fields):
+    return SimpleNamespace(**{
+        "first_name": None, "last_name": None, "instagram_username": None, "custom_attributes": {}, **fields
+    })
+
+def _state(context=None, tags=()):
+    return FlowState(uuid.uuid4(), uuid.uuid4(), "node", dict(context or {}), list(tags))
+
+def _text(text):
+    return SimpleNamespace(type="text", content={"text": text})
+
+def _button(payload):
+    return SimpleNamespace(type="button_response", content={"payload": payload})
+
+def _connection(target, condition=None):
+    return {"targetNodeId": target, **({"condition": condition} if condition else {})}
+
+def _next(node, message=None, contact=None, state=None):
+    return node.next_target(contact or _contact(), state or _state(), message)
+
+def test_button_payloads_pick_their_branch():
+    node = CompiledNode({"id": "ask", "type": "message", "content": {"text": "Pick"}, "connections": [
+        _connection("yes", {"type": "button_payload", "value": "YES"}),
+        _connection("no", {"type": "button_payload", "value": "NO"}),
+        _connection("again", {"type": "button_payload", "value": "YES"}),
+        _connection("fallback"),
+    ]})
+    assert node.branches == {"button_payload": {"YES": "yes", "NO": "no"}}
+    assert _next(node, _button("NO")) == "no"
+    assert _next(node, _button("YES")) == "yes"
+    assert _next(node, _button("MAYBE")) == "fallback"
+    # Text that happens to equal a payload is not a button press
+    assert _next(node, _text("NO")) == "fallback"
+
+def test_input_valid_branches_follow_the_input_type():
+    node = CompiledNode({"id": "email", "type": "get_input", "inputType": "email", "connections": [
+        _connection("thanks", {"type": "input_valid", "value": True}),
+        _connection("retry", {"type": "input_valid", "value": False}),
+    ]})
+    assert _next(node, _text(" me@example.com ")) == "thanks"
+    assert _next(node, _text("not an email")) == "retry"
+    assert _next(node) is None
+
+def test_conditions_are_tried_in_connection_order():
+    node = CompiledNode({"id": "route", "type": "condition", "connections": [
+        _connection("vip", {"type": "attribute_equals", "attribute": "tags", "value": "vip"}),
+        _connection("pricing", {"type": "keyword", "value": "price, cost"}),
+        _connection("plan", {"type": "attribute_equals", "attribute": "custom.plan", "value": 2}),
+        _connection("named", {"type": "attribute_equals", "attribute": "contact.firstName", "value": "Ana"}),
+        _connection("context", {"type": "attribute_equals", "attribute": "flow.step", "value": "done"}),
+        _connection("default"),
+        _connection("unreachable", {"type": "keyword", "value": "anything"}),
+    ]})
+    assert len(node.conditions) == 5
+    assert _next(node, _text("what is the PRICE?"), state=_state(tags=["vip"])) == "vip"
+    assert _next(node, _text("what is the PRICE?")) == "pricing"
+    assert _next(node, _text("priceless")) == "default"
+    assert _next(node, contact=_contact(custom_attributes={"plan": "2"})) == "plan"
+    assert _next(node, contact=_contact(first_name="Ana")) == "named"
+    assert _next(node, state=_state(context={"step": "done"})) == "context"
+    assert _next(node, _text("anything")) == "default"
+
+def test_unknown_and_empty_conditions_are_skipped():
+    node = CompiledNode({"id": "n", "type": "condition", "connections": [
+        _connection("never", {"type": "keyword", "value": " , "}),
+        _connection("missing", {"type": "attribute_equals", "value": "x"}),
+        _connection("other", {"type": "something_new"}),
+    ]})
+    assert node.conditions == []
+    assert node.default_target is None
+    assert _next(node, _text("x")) is None
+
+def test_message_nodes_precompile_their_content():
+    node = CompiledNode({"id": "hi", "type": "message", "content": {"text": "Hi {{contact.firstName}}"}})
+    assert node.render_content is not None
+    assert CompiledNode({"id": "wait", "type": "delay"}).render_content is None
+
+def test_graphs_are_shared_by_content():
+    definition = {"startNodeId": "a", "nodes": [{"id": "a", "type": "message", "content": {"text": "x"}}]}
+    reordered = {"nodes": definition["nodes"], "startNodeId": "a"}
+    cache = GraphCache(max_size=1)
+
+    graph = cache.get_or_compile(definition)
+    assert isinstance(graph, CompiledGraph)
+    assert graph.content_hash == definition_hash(definition)
+    assert cache.get_or_compile(reordered) is graph
+    assert graph.node("a").id == "a" and graph.node("missing") is None
+
+    cache.get_or_compile({**definition, "startNodeId": "b", "nodes": []})
+    assert cache.get_or_compile(definition) is not graph
+
+def test_versions_keep_their_graph():
+    cache = GraphCache(max_size=2)
+    version = SimpleNamespace(id=uuid.uuid4(), content_hash=None, flow_definition={"startNodeId": "a", "nodes": []})
+    graph = cache.add_version(version)
+    assert cache.for_version(version.id) is graph
+    assert cache.for_version(uuid.uuid4()) is None
@@ -0,0 +1,189 @@
+import uuid
+import pytest
+from app.services import flow_state
+from app.services.automation import AutomationEngine
+from app.services.flow_state import (
+    CLAIM_SCRIPT,
+    DIRTY_KEY,
+    FLUSHING_KEY,
+    STATE_KEY_PREFIX,
+    FlowState,
+    FlowStateStore
+)
+from app.services.redis_service import redis_service
+
+class RecordingSession:
+    """Stands in for AsyncSessionLocal(), keeping the rows flushed."""
+
+    def __init__(self, writes, on_execute=None):
+        self.writes = writes
+        self.on_execute = on_execute
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, rows):
+        self.writes.extend(rows)
+        if self.on_execute:
+            await self.on_execute()
+
+    async def commit(self):
+        pass
+
+@pytest.fixture
+def writes(monkeypatch):
+    writes = []
+    monkeypatch.setattr(flow_state, "AsyncSessionLocal", lambda: RecordingSession(writes))
+    return writes
+
+def _state(node_id="n1", tags=()):
+    return FlowState(uuid.uuid4(), uuid.uuid4(), node_id, {"step": 1}, list(tags))
+
+async def test_flush_writes_dirty_states_once(redis, writes):
+    store = FlowStateStore()
+    states = [_state(), _state()]
+    await store.save_many(states)
+    assert await redis.zcard(DIRTY_KEY) == 2
+    assert await redis.ttl(f"{STATE_KEY_PREFIX}{states[0].contact_id}") == -1
+
+    assert await store.flush() == 2
+
+    assert {row["contact_id"] for row in writes} == {state.contact_id for state in states}
+    assert writes[0]["context"] == {"step": 1}
+    assert not await redis.exists(DIRTY_KEY, FLUSHING_KEY)
+    assert await redis.ttl(f"{STATE_KEY_PREFIX}{states[0].contact_id}") == store.ttl_seconds
+    assert await store.flush() == 0
+
+async def test_a_change_during_the_write_stays_dirty(redis, writes, monkeypatch):
+    store = FlowStateStore()
+    state = _state()
+    await store.save_many([state])
+
+    async def change_again():
+        state.node_id = "n2"
+        await store.save_many([state])
+    monkeypatch.setattr(flow_state, "AsyncSessionLocal", lambda: RecordingSession(writes, change_again))
+    await store.flush()
+
+    key = f"{STATE_KEY_PREFIX}{state.contact_id}"
+    assert await redis.zscore(DIRTY_KEY, str(state.contact_id)) is not None
+    assert await redis.ttl(key) == -1
+
+    monkeypatch.setattr(flow_state, "AsyncSessionLocal", lambda: RecordingSession(writes))
+    await store.flush()
+    assert [row["node_id"] for row in writes] == ["n1", "n2"]
+    assert await redis.ttl(key) == store.ttl_seconds
+
+async def test_claim_skips_contacts_leased_to_another_flusher(redis):
+    state = _state()
+    await FlowStateStore().save_many([state])
+    keys = [DIRTY_KEY, FLUSHING_KEY, f"{STATE_KEY_PREFIX}{state.contact_id}"]
+
+    first = await redis_service.eval_script(CLAIM_SCRIPT, keys, [1000, 60000, str(state.contact_id)])
+    second = await redis_service.eval_script(CLAIM_SCRIPT, keys, [1000, 60000, str(state.contact_id)])
+
+    assert first[0] == str(state.contact_id)
+    assert dict(zip(first[1][::2], first[1][1::2]))["node"] == "n1"
+    assert second == []
+    assert await redis.zscore(FLUSHING_KEY, str(state.contact_id)) == 61000
+
+async def test_leases_of_dead_flushers_are_reaped(redis):
+    state = _state()
+    store = FlowStateStore()
+    await store.save_many([state])
+    keys = [DIRTY_KEY, FLUSHING_KEY, f"{STATE_KEY_PREFIX}{state.contact_id}"]
+    await redis_service.eval_script(CLAIM_SCRIPT, keys, [0, 1, str(state.contact_id)])
+
+    assert await store.reap() == 1
+    assert await redis.zcard(FLUSHING_KEY) == 0
+    assert await redis.zcard(DIRTY_KEY) == 1
+
+async def test_expired_states_are_acked_without_a_write(redis, writes):
+    store = FlowStateStore()
+    state = _state()
+    await store.save_many([state])
+    await redis.delete(f"{STATE_KEY_PREFIX}{state.contact_id}")
+
+    assert await store.flush() == 1
+    assert writes == []
+    assert not await redis.exists(DIRTY_KEY, FLUSHING_KEY)
+
+async def test_states_round_trip_and_tags_merge(redis):
+    store = FlowStateStore()
+    state = _state(tags=["a"])
+    await store.save_many([state])
+    assert not state.is_changed()
+
+    await store.add_tags(state.contact_id, ["b", "a"])
+    contact = type("Contact", (), {"id": state.contact_id})()
+    loaded = (await store.load_many([contact]))[state.contact_id]
+
+    assert (loaded.flow_id, loaded.node_id, loaded.context) == (state.flow_id, "n1", {"step": 1})
+    assert loaded.tags == ["a", "b"]
+
+async def test_states_saved_meanwhile_are_not_overwritten(redis):
+    store = FlowStateStore()
+    state = _state()
+    await store.save_many([state])
+    contact = type("Contact", (), {"id": state.contact_id})()
+    first, second = [(await store.load_many([contact]))[state.contact_id] for _ in range(2)]
+
+    first.node_id = "n2"
+    assert await store.save_many([first]) == []
+    second.node_id = "n3"
+    assert await store.save_many([second]) == [state.contact_id]
+
+    assert second.is_changed()
+    loaded = (await store.load_many([contact]))[state.contact_id]
+    assert (loaded.node_id, loaded.version) == ("n2", 2)
+
+async def test_saves_keep_tags_added_meanwhile(redis):
+    store = FlowStateStore()
+    state = _state(tags=["a"])
+    await store.save_many([state])
+
+    await store.add_tags(state.contact_id, ["b"])
+    state.tags = ["a", "c"]
+    assert await store.save_many([state]) == []
+
+    contact = type("Contact", (), {"id": state.contact_id})()
+    assert (await store.load_many([contact]))[state.contact_id].tags == ["a", "c", "b"]
+
+async def test_added_tags_are_flushed(redis, writes):
+    store = FlowStateStore()
+    state = _state(tags=["a"])
+    await store.save_many([state])
+    await store.flush()
+    writes.clear()
+
+    await store.add_tags(state.contact_id, ["b"])
+    key = f"{STATE_KEY_PREFIX}{state.contact_id}"
+    assert await redis.ttl(key) == -1
+
+    assert await store.flush() == 1
+    assert writes[0]["state_tags"] == ["a", "b"]
+    assert await redis.ttl(key) == store.ttl_seconds
+
+async def test_tags_of_uncached_states_are_not_journaled(redis):
+    await FlowStateStore().add_tags(uuid.uuid4(), ["a"])
+    assert not await redis.exists(DIRTY_KEY)
+
+async def test_engine_saves_states_only_after_the_commit(redis):
+    class FailingSession:
+        async def execute(self, statement):
+            pass
+
+        async def commit(self):
+            raise RuntimeError("commit failed")
+
+    store = FlowStateStore()
+    engine = AutomationEngine(FailingSession(), state_store=store)
+    state = _state()
+    engine.states[state.contact_id] = state
+
+    with pytest.raises(RuntimeError):
+        await engine.flush()
+    assert not await redis.exists(DIRTY_KEY, f"{STATE_KEY_PREFIX}{state.contact_id}")
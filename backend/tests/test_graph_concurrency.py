@@ -0,0 +1,116 @@
+import asyncio
+import orjson
+from app.services import graph_concurrency as graph_concurrency_module
+from app.services.graph_concurrency import (
+    APP_USAGE_HEADER,
+    BUSINESS_USAGE_HEADER,
+    AdaptiveLimit,
+    GraphConcurrencyController
+)
+
+def _business_usage(percent, regain_minutes=0):
+    return orjson.dumps({"page": [{
+        "type": "messenger", "call_count": percent, "total_cputime": 1, "total_time": 1,
+        "estimated_time_to_regain_access": regain_minutes
+    }]}).decode("utf-8")
+
+def test_limits_grow_by_one_per_window_of_calls_while_saturated():
+    limit = AdaptiveLimit(4, min_limit=1, max_limit=6)
+    limit.in_flight = 3
+    # +1/limit per call: a window of about `limit` calls adds one
+    for _ in range(3):
+        limit.increase()
+    assert int(limit.limit) == 4
+    for _ in range(2):
+        limit.increase()
+    assert int(limit.limit) == 5
+
+    # Not the bottleneck: no growth
+    limit.in_flight = 0
+    for _ in range(20):
+        limit.increase()
+    assert int(limit.limit) == 5
+
+    limit.in_flight = 5
+    for _ in range(50):
+        limit.increase()
+    assert limit.limit == 6
+
+def test_limits_halve_once_per_interval_down_to_the_minimum():
+    limit = AdaptiveLimit(16, min_limit=3, max_limit=64)
+    limit.decrease(0.5, interval=60)
+    limit.decrease(0.5, interval=60)
+    assert limit.limit == 8
+
+    for _ in range(5):
+        limit.decrease(0.5, interval=0)
+    assert limit.limit == 3
+
+async def test_acquire_waits_for_a_free_slot():
+    limit = AdaptiveLimit(1, min_limit=1, max_limit=2)
+    await limit.acquire()
+    waiter = asyncio.ensure_future(limit.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    limit.release()
+    await asyncio.wait_for(waiter, 1)
+    assert limit.in_flight == 1
+
+async def test_a_raised_limit_wakes_waiters():
+    limit = AdaptiveLimit(1, min_limit=1, max_limit=2)
+    await limit.acquire()
+    waiter = asyncio.ensure_future(limit.acquire())
+    await asyncio.sleep(0)
+
+    limit.increase()
+    await asyncio.wait_for(waiter, 1)
+    assert limit.in_flight == 2
+
+def test_usage_above_the_target_backs_off_and_low_usage_grows():
+    controller = GraphConcurrencyController()
+    controller.decrease_interval = 0
+    account = controller._account("page")
+    start = account.limit
+
+    controller.observe("page", 200, {BUSINESS_USAGE_HEADER: _business_usage(95)})
+    assert account.limit == start * controller.backoff
+    assert account.usage == 95
+
+    account.in_flight = int(account.limit)
+    controller.observe("page", 200, {BUSINESS_USAGE_HEADER: _business_usage(10)})
+    assert account.limit > start * controller.backoff
+
+    app_limit = controller.app.limit
+    controller.observe(None, 200, {APP_USAGE_HEADER: orjson.dumps({"call_count": 99}).decode("utf-8")})
+    assert controller.app.limit == app_limit * controller.backoff
+
+def test_throttling_and_server_errors_back_off():
+    controller = GraphConcurrencyController()
+    controller.decrease_interval = 0
+    account = controller._account("page")
+    start = account.limit
+
+    controller.observe("page", 400, {}, throttled=True)
+    controller.observe("page", None, {})
+    assert account.limit == max(account.min_limit, start * controller.backoff ** 2)
+    assert (account.throttled, account.errors) == (1, 1)
+
+def test_blocked_accounts_report_when_they_regain_access():
+    controller = GraphConcurrencyController()
+    controller.observe("page", 200, {BUSINESS_USAGE_HEADER: _business_usage(100, regain_minutes=2)})
+    assert 100 < controller.blocked_for("page") <= 120
+    assert controller.blocked_for("other") == 0
+
+def test_idle_accounts_beyond_the_cap_are_forgotten(monkeypatch):
+    monkeypatch.setattr(graph_concurrency_module.settings, "GRAPH_CONCURRENCY_MAX_ACCOUNTS", 4)
+    controller = GraphConcurrencyController()
+    controller._account("busy").in_flight = 1
+    controller.observe("blocked", 200, {BUSINESS_USAGE_HEADER: _business_usage(100, regain_minutes=5)})
+    controller._account("used")
+    controller._account("unused")
+    controller._account("used")
+
+    controller._account("new")
+
+    assert list(controller.accounts) == ["busy", "blocked", "used", "new"]
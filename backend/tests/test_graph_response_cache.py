@@ -0,0 +1,93 @@
+import asyncio
+import orjson
+import pytest
+from app.services.graph_client import InstagramAPIError
+from app.services.graph_response_cache import CACHE_KEY_PREFIX, NOT_FOUND, GraphResponseCache
+
+async def test_concurrent_misses_share_one_fetch(redis):
+    cache = GraphResponseCache()
+    calls = []
+    release = asyncio.Event()
+
+    async def fetch():
+        calls.append(1)
+        await release.wait()
+        return {"id": "1", "username": "ana"}
+
+    waiting = [asyncio.ensure_future(cache.get_or_fetch("profile", "page:1", fetch)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiting) == [{"id": "1", "username": "ana"}] * 5
+    assert calls == [1]
+    assert cache.stats["coalesced"] == 4
+    assert orjson.loads(await redis.get(f"{CACHE_KEY_PREFIX}:profile:page:1")) == {"id": "1", "username": "ana"}
+
+async def test_a_failed_fetch_fails_every_waiter_and_is_not_cached(redis):
+    cache = GraphResponseCache()
+    release = asyncio.Event()
+
+    async def fetch():
+        await release.wait()
+        raise InstagramAPIError("Server error", status_code=500)
+
+    waiting = [asyncio.ensure_future(cache.get_or_fetch("profile", "page:1", fetch)) for _ in range(2)]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*waiting, return_exceptions=True)
+    assert all(isinstance(result, InstagramAPIError) for result in results)
+    assert await cache.get("profile", "page:1") is None
+
+async def test_not_found_is_cached_for_the_negative_ttl(redis):
+    cache = GraphResponseCache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        raise InstagramAPIError("No such user", status_code=404)
+
+    for _ in range(2):
+        with pytest.raises(InstagramAPIError) as error:
+            await cache.get_or_fetch("profile", "page:gone", fetch)
+        assert error.value.status_code == 404
+
+    assert calls == [1]
+    key = f"{CACHE_KEY_PREFIX}:profile:page:gone"
+    assert orjson.loads(await redis.get(key)) == NOT_FOUND
+    assert 0 < await redis.ttl(key) <= cache.negative_ttl_seconds
+
+async def test_the_local_tier_evicts_the_least_recently_used(redis):
+    cache = GraphResponseCache()
+    cache.max_local_entries = 2
+    for key in ("a", "b"):
+        await cache.put("profile", key, {"id": key})
+    await cache.get("profile", "a")
+    await cache.put("profile", "c", {"id": "c"})
+
+    assert cache._get_local(f"{CACHE_KEY_PREFIX}:profile:b") is None
+    assert cache._get_local(f"{CACHE_KEY_PREFIX}:profile:a") == {"id": "a"}
+    # Still in Redis
+    assert await cache.get("profile", "b") == {"id": "b"}
+    assert cache.stats["redis_hits"] == 1
+
+async def test_get_many_reads_what_is_not_local_with_one_mget(redis, monkeypatch):
+    shared = GraphResponseCache()
+    await shared.put_many("profile", {"a": {"id": "a"}, "b": NOT_FOUND})
+    cache = GraphResponseCache()
+    await cache.put("profile", "c", {"id": "c"})
+    reads = []
+    mget = redis.mget
+
+    async def counting_mget(keys, *args):
+        reads.append(list(keys))
+        return await mget(keys, *args)
+
+    monkeypatch.setattr(redis, "mget", counting_mget)
+
+    assert await cache.get_many("profile", ["a", "b", "c", "d"]) == {"a": {"id": "a"}, "b": NOT_FOUND, "c": {"id": "c"}}
+    assert reads == [[f"{CACHE_KEY_PREFIX}:profile:{key}" for key in ("a", "b", "d")]]
+    # Kept locally from now on
+    assert await cache.get_many("profile", ["a", "b"]) == {"a": {"id": "a"}, "b": NOT_FOUND}
+    assert len(reads) == 1
+    assert 0 < await redis.ttl(f"{CACHE_KEY_PREFIX}:profile:b") <= cache.negative_ttl_seconds
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+from app.services.message_templates import MessageTemplate, compile_content
+
+def _contact(**fields):
+    return SimpleNamespace(**{
+        "first_name": None, "last_name": None, "instagram_username": "ana.s", "custom_attributes": {}, **fields
+    })
+
+def test_templates_split_into_literals_and_variables():
+    template = MessageTemplate("Hi {{contact.firstName|there}}, your code is {{ flow.code }}!")
+
+    assert not template.is_static
+    assert [segment for segment in template.segments if isinstance(segment, str)] == ["Hi ", ", your code is ", "!"]
+    assert template.render(_contact(first_name="Ana"), {"code": 42}) == "Hi Ana, your code is 42!"
+    assert template.render(_contact(), {}) == "Hi there, your code is !"
+
+def test_variables_read_contact_custom_and_flow_values():
+    contact = _contact(first_name="Ana", last_name="Silva", custom_attributes={"plan": "pro"})
+    template = MessageTemplate("{{contact.fullName}} (@{{contact.username}}) on {{custom.plan}} {{custom.seats|1}}")
+    assert template.render(contact, {}) == "Ana Silva (@ana.s) on pro 1"
+
+def test_unknown_placeholders_stay_literal():
+    source = "{{ a {{contact.firstName}} {{unknown.field}} {{contact.nope}} {{ open"
+    template = MessageTemplate(source)
+    assert template.render(_contact(first_name="Ana"), {}) == "{{ a Ana {{unknown.field}} {{contact.nope}} {{ open"
+
+    static = MessageTemplate("No {{variables}} here")
+    assert static.is_static
+    assert static.render(_contact(), {}) is static.source
+
+def test_static_content_is_shared_between_renders():
+    content = {"text": "Pick one", "quick_replies": [{"title": "Yes", "payload": "YES"}]}
+    render, is_static = compile_content(content)
+
+    assert is_static
+    assert render(_contact(), {}) is content
+
+def test_dynamic_content_renders_fresh_structures_with_shared_static_parts():
+    buttons = [{"title": "Shop", "url": "https://example.com"}]
+    content = {"text": "Hi {{contact.firstName}}", "buttons": buttons, "count": 3}
+    render, is_static = compile_content(content)
+
+    first = render(_contact(first_name="Ana"), {})
+    second = render(_contact(first_name="Bo"), {})
+
+    assert not is_static
+    assert first == {"text": "Hi Ana", "buttons": buttons, "count": 3}
+    assert second["text"] == "Hi Bo"
+    assert first is not second
+    assert first["buttons"] is buttons and second["buttons"] is buttons
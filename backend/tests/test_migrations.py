@@ -0,0 +1,34 @@
+import importlib.util
+import pathlib
+import subprocess
+import sys
+import textwrap
+from app.services.flow_compiler import definition_hash
+
+VERSIONS_DIR = pathlib.Path(__file__).resolve().parent.parent / "alembic" / "versions"
+
+def _load_migration(name):
+    spec = importlib.util.spec_from_file_location(name, VERSIONS_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_flow_versions_migration_does_not_import_app():
+    # Run in a fresh interpreter, this one already imported the app
+    script = textwrap.dedent(f"""
+        import importlib.util, sys
+        spec = importlib.util.spec_from_file_location("m", {str(VERSIONS_DIR / "006_add_flow_versions.py")!r})
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+        assert not [name for name in sys.modules if name == "app" or name.startswith("app.")]
+    """)
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+def test_flow_versions_migration_hashes_like_the_app():
+    migration = _load_migration("006_add_flow_versions")
+    definitions = [
+        {},
+        {"nodes": [{"id": "start", "type": "trigger"}], "connections": []},
+        {"b": [1, 2.5, None, True], "a": {"text": "Привет 👋", "z": "", "y": "\"quoted\"\n"}},
+    ]
+    for definition in definitions:
+        assert migration.definition_hash(definition) == definition_hash(definition)
@@ -0,0 +1,141 @@
+import uuid
+from types import SimpleNamespace
+import orjson
+import pytest
+from app.core.config import settings
+from app.services import instagram
+from app.services.instagram import instagram_api
+from app.services import profile_enrichment
+from app.services.profile_enrichment import (
+    PROFILE_ENRICHMENT_ATTEMPTS,
+    PROFILE_ENRICHMENT_QUEUE,
+    claim_profile_enrichment_batch,
+    clear_profile_enrichment_attempts,
+    enqueue_profile_enrichment,
+    retry_profile_enrichment
+)
+from app.worker import profile_enrichment_worker
+from app.worker.profile_enrichment_worker import ProfileEnrichmentWorker
+
+async def test_claims_take_the_oldest_due_contacts(redis):
+    await enqueue_profile_enrichment(["a", "b", "c"])
+    assert await claim_profile_enrichment_batch(2, timeout_seconds=0) == ["a", "b"]
+    assert await claim_profile_enrichment_batch(2, timeout_seconds=0) == ["c"]
+    assert await claim_profile_enrichment_batch(2, timeout_seconds=0) == []
+
+async def test_retries_wait_for_a_growing_backoff(redis, monkeypatch):
+    delays = []
+    monkeypatch.setattr(profile_enrichment, "retry_delay", lambda attempt: delays.append(attempt) or 60 * attempt)
+    await retry_profile_enrichment(["a"])
+
+    assert await claim_profile_enrichment_batch(10, timeout_seconds=0) == []
+    await redis.zadd(PROFILE_ENRICHMENT_QUEUE, {"a": 0})
+    assert await claim_profile_enrichment_batch(10, timeout_seconds=0) == ["a"]
+    await retry_profile_enrichment(["a"])
+    assert delays == [1, 2]
+
+async def test_contacts_are_given_up_after_the_last_attempt(redis):
+    for _ in range(settings.PROFILE_ENRICHMENT_MAX_ATTEMPTS - 1):
+        assert await retry_profile_enrichment(["a"]) == []
+        await redis.zrem(PROFILE_ENRICHMENT_QUEUE, "a")
+
+    assert await retry_profile_enrichment(["a"]) == ["a"]
+    assert await redis.zcard(PROFILE_ENRICHMENT_QUEUE) == 0
+    assert not await redis.hexists(PROFILE_ENRICHMENT_ATTEMPTS, "a")
+
+async def test_successful_lookups_reset_the_attempts(redis):
+    await retry_profile_enrichment(["a", "b"])
+    await clear_profile_enrichment_attempts(["a"])
+    assert await redis.hgetall(PROFILE_ENRICHMENT_ATTEMPTS) == {"b": "1"}
+
+async def test_the_worker_requeues_a_batch_that_failed(redis, monkeypatch):
+    worker = ProfileEnrichmentWorker()
+
+    async def enrich(contact_ids):
+        raise RuntimeError("database unavailable")
+
+    async def pause(seconds):
+        worker.stop()
+
+    async def close():
+        pass
+
+    monkeypatch.setattr(worker, "enrich", enrich)
+    monkeypatch.setattr(profile_enrichment_worker.asyncio, "sleep", pause)
+    monkeypatch.setattr(profile_enrichment_worker.instagram_api, "close", close)
+    await enqueue_profile_enrichment(["a", "b"])
+
+    await worker.start()
+
+    assert await redis.zrange(PROFILE_ENRICHMENT_QUEUE, 0, -1) == ["a", "b"]
+    assert await redis.hgetall(PROFILE_ENRICHMENT_ATTEMPTS) == {"a": "1", "b": "1"}
+
+class EnrichmentSession:
+    """Stands in for AsyncSessionLocal(): returns rows, keeps the updates."""
+
+    def __init__(self, rows, updates):
+        self.rows = rows
+        self.updates = updates
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, params=None):
+        if params is not None:
+            self.updates.extend(params)
+        return SimpleNamespace(all=lambda: self.rows)
+
+    async def commit(self):
+        pass
+
+@pytest.fixture
+def batch_responses(monkeypatch):
+    """Answers of the next Graph API batch, and the batches requested."""
+    answers = []
+    batches = []
+
+    async def batch(requests, access_token, account_key=None):
+        batches.append([request["relative_url"].split("?")[0] for request in requests])
+        return answers.pop(0)
+
+    async def acquire(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(instagram_api, "batch", batch)
+    monkeypatch.setattr(instagram.graph_rate_limiter, "acquire", acquire)
+    return answers, batches
+
+def _profile(user_id):
+    return {"code": 200, "body": orjson.dumps({"id": user_id, "username": f"name-{user_id}"}).decode("utf-8")}
+
+async def test_batch_lookups_report_the_users_that_failed(redis, batch_responses):
+    answers, batches = batch_responses
+    page_id = f"page-{uuid.uuid4()}"
+    answers.append([_profile("found"), {"code": 404, "body": "{}"}, None, {"code": 500, "body": "{}"}])
+
+    profiles, failed = await instagram_api.get_user_profiles(["found", "gone", "timeout", "error"], "token", page_id)
+
+    assert list(profiles) == ["found"]
+    assert failed == ["timeout", "error"]
+    # Found and not found users are cached, failed ones are looked up again
+    answers.append([_profile("timeout"), _profile("error")])
+    profiles, failed = await instagram_api.get_user_profiles(["found", "gone", "timeout", "error"], "token", page_id)
+    assert batches[-1] == ["timeout", "error"]
+    assert sorted(profiles) == ["error", "found", "timeout"]
+    assert failed == []
+
+async def test_contacts_whose_lookup_failed_are_retried(redis, batch_responses, monkeypatch):
+    answers, _ = batch_responses
+    answers.append([_profile("ok"), None])
+    updates = []
+    page_id = f"page-{uuid.uuid4()}"
+    rows = [("contact-ok", "ok", page_id, "token"), ("contact-timeout", "timeout", page_id, "token")]
+    monkeypatch.setattr(profile_enrichment_worker, "AsyncSessionLocal", lambda: EnrichmentSession(rows, updates))
+
+    failed = await ProfileEnrichmentWorker().enrich(["contact-ok", "contact-timeout"])
+
+    assert failed == ["contact-timeout"]
+    assert [update["contact_id"] for update in updates] == ["contact-ok"]
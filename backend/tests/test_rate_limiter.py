@@ -0,0 +1,69 @@
+import pytest
+from app.services.rate_limiter import MESSAGING, PROFILE, GraphRateLimiter, RateLimitTimeout
+
+# Slow enough that the real clock fakeredis runs on refills nothing
+# noticeable during a test
+SLOW = 0.001
+
+@pytest.fixture
+def limiter():
+    limiter = GraphRateLimiter()
+    limiter.enabled = True
+    limiter.limits = {
+        MESSAGING: ((SLOW, 3), (SLOW, 5)),
+        PROFILE: ((SLOW, 2), (SLOW, 10)),
+    }
+    return limiter
+
+async def test_takes_from_the_account_and_the_app_bucket(redis, limiter):
+    assert await limiter._take(MESSAGING, "acct", 1) == [0, 2, 4]
+    assert await limiter._take(MESSAGING, "acct", 2) == [0, 0, 2]
+
+async def test_an_empty_bucket_returns_the_wait(redis, limiter):
+    await limiter._take(MESSAGING, "acct", 3)
+    wait_ms, account_tokens, app_tokens = await limiter._take(MESSAGING, "acct", 1)
+    # One token at SLOW tokens per second
+    assert wait_ms == pytest.approx(1 / SLOW * 1000, rel=0.01)
+    assert (account_tokens, app_tokens) == (0, 2)
+
+async def test_nothing_is_taken_unless_every_bucket_has_enough(redis, limiter):
+    await limiter._take(MESSAGING, "a", 3)
+    await limiter._take(MESSAGING, "b", 2)
+    # The app bucket has 0 left; account c keeps its tokens
+    assert (await limiter._take(MESSAGING, "c", 1))[0] > 0
+    assert await limiter._take(MESSAGING, "c", 0) == [0, 3, 0]
+
+async def test_accounts_and_kinds_have_separate_buckets(redis, limiter):
+    await limiter._take(MESSAGING, "a", 3)
+    assert (await limiter._take(MESSAGING, "b", 1))[0] == 0
+    assert (await limiter._take(PROFILE, "a", 1))[0] == 0
+
+async def test_a_cost_above_capacity_waits_for_a_full_bucket(redis, limiter):
+    assert await limiter._take(PROFILE, "acct", 4) == [0, -2, 6]
+    assert (await limiter._take(PROFILE, "acct", 1))[0] > 0
+
+async def test_tokens_refill_over_time(redis, limiter):
+    limiter.limits[MESSAGING] = ((1000.0, 3), (1000.0, 5))
+    await limiter._take(MESSAGING, "acct", 3)
+    wait_ms, _, _ = await limiter._take(MESSAGING, "acct", 1)
+    assert wait_ms <= 1
+
+async def test_acquire_gives_up_at_the_deadline(redis, limiter):
+    await limiter.acquire(MESSAGING, "acct", cost=3)
+    with pytest.raises(RateLimitTimeout):
+        await limiter.acquire(MESSAGING, "acct", timeout=0.01)
+    stats = limiter.get_stats()[MESSAGING]
+    assert (stats["acquired"], stats["timeouts"]) == (1, 1)
+
+async def test_remaining_reports_both_buckets(redis, limiter):
+    await limiter.acquire(PROFILE, "acct")
+    budgets = await limiter.remaining("acct")
+    assert budgets[PROFILE] == {"account": 1, "app": 9}
+    assert budgets[MESSAGING] == {"account": 3, "app": 5}
+
+async def test_calls_go_through_when_redis_fails(redis, limiter, monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("down")
+    monkeypatch.setattr("app.services.rate_limiter.redis_service.eval_script", unavailable)
+    await limiter.acquire(MESSAGING, "acct")
+    assert limiter.get_stats()[MESSAGING]["errors"] == 1
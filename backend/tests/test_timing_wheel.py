@@ -0,0 +1,54 @@
+import random
+import pytest
+from app.services.timing_wheel import TimingWheel
+
+def test_timers_expire_at_their_tick():
+    wheel = TimingWheel(tick_ms=10, wheel_size=4, levels=2)
+    wheel.add(35, "a")
+    wheel.add(5, "b")
+    assert len(wheel) == 2
+
+    assert wheel.advance(29) == ["b"]
+    assert wheel.advance(30) == ["a"]
+    assert len(wheel) == 0
+
+def test_due_timers_expire_on_next_advance():
+    wheel = TimingWheel(tick_ms=10, start_ms=1000)
+    wheel.add(500, "late")
+    assert wheel.advance(1000) == ["late"]
+
+def test_timers_cascade_from_higher_levels():
+    wheel = TimingWheel(tick_ms=1, wheel_size=4, levels=3)
+    # Beyond level 0 (4 ticks) and level 1 (16 ticks)
+    wheel.add(37, "far")
+    wheel.add(9, "near")
+
+    assert wheel.advance(8) == []
+    assert wheel.advance(9) == ["near"]
+    assert wheel.advance(36) == []
+    assert wheel.advance(37) == ["far"]
+
+def test_timers_beyond_the_span_are_rejected():
+    wheel = TimingWheel(tick_ms=1, wheel_size=4, levels=2)
+    wheel.add(15, "last")
+    with pytest.raises(ValueError):
+        wheel.add(16, "too far")
+
+def test_random_timers_expire_in_order_and_never_early():
+    generator = random.Random(7)
+    wheel = TimingWheel(tick_ms=5, wheel_size=8, levels=3, start_ms=100)
+    due = {f"t{index}": 100 + generator.randrange(5 * 8 ** 3) for index in range(500)}
+    for item, due_ms in due.items():
+        wheel.add(due_ms, item)
+
+    now = 100
+    expired = {}
+    while len(wheel):
+        now += generator.randrange(1, 40)
+        for item in wheel.advance(now):
+            expired[item] = now
+    assert expired.keys() == due.keys()
+    for item, expired_ms in expired.items():
+        # Never before its tick, and on the first advance that reached it
+        assert expired_ms // 5 >= due[item] // 5
+        assert expired_ms - due[item] < 40 + 5
@@ -0,0 +1,135 @@
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+from app.models.instagram_account import InstagramAccount
+from app.services import token_refresh
+from app.services.graph_client import InstagramAPIError
+from app.services.resilience import TOKEN_EXPIRED, account_breaker
+from app.services.token_refresh import TokenRefreshSweeper
+
+@compiles(UUID, "sqlite")
+def _uuid_on_sqlite(type_, compiler, **kw):
+    return "CHAR(32)"
+
+@pytest.fixture
+async def sessions(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(InstagramAccount.__table__.create)
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        monkeypatch.setattr(token_refresh, "AsyncSessionLocal", sessions)
+        yield sessions
+    finally:
+        await engine.dispose()
+
+@pytest.fixture
+def refreshed(monkeypatch):
+    """Page ids refreshed, in order; pages starting with `revoked` fail."""
+    calls = []
+
+    async def refresh_access_token(account):
+        calls.append(account.instagram_page_id)
+        if account.instagram_page_id.startswith("revoked"):
+            raise InstagramAPIError("Token revoked", status_code=400, response={"error": {"code": 190}})
+        return f"new-{account.instagram_page_id}", datetime(2030, 1, 1)
+
+    monkeypatch.setattr(token_refresh.instagram_service, "refresh_access_token", refresh_access_token)
+    return calls
+
+async def _add_accounts(sessions, *accounts):
+    async with sessions() as db:
+        for page_id, expires_in, status in accounts:
+            db.add(InstagramAccount(
+                id=uuid.uuid4(),
+                user_id=uuid.uuid4(),
+                instagram_page_id=page_id,
+                instagram_user_id=f"user-{page_id}",
+                instagram_username=page_id,
+                access_token="old",
+                token_expires_at=datetime.utcnow() + expires_in,
+                status=status
+            ))
+        await db.commit()
+
+async def _accounts(sessions):
+    async with sessions() as db:
+        return {account.instagram_page_id: account for account in (await db.scalars(select(InstagramAccount))).all()}
+
+async def test_due_times_spread_over_the_first_half_of_the_window():
+    sweeper = TokenRefreshSweeper()
+    expires_at = datetime(2030, 1, 1)
+    due = [sweeper.due_at(uuid.uuid4(), expires_at) for _ in range(200)]
+    assert all(expires_at - sweeper.window <= at <= expires_at - sweeper.window / 2 for at in due)
+    assert max(due) - min(due) > sweeper.window / 4
+    account_id = uuid.uuid4()
+    assert sweeper.due_at(account_id, expires_at) == sweeper.due_at(account_id, expires_at)
+
+async def test_sweep_refreshes_due_connected_accounts(redis, sessions, refreshed):
+    await _add_accounts(
+        sessions,
+        ("expired", timedelta(days=-1), "connected"),
+        ("soon", timedelta(hours=1), "connected"),
+        ("later", timedelta(days=60), "connected"),
+        ("disconnected", timedelta(hours=1), "disconnected"),
+        ("broken", timedelta(days=-5), "error"),
+    )
+
+    assert await TokenRefreshSweeper().sweep() == 2
+
+    assert sorted(refreshed) == ["expired", "soon"]
+    accounts = await _accounts(sessions)
+    assert accounts["soon"].access_token == "new-soon"
+    assert accounts["soon"].token_expires_at == datetime(2030, 1, 1)
+    assert accounts["later"].access_token == "old"
+
+async def test_accounts_in_error_do_not_take_the_batch(redis, sessions, refreshed):
+    # Expired the longest, so first in token_expires_at order
+    await _add_accounts(sessions, *((f"broken{index}", timedelta(days=-30), "error") for index in range(3)))
+    await _add_accounts(sessions, ("due", timedelta(hours=1), "connected"))
+    sweeper = TokenRefreshSweeper()
+    sweeper.batch_size = 1
+
+    assert await sweeper.sweep() == 1
+    assert refreshed == ["due"]
+
+async def test_rejected_tokens_put_their_account_in_error(redis, sessions, refreshed):
+    await _add_accounts(sessions, ("revoked", timedelta(hours=1), "connected"))
+    sweeper = TokenRefreshSweeper()
+
+    assert await sweeper.sweep() == 0
+    assert (await _accounts(sessions))["revoked"].status == "error"
+    # Left out of every later sweep
+    assert await sweeper.sweep() == 0
+    assert refreshed == ["revoked"]
+
+async def test_a_refresh_closes_the_breaker_of_its_account(redis, sessions, refreshed):
+    await _add_accounts(sessions, ("soon", timedelta(hours=1), "connected"))
+    account = (await _accounts(sessions))["soon"]
+    await account_breaker.open(account.id, TOKEN_EXPIRED)
+
+    assert await TokenRefreshSweeper().sweep() == 1
+    assert await account_breaker.check(account.id) is None
+    assert await account_breaker.token_expired_accounts() == []
+
+async def test_breakers_of_reconnected_accounts_are_closed(redis, sessions, refreshed):
+    await _add_accounts(sessions, ("revoked", timedelta(hours=1), "connected"))
+    account = (await _accounts(sessions))["revoked"]
+    sweeper = TokenRefreshSweeper()
+    await sweeper.sweep()
+    assert await account_breaker.check(account.id) == TOKEN_EXPIRED
+
+    # Still in error: the breaker stays open
+    assert await sweeper.close_reconnected_breakers() == 0
+    assert await account_breaker.check(account.id) == TOKEN_EXPIRED
+
+    async with sessions() as db:
+        (await db.get(InstagramAccount, account.id)).status = "connected"
+        await db.commit()
+    assert await sweeper.close_reconnected_breakers() == 1
+    assert await account_breaker.check(account.id) is None
+    assert await account_breaker.token_expired_accounts() == []
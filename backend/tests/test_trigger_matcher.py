@@ -0,0 +1,87 @@
+import random
+from app.models.flow import TriggerType
+from app.services.trigger_matcher import AccountTriggerMatcher, KeywordAutomaton, TriggerRule, post_key
+
+def _rule(trigger_id, keyword=None, type=TriggerType.DM_KEYWORD, priority=0, whole_word=False, post=None):
+    return TriggerRule(trigger_id, f"flow-{trigger_id}", type, keyword, priority, whole_word, post)
+
+def test_automaton_finds_overlapping_keywords():
+    automaton = KeywordAutomaton([("he", "he"), ("she", "she"), ("his", "his"), ("hers", "hers")])
+    matches = sorted(automaton.iter_matches("ushers"))
+    assert matches == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+def test_automaton_agrees_with_naive_search():
+    generator = random.Random(3)
+    keywords = {"".join(generator.choice("ab") for _ in range(generator.randint(1, 4))) for _ in range(12)}
+    automaton = KeywordAutomaton((keyword, keyword) for keyword in keywords)
+    for _ in range(50):
+        text = "".join(generator.choice("abc") for _ in range(30))
+        expected = sorted(
+            (start, start + len(keyword), keyword)
+            for keyword in keywords
+            for start in range(len(text))
+            if text.startswith(keyword, start)
+        )
+        assert sorted(automaton.iter_matches(text)) == expected
+
+def test_dm_matching_is_case_insensitive_and_splits_keywords():
+    matcher = AccountTriggerMatcher([_rule(1, "Price, COST")])
+    assert matcher.match_dm("what is the cost?").trigger_id == 1
+    assert matcher.match_dm("PRICE please").trigger_id == 1
+    assert matcher.match_dm("hello") is None
+    assert matcher.match_dm("") is None
+
+def test_priority_then_length_then_position_wins():
+    matcher = AccountTriggerMatcher([
+        _rule("short", "info"),
+        _rule("long", "more info"),
+        _rule("late", "later"),
+        _rule("urgent", "help", priority=5),
+    ])
+    assert matcher.match_dm("more info").trigger_id == "long"
+    assert matcher.match_dm("more info, help").trigger_id == "urgent"
+    assert matcher.match_dm("info later").trigger_id == "late"
+
+def test_whole_word_rules_skip_partial_words():
+    matcher = AccountTriggerMatcher([_rule(1, "hi", whole_word=True)])
+    assert matcher.match_dm("this") is None
+    assert matcher.match_dm("oh hi!").trigger_id == 1
+    assert matcher.match_dm("hi_there") is None
+
+def test_comment_rules_are_scoped_to_their_post():
+    matcher = AccountTriggerMatcher([
+        _rule("any", "link", type=TriggerType.COMMENT_KEYWORD),
+        _rule("post", "link", type=TriggerType.COMMENT_KEYWORD, priority=1, post="https://www.instagram.com/reel/Abc/"),
+        _rule("media", "guide", type=TriggerType.COMMENT_KEYWORD, post="17900"),
+        _rule("dm", "guide"),
+    ])
+    assert matcher.has_permalink_rules
+    assert matcher.match_comment("link pls").trigger_id == "any"
+    assert matcher.match_comment("link pls", permalink="instagram.com/p/Abc").trigger_id == "post"
+    assert matcher.match_comment("guide", media_id="17900").trigger_id == "media"
+    assert matcher.match_comment("guide", media_id="17901") is None
+
+def test_post_keys_compare_permalink_variants_equal():
+    assert post_key("https://www.instagram.com/reel/Abc/?igsh=x") == "instagram.com/p/Abc"
+    assert post_key("instagram.com/tv/Abc") == "instagram.com/p/Abc"
+    assert post_key(" 17900 ") == "17900"
+
+def test_welcome_and_story_mention_rules_by_priority():
+    matcher = AccountTriggerMatcher([
+        _rule("welcome-low", type=TriggerType.WELCOME_MESSAGE),
+        _rule("welcome-high", type=TriggerType.WELCOME_MESSAGE, priority=2),
+        _rule("story", type=TriggerType.STORY_MENTION),
+    ])
+    assert matcher.welcome_rule.trigger_id == "welcome-high"
+    assert matcher.story_mention_rule.trigger_id == "story"
+
+def test_rebuild_reuses_unchanged_automata():
+    dm = _rule(1, "price")
+    comment = _rule(2, "link", type=TriggerType.COMMENT_KEYWORD)
+    previous = AccountTriggerMatcher([dm, comment])
+
+    matcher = AccountTriggerMatcher([dm, comment._replace(keyword="url")], previous=previous)
+
+    assert matcher._automata[TriggerType.DM_KEYWORD] is previous._automata[TriggerType.DM_KEYWORD]
+    assert matcher._automata[TriggerType.COMMENT_KEYWORD] is not previous._automata[TriggerType.COMMENT_KEYWORD]
+    assert matcher.match_comment("url?").trigger_id == 2
@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+import orjson
+import pytest
+from app.core.config import settings
+from app.services.resilience import DEAD_LETTER_STREAM
+from app.services.webhook_stream import stream_key
+from app.worker import webhook_consumer
+from app.worker.webhook_consumer import WebhookConsumer
+
+STREAM = stream_key(0)
+
+class NoSession:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+@pytest.fixture
+def processed(monkeypatch):
+    """Names of the payloads processed, in order; `fail` lists those to fail."""
+    processed = SimpleNamespace(names=[], fail={})
+
+    async def process_webhook_payload(db, payload):
+        name = payload["name"]
+        processed.names.append(name)
+        if processed.fail.get(name, 0):
+            processed.fail[name] -= 1
+            raise RuntimeError(f"{name} failed")
+        return SimpleNamespace(scheduled_jobs=[], new_contact_ids=[])
+
+    monkeypatch.setattr(webhook_consumer, "process_webhook_payload", process_webhook_payload)
+    monkeypatch.setattr(webhook_consumer, "AsyncSessionLocal", NoSession)
+    monkeypatch.setattr(webhook_consumer, "retry_delay", lambda attempt: 0)
+    return processed
+
+async def _consumer(**kwargs):
+    consumer = WebhookConsumer(partitions=[0], **kwargs)
+    await consumer.setup()
+    return consumer
+
+async def _publish(redis, *names):
+    for name in names:
+        await redis.xadd(STREAM, {"body": orjson.dumps({"name": name, "entry": []}).decode("utf-8")})
+
+async def _drain(consumer, rounds):
+    # The first round of a fresh consumer reads its (empty) pending list
+    for _ in range(rounds):
+        await consumer.consume()
+
+async def _pending(redis):
+    return (await redis.xpending(STREAM, settings.WEBHOOK_CONSUMER_GROUP))["pending"]
+
+def test_partitions_are_split_between_consumers():
+    streams = [
+        set(WebhookConsumer(consumer_index=index, consumer_count=3).streams)
+        for index in range(3)
+    ]
+    assert set.union(*streams) == {stream_key(partition) for partition in range(settings.WEBHOOK_STREAM_PARTITIONS)}
+    assert sum(map(len, streams)) == settings.WEBHOOK_STREAM_PARTITIONS
+    assert WebhookConsumer(consumer_index=1, consumer_count=3).consumer_name == "consumer-1"
+
+async def test_entries_are_processed_and_acked_in_order(redis, processed):
+    consumer = await _consumer()
+    await _publish(redis, "a", "b", "c")
+
+    await _drain(consumer, 2)
+
+    assert processed.names == ["a", "b", "c"]
+    assert await _pending(redis) == 0
+
+async def test_a_failed_entry_is_retried_before_what_follows(redis, processed):
+    consumer = await _consumer()
+    await _publish(redis, "a", "b", "c")
+    processed.fail["b"] = 2
+
+    await _drain(consumer, 6)
+
+    assert processed.names == ["a", "b", "b", "b", "c"]
+    assert await _pending(redis) == 0
+    assert not consumer.attempts
+
+async def test_entries_failing_every_attempt_are_dead_lettered(redis, processed):
+    consumer = await _consumer()
+    consumer.max_attempts = 2
+    await _publish(redis, "a", "b")
+    processed.fail["a"] = 10
+
+    await _drain(consumer, 5)
+
+    assert processed.names == ["a", "a", "b"]
+    assert await _pending(redis) == 0
+    [(_, fields)] = await redis.xrange(DEAD_LETTER_STREAM)
+    assert fields["reason"] == "retries_exhausted"
+    assert orjson.loads(fields["job"])["type"] == "webhook"
+
+async def test_entries_abandoned_by_other_consumers_are_claimed(redis, processed):
+    consumer = await _consumer()
+    consumer.claim_min_idle_ms = 0
+    await _publish(redis, "a", "b")
+    # A consumer of an older deployment read them and went away
+    await redis.xreadgroup(settings.WEBHOOK_CONSUMER_GROUP, "old-host-123", {STREAM: ">"}, count=10)
+
+    assert await consumer.claim_abandoned() == 2
+    await _drain(consumer, 2)
+
+    assert processed.names == ["a", "b"]
+    assert await _pending(redis) == 0
+
+async def test_recently_read_entries_are_not_claimed(redis, processed):
+    consumer = await _consumer()
+    await _publish(redis, "a")
+    await redis.xreadgroup(settings.WEBHOOK_CONSUMER_GROUP, "consumer-1", {STREAM: ">"}, count=10)
+    assert await consumer.claim_abandoned() == 0
+
+async def test_a_replayed_entry_is_not_taken_for_a_duplicate(redis, processed):
+    consumer = await _consumer()
+    entry = {"id": "page", "messaging": [{"sender": {"id": "1"}, "message": {"mid": "m1"}}]}
+    await redis.xadd(STREAM, {"body": orjson.dumps({"name": "a", "entry": [entry]}).decode("utf-8")})
+    processed.fail["a"] = 1
+
+    await _drain(consumer, 3)
+
+    assert processed.names == ["a", "a"]
+    assert await _pending(redis) == 0
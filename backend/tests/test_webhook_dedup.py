@@ -0,0 +1,82 @@
+from app.services.webhook_dedup import WebhookDeduplicator
+
+def _message(mid):
+    return {"sender": {"id": "1"}, "recipient": {"id": "2"}, "message": {"mid": mid, "text": "hi"}}
+
+def _comment(comment_id):
+    return {"field": "comments", "value": {"id": comment_id, "text": "hi"}}
+
+def _payload(*messaging, changes=()):
+    return {"object": "instagram", "entry": [{"id": "2", "messaging": list(messaging), "changes": list(changes)}]}
+
+def _mids(payload):
+    return [event["message"]["mid"] for entry in payload["entry"] for event in entry["messaging"]]
+
+async def test_first_delivery_is_kept(redis):
+    payload = _payload(_message("m1"), _message("m2"))
+    assert await WebhookDeduplicator().drop_duplicates(payload) == payload
+
+async def _process(deduplicator, payload):
+    payload = await deduplicator.drop_duplicates(payload)
+    await deduplicator.mark_seen(payload)
+    return payload
+
+async def test_redelivered_events_are_dropped(redis):
+    deduplicator = WebhookDeduplicator()
+    await _process(deduplicator, _payload(_message("m1"), changes=[_comment("c1")]))
+
+    result = await deduplicator.drop_duplicates(
+        _payload(_message("m1"), _message("m2"), changes=[_comment("c1"), _comment("c2")])
+    )
+
+    assert _mids(result) == ["m2"]
+    assert result["entry"][0]["changes"] == [_comment("c2")]
+
+async def test_events_are_not_seen_until_marked(redis):
+    deduplicator = WebhookDeduplicator()
+    payload = _payload(_message("m1"))
+    # Processing failed or the process died before the commit
+    await deduplicator.drop_duplicates(payload)
+
+    assert _mids(await deduplicator.drop_duplicates(payload)) == ["m1"]
+
+async def test_repeats_within_one_payload_are_dropped(redis):
+    result = await WebhookDeduplicator().drop_duplicates(_payload(_message("m1"), _message("m1")))
+    assert _mids(result) == ["m1"]
+
+async def test_events_without_ids_are_kept(redis):
+    read = {"sender": {"id": "1"}, "read": {"watermark": 1}}
+    payload = _payload(read, read)
+    assert await WebhookDeduplicator().drop_duplicates(payload) == payload
+
+async def test_previous_bucket_still_counts(redis, monkeypatch):
+    deduplicator = WebhookDeduplicator()
+    clock = [1_000_000.0]
+    monkeypatch.setattr("app.services.webhook_dedup.time.time", lambda: clock[0])
+    await _process(deduplicator, _payload(_message("m1")))
+
+    clock[0] += deduplicator.window_seconds
+    assert _mids(await deduplicator.drop_duplicates(_payload(_message("m1")))) == []
+    clock[0] += 2 * deduplicator.window_seconds
+    assert _mids(await deduplicator.drop_duplicates(_payload(_message("m1")))) == ["m1"]
+
+async def test_stats_count_duplicates(redis):
+    deduplicator = WebhookDeduplicator()
+    await _process(deduplicator, _payload(_message("m1"), _message("m2")))
+    await _process(deduplicator, _payload(_message("m1")))
+
+    stats = await deduplicator.get_stats(hours=1)
+    assert (stats["total_events"], stats["duplicate_events"]) == (3, 1)
+
+async def test_redis_failure_keeps_the_payload(redis, monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("down")
+    monkeypatch.setattr("app.services.webhook_dedup.redis_service.eval_script", unavailable)
+    payload = _payload(_message("m1"))
+    assert await WebhookDeduplicator().drop_duplicates(payload) == payload
+
+async def test_marking_failures_are_only_logged(redis, monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("down")
+    monkeypatch.setattr("app.services.webhook_dedup.redis_service.redis.pipeline", unavailable)
+    await WebhookDeduplicator().mark_seen(_payload(_message("m1")))
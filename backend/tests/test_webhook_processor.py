@@ -0,0 +1,161 @@
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app.models import Contact, Conversation, Flow, InstagramAccount, MessageLog, Trigger, User
+from app.models.flow import FlowStatus, TriggerType
+from app.services.instagram import instagram_api
+from app.services.webhook_processor import process_webhook_payload
+
+@pytest.fixture
+def sent(monkeypatch):
+    """(recipient id, message) of every message the flows sent."""
+    messages = []
+
+    async def send_message(instagram_user_id, recipient_id, message, access_token):
+        messages.append((recipient_id, message))
+
+    monkeypatch.setattr(instagram_api, "send_message", send_message)
+    return messages
+
+@pytest.fixture
+async def account(db):
+    user = User(id=uuid.uuid4(), email=f"{uuid.uuid4()}@example.com", password_hash="x")
+    account = InstagramAccount(
+        id=uuid.uuid4(),
+        user_id=user.id,
+        instagram_page_id=f"page-{uuid.uuid4()}",
+        instagram_user_id=f"ig-{uuid.uuid4()}",
+        instagram_username="shop",
+        access_token="token",
+        token_expires_at=datetime.utcnow() + timedelta(days=60),
+        status="connected"
+    )
+    db.add_all([user, account])
+    await db.commit()
+    return account
+
+async def _add_welcome_flow(db, account):
+    flow = Flow(
+        id=uuid.uuid4(),
+        instagram_account_id=account.id,
+        name="Welcome",
+        flow_definition={
+            "startNodeId": "hello",
+            "nodes": [{"id": "hello", "type": "message", "content": {"text": "Welcome!"}, "connections": []}]
+        },
+        status=FlowStatus.ACTIVE
+    )
+    db.add(flow)
+    await db.flush()
+    db.add(Trigger(flow_id=flow.id, type=TriggerType.WELCOME_MESSAGE))
+    await db.commit()
+
+def _payload(account, sender_id, *texts):
+    return {"object": "instagram", "entry": [{"id": account.instagram_page_id, "messaging": [
+        {
+            "sender": {"id": sender_id},
+            "recipient": {"id": account.instagram_page_id},
+            "timestamp": 1700000000000 + index,
+            "message": {"mid": f"mid-{uuid.uuid4()}", "text": text}
+        }
+        for index, text in enumerate(texts)
+    ]}]}
+
+async def _contact(db, account, sender_id):
+    return await db.scalar(
+        select(Contact)
+        .where(Contact.instagram_account_id == account.id, Contact.instagram_user_id == sender_id)
+        .execution_options(populate_existing=True)
+    )
+
+async def test_first_dm_gets_the_welcome_flow_once(redis, db, account, sent):
+    await _add_welcome_flow(db, account)
+
+    await process_webhook_payload(db, _payload(account, "sender", "hi", "anyone there?"))
+    await process_webhook_payload(db, _payload(account, "sender", "hello again"))
+
+    assert sent == [("sender", {"text": "Welcome!"})]
+    assert (await _contact(db, account, "sender")).last_interaction_at is not None
+
+async def test_commenters_get_the_welcome_flow_on_their_first_dm(redis, db, account, sent):
+    await _add_welcome_flow(db, account)
+    # As the comment trigger pipeline leaves a commenter it upserted
+    db.add(Contact(
+        instagram_account_id=account.id,
+        instagram_user_id="commenter",
+        instagram_username="commenter",
+        tags=[],
+        custom_attributes={}
+    ))
+    await db.commit()
+
+    result = await process_webhook_payload(db, _payload(account, "commenter", "hi"))
+
+    assert sent == [("commenter", {"text": "Welcome!"})]
+    assert result.new_contact_ids == []
+    assert (await _contact(db, account, "commenter")).last_interaction_at is not None
+
+def _messaging(account, sender_id, mid, text="hi"):
+    return {
+        "sender": {"id": sender_id},
+        "recipient": {"id": account.instagram_page_id},
+        "timestamp": 1700000000000,
+        "message": {"mid": mid, "text": text}
+    }
+
+async def _rows(db, model, *where):
+    db.expunge_all()
+    return (await db.scalars(select(model).where(*where))).all()
+
+async def test_senders_are_upserted_and_only_new_ones_reported(redis, db, account, sent):
+    first = await process_webhook_payload(db, {"entry": [{"id": account.instagram_page_id, "messaging": [
+        _messaging(account, "a", "mid-a1"),
+        _messaging(account, "b", "mid-b1"),
+        _messaging(account, "a", "mid-a2"),
+    ]}]})
+    contacts = {contact.instagram_user_id: contact for contact in await _rows(db, Contact)}
+    assert sorted(contacts) == ["a", "b"]
+    assert sorted(first.new_contact_ids) == sorted(contact.id for contact in contacts.values())
+
+    second = await process_webhook_payload(db, {"entry": [{"id": account.instagram_page_id, "messaging": [
+        _messaging(account, "a", "mid-a3"),
+        _messaging(account, "c", "mid-c1"),
+    ]}]})
+    contacts = {contact.instagram_user_id: contact for contact in await _rows(db, Contact)}
+    # xmax tells the row inserted for c from the one updated for a
+    assert second.new_contact_ids == [contacts["c"].id]
+    assert len(contacts) == 3
+
+async def test_one_open_conversation_per_contact_tracks_the_last_message(redis, db, account, sent):
+    await process_webhook_payload(db, {"entry": [{"id": account.instagram_page_id, "messaging": [
+        _messaging(account, "a", "mid-1", "first"),
+        _messaging(account, "a", "mid-2", "second"),
+    ]}]})
+    await process_webhook_payload(db, _payload(account, "a", "third"))
+
+    conversations = await _rows(db, Conversation)
+    assert len(conversations) == 1
+    last = await db.get(MessageLog, conversations[0].last_message_id)
+    assert last.content == {"text": "third"}
+    logs = await _rows(db, MessageLog, MessageLog.conversation_id == conversations[0].id)
+    assert sorted(log.content["text"] for log in logs) == ["first", "second", "third"]
+
+async def test_redelivered_messages_are_logged_once(redis, db, account, sent):
+    await _add_welcome_flow(db, account)
+    payload = {"entry": [{"id": account.instagram_page_id, "messaging": [_messaging(account, "a", "mid-1")]}]}
+
+    await process_webhook_payload(db, payload)
+    # Same mid again, e.g. the webhook was retried: no second log, no flow
+    await process_webhook_payload(db, payload)
+
+    assert len(await _rows(db, MessageLog, MessageLog.instagram_message_id == "mid-1")) == 1
+    assert sent == [("a", {"text": "Welcome!"})]
+
+async def test_events_of_unknown_accounts_are_ignored(redis, db, account, sent):
+    result = await process_webhook_payload(db, {"entry": [{"id": "unknown-page", "messaging": [
+        _messaging(account, "a", "mid-1")
+    ]}]})
+
+    assert result.new_contact_ids == []
+    assert await _rows(db, Contact) == []
@@ -0,0 +1,30 @@
+import hashlib
+import hmac
+from app.api.v1.endpoints import webhooks
+from app.api.v1.endpoints.webhooks import verify_signature
+
+BODY = b'{"object":"instagram","entry":[]}'
+
+def _sign(body, secret="app-secret"):
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+def test_a_signature_of_the_raw_body_is_accepted(monkeypatch):
+    monkeypatch.setattr(webhooks.settings, "INSTAGRAM_APP_SECRET", "app-secret")
+    assert verify_signature(BODY, _sign(BODY))
+
+def test_bad_signatures_are_rejected(monkeypatch):
+    monkeypatch.setattr(webhooks.settings, "INSTAGRAM_APP_SECRET", "app-secret")
+    assert not verify_signature(BODY, _sign(BODY, secret="other-secret"))
+    # Signed before a byte of the body changed, e.g. re-serialized JSON
+    assert not verify_signature(BODY + b" ", _sign(BODY))
+    assert not verify_signature(BODY, _sign(BODY).replace("sha256=", "sha1="))
+    assert not verify_signature(BODY, "sha256=")
+
+def test_a_missing_header_is_rejected(monkeypatch):
+    monkeypatch.setattr(webhooks.settings, "INSTAGRAM_APP_SECRET", "app-secret")
+    assert not verify_signature(BODY, None)
+    assert not verify_signature(BODY, "")
+
+def test_nothing_is_accepted_without_an_app_secret(monkeypatch):
+    monkeypatch.setattr(webhooks.settings, "INSTAGRAM_APP_SECRET", None)
+    assert not verify_signature(BODY, _sign(BODY))